@@ -0,0 +1,116 @@
+import collections
+from dataclasses import dataclass
+from quiz_db import Answer
+import threading
+import time
+from typing import Deque, Dict, Iterable, List, Optional
+
+
+@dataclass
+class AnswerTrace:
+    """Wall clock times in seconds of the stages an answer goes through, None for stages not reached yet."""
+    quiz_id: str
+    question: int
+    team_id: int
+    # Date of the Telegram message, which has a resolution of one second.
+    sent: float
+    # The dispatcher called the answer handler.
+    received: float
+    # The answer has been committed to the database, update_id is 0 if it was outdated.
+    committed: Optional[float] = None
+    update_id: Optional[int] = None
+    # Dashboards waiting for updates have been woken up.
+    notified: Optional[float] = None
+    # The first response carrying the answer has been written to a dashboard.
+    delivered: Optional[float] = None
+
+    def breakdown(self) -> Dict[str, Optional[float]]:
+        """Milliseconds spent in every stage, None for stages not reached yet."""
+        stages = [self.sent, self.received, self.committed, self.notified, self.delivered]
+        names = ['telegram', 'write', 'notify', 'deliver']
+        breakdown = {}
+        for name, start, end in zip(names, stages, stages[1:]):
+            breakdown[name] = 1000 * (end - start) if start is not None and end is not None else None
+        reached = [t for t in stages if t is not None]
+        breakdown['total'] = 1000 * (reached[-1] - reached[0])
+        return breakdown
+
+
+class AnswerTracer:
+    """Keeps traces of the latest answers in a ring buffer of the given capacity.
+
+    Later stages are matched to traces by update id, a trace stops waiting for them once it leaves the buffer.
+    All methods may be called from any thread.
+    """
+
+    def __init__(self, capacity: int = 1000):
+        self._lock = threading.Lock()
+        self._traces: Deque[AnswerTrace] = collections.deque()
+        self._capacity = capacity
+        # Traces of committed answers by update id, until they are notified and delivered.
+        self._not_notified: Dict[int, List[AnswerTrace]] = {}
+        self._not_delivered: Dict[int, List[AnswerTrace]] = {}
+        self._last_notified_update_id = 0
+        self._last_notified_time = 0.0
+
+    def start(self, answer: Answer, received: float) -> AnswerTrace:
+        trace = AnswerTrace(quiz_id=answer.quiz_id, question=answer.question, team_id=answer.team_id,
+                            sent=answer.timestamp, received=received)
+        with self._lock:
+            if len(self._traces) >= self._capacity:
+                self._forget(self._traces.popleft())
+            self._traces.append(trace)
+        return trace
+
+    def committed(self, trace: AnswerTrace, update_id: int) -> None:
+        now = time.time()
+        with self._lock:
+            trace.committed = now
+            trace.update_id = update_id
+            if not update_id:
+                return
+            # Without a debounce window dashboards are woken up before the writer reports the commit.
+            if update_id <= self._last_notified_update_id:
+                trace.notified = max(now, self._last_notified_time)
+            else:
+                self._not_notified.setdefault(update_id, []).append(trace)
+            self._not_delivered.setdefault(update_id, []).append(trace)
+
+    def notified(self, last_update_id: int) -> None:
+        """Marks answers with update ids up to last_update_id as notified."""
+        now = time.time()
+        with self._lock:
+            self._last_notified_update_id = max(self._last_notified_update_id, last_update_id)
+            self._last_notified_time = now
+            if not self._not_notified:
+                return
+            for update_id in [u for u in self._not_notified if u <= last_update_id]:
+                for trace in self._not_notified.pop(update_id):
+                    # A dashboard may have read the answer without waiting for it.
+                    if trace.delivered is None:
+                        trace.notified = now
+
+    def delivered(self, update_ids: Iterable[int]) -> None:
+        now = time.time()
+        with self._lock:
+            if not self._not_delivered:
+                return
+            for update_id in update_ids:
+                for trace in self._not_delivered.pop(update_id, ()):
+                    trace.delivered = now
+
+    def get_traces(self, limit: Optional[int] = None) -> List[AnswerTrace]:
+        """Returns the latest traces, oldest first."""
+        with self._lock:
+            traces = list(self._traces)
+        return traces[-limit:] if limit else traces
+
+    def _forget(self, trace: AnswerTrace) -> None:
+        for pending in (self._not_notified, self._not_delivered):
+            traces = pending.get(trace.update_id)
+            if traces:
+                traces = [t for t in traces if t is not trace]
+                if traces:
+                    pending[trace.update_id] = traces
+                else:
+                    del pending[trace.update_id]
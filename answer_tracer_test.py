@@ -0,0 +1,108 @@
+from answer_tracer import AnswerTracer
+from quiz_db import Answer
+import time
+import unittest
+
+
+def _answer(team_id: int = 5001) -> Answer:
+    return Answer(quiz_id='test', question=1, team_id=team_id, answer='Apple', timestamp=time.time() - 1)
+
+
+class AnswerTracerTest(unittest.TestCase):
+    def test_records_stages(self):
+        tracer = AnswerTracer()
+
+        trace = tracer.start(_answer(), time.time())
+        tracer.committed(trace, 7)
+        tracer.notified(7)
+        tracer.delivered([6, 7])
+
+        self.assertEqual([trace], tracer.get_traces())
+        self.assertEqual(7, trace.update_id)
+        self.assertLessEqual(trace.sent, trace.received)
+        self.assertLessEqual(trace.received, trace.committed)
+        self.assertLessEqual(trace.committed, trace.notified)
+        self.assertLessEqual(trace.notified, trace.delivered)
+        breakdown = trace.breakdown()
+        self.assertEqual(['telegram', 'write', 'notify', 'deliver', 'total'], list(breakdown))
+        stages = ('telegram', 'write', 'notify', 'deliver')
+        self.assertAlmostEqual(breakdown['total'], sum(breakdown[s] for s in stages))
+
+    def test_notified_before_commit_is_reported(self):
+        tracer = AnswerTracer()
+        trace = tracer.start(_answer(), time.time())
+
+        tracer.notified(7)
+        tracer.committed(trace, 7)
+
+        self.assertEqual(trace.committed, trace.notified)
+
+    def test_does_not_notify_later_update_ids(self):
+        tracer = AnswerTracer()
+        trace = tracer.start(_answer(), time.time())
+        tracer.committed(trace, 8)
+
+        tracer.notified(7)
+
+        self.assertIsNone(trace.notified)
+        tracer.notified(8)
+        self.assertIsNotNone(trace.notified)
+
+    def test_keeps_first_delivery(self):
+        tracer = AnswerTracer()
+        trace = tracer.start(_answer(), time.time())
+        tracer.committed(trace, 7)
+        tracer.notified(7)
+
+        tracer.delivered([7])
+        delivered = trace.delivered
+        tracer.delivered([7])
+
+        self.assertEqual(delivered, trace.delivered)
+
+    def test_coalesced_answers_share_update_id(self):
+        tracer = AnswerTracer()
+        first = tracer.start(_answer(), time.time())
+        second = tracer.start(_answer(), time.time())
+        tracer.committed(first, 7)
+        tracer.committed(second, 7)
+
+        tracer.notified(7)
+        tracer.delivered([7])
+
+        self.assertIsNotNone(first.delivered)
+        self.assertIsNotNone(second.delivered)
+
+    def test_outdated_answer(self):
+        tracer = AnswerTracer()
+        trace = tracer.start(_answer(), time.time())
+
+        tracer.committed(trace, 0)
+        tracer.notified(7)
+
+        self.assertEqual(0, trace.update_id)
+        self.assertIsNone(trace.notified)
+        self.assertIsNone(trace.breakdown()['notify'])
+
+    def test_ring_buffer(self):
+        tracer = AnswerTracer(capacity=2)
+        traces = [tracer.start(_answer(team_id), time.time()) for team_id in range(3)]
+        for update_id, trace in enumerate(traces, 1):
+            tracer.committed(trace, update_id)
+
+        self.assertEqual(traces[1:], tracer.get_traces())
+        self.assertEqual(traces[2:], tracer.get_traces(limit=1))
+
+    def test_forgets_evicted_traces(self):
+        tracer = AnswerTracer(capacity=1)
+        first = tracer.start(_answer(), time.time())
+        tracer.committed(first, 1)
+
+        tracer.start(_answer(), time.time())
+
+        self.assertEqual({}, tracer._not_notified)
+        self.assertEqual({}, tracer._not_delivered)
+
+
+if __name__ == '__main__':
+    unittest.main()
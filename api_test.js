@@ -0,0 +1,89 @@
+const assert = require('assert');
+
+const { Api } = require('./static/api.js')
+
+function fakeFetcher(calls, status, response) {
+    return async (url, init) => {
+        calls.push([url, init])
+        return {
+            status: status,
+            text: async () => JSON.stringify(response),
+        }
+    }
+}
+
+describe('Api', () => {
+    describe('GetUpdates', () => {
+        it('#decodesColumns', async () => {
+            const calls = []
+            const api = new Api(fakeFetcher(calls, 200, {
+                quiz_id: 'test',
+                status: { update_id: 3, quiz_id: 'test', question: 1 },
+                teams: { id: [5001, 5002], name: ['Austria', 'Belgium'], timestamp: [11, 12], update_id: [1, 2] },
+                answers: {
+                    question: [1], team_id: [5001], answer: ['Apple'], timestamp: [13], points: [null], update_id: [4],
+                },
+            }))
+
+            const updates = await api.getUpdates(1, 2, 3)
+
+            assert.equal(calls.length, 1)
+            assert.equal(calls[0][0], '/api/getUpdates')
+            assert.deepEqual(JSON.parse(calls[0][1].body), {
+                min_status_update_id: 1,
+                min_teams_update_id: 2,
+                min_answers_update_id: 3,
+                timeout: 30,
+                format: 'columnar',
+            })
+            assert.deepEqual(updates, {
+                status: { update_id: 3, quiz_id: 'test', question: 1 },
+                teams: [
+                    { quiz_id: 'test', id: 5001, name: 'Austria', timestamp: 11, update_id: 1 },
+                    { quiz_id: 'test', id: 5002, name: 'Belgium', timestamp: 12, update_id: 2 },
+                ],
+                answers: [
+                    { quiz_id: 'test', question: 1, team_id: 5001, answer: 'Apple', timestamp: 13, points: null, update_id: 4 },
+                ],
+            })
+        });
+
+        it('#noUpdates', async () => {
+            const api = new Api(fakeFetcher([], 200, {
+                quiz_id: null,
+                status: null,
+                teams: { id: [], name: [], timestamp: [], update_id: [] },
+                answers: { question: [], team_id: [], answer: [], timestamp: [], points: [], update_id: [] },
+            }))
+
+            const updates = await api.getUpdates(1, 1, 1)
+
+            assert.deepEqual(updates, { status: null, teams: [], answers: [] })
+        });
+
+        it('#throwsError', async () => {
+            const api = new Api(fakeFetcher([], 400, { error: 'Parameter format must be either "rows" or "columnar".' }))
+
+            await assert.rejects(api.getUpdates(1, 1, 1), (error) => error.startsWith('Parameter format'))
+        });
+    })
+
+    describe('GetScoreboard', () => {
+        it('#readsWithGet', async () => {
+            const calls = []
+            const scoreboard = {
+                quiz_id: 'test', questions: 1, team_ids: [5001], names: ['Austria'], totals: [1], points: [[1]],
+            }
+            const api = new Api(fakeFetcher(calls, 200, scoreboard))
+
+            assert.deepEqual(await api.getScoreboard(), scoreboard)
+            assert.deepEqual(calls, [['/api/getScoreboard', { method: 'GET', cache: 'no-cache' }]])
+        });
+
+        it('#throwsError', async () => {
+            const api = new Api(fakeFetcher([], 400, { error: 'Quiz is not started.' }))
+
+            await assert.rejects(api.getScoreboard(), (error) => error === 'Quiz is not started.')
+        });
+    })
+})
@@ -0,0 +1,71 @@
+"""Cost of encoding a whole quiz for getUpdates: json.dumps of __dict__ versus encode_json, with and without orjson.
+
+Usage: python -m bench.json_bench [--calls N] [--teams N] [--questions N]
+"""
+import argparse
+from bench.timing import best_latency_us
+import json
+from quiz_db import Answer, Team
+import quiz_http_server
+from quiz_http_server import encode_json
+import sys
+from telegram_quiz import QuizStatus, Updates
+from typing import List
+from unittest.mock import patch
+
+
+def _make_updates(teams: int, questions: int) -> Updates:
+    status = QuizStatus(update_id=1, quiz_id='bench', language='uk', question=questions, registration=False,
+                        time='2020-02-03 04:05:06')
+    update_id = 0
+    team_list = []
+    for team_id in range(teams):
+        update_id += 1
+        team_list.append(Team(quiz_id='bench', id=team_id, name=f'Команда {team_id}', timestamp=1000,
+                              update_id=update_id))
+    answers = []
+    for question in range(1, questions + 1):
+        for team_id in range(teams):
+            update_id += 1
+            answers.append(Answer(quiz_id='bench', question=question, team_id=team_id,
+                                  answer=f'Відповідь {question}', timestamp=1000 + question,
+                                  points=team_id % 2, update_id=update_id))
+    return Updates(status=status, teams=team_list, answers=answers)
+
+
+def _encode_dicts(updates: Updates) -> bytes:
+    # How responses were encoded before encode_json.
+    return json.dumps({
+        'status': updates.status.__dict__,
+        'teams': [t.__dict__ for t in updates.teams],
+        'answers': [a.__dict__ for a in updates.answers],
+    }).encode('utf-8')
+
+
+def main(args: List[str]) -> None:
+    parser = argparse.ArgumentParser(description='JSON encoding benchmark.')
+    parser.add_argument('--calls', type=int, default=50)
+    parser.add_argument('--teams', type=int, default=70)
+    parser.add_argument('--questions', type=int, default=24)
+    args = parser.parse_args(args)
+
+    updates = _make_updates(args.teams, args.questions)
+    results = [
+        ('json.dumps of __dict__', len(_encode_dicts(updates)),
+         best_latency_us(args.calls, lambda: _encode_dicts(updates))),
+    ]
+    with patch.object(quiz_http_server, 'orjson', None):
+        results.append(('encode_json, json module', len(encode_json(updates)),
+                        best_latency_us(args.calls, lambda: encode_json(updates))))
+    if quiz_http_server.orjson:
+        results.append(('encode_json, orjson', len(encode_json(updates)),
+                        best_latency_us(args.calls, lambda: encode_json(updates))))
+    else:
+        print('orjson is not installed, only the json module is measured.')
+
+    for name, size, latency in results:
+        print(f'{name:<30} {size:8} bytes {latency:10.1f} us/call')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
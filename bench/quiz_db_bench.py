@@ -0,0 +1,79 @@
+"""Per-call latency of QuizDb: a connection per call versus pooled connections.
+
+Usage: python -m bench.quiz_db_bench [--calls N] [--teams N]
+"""
+import argparse
+import contextlib
+import os
+from quiz_db import QuizDb
+import sqlite3
+import sys
+import tempfile
+import time
+from typing import Callable, List
+
+
+def _connect_per_call_get_teams(db_path: str, quiz_id: str) -> None:
+    with contextlib.closing(sqlite3.connect(db_path)) as db:
+        with db:
+            db.execute('SELECT update_id, quiz_id, id, name, timestamp FROM teams WHERE quiz_id = ?',
+                       (quiz_id,)).fetchall()
+
+
+def _connect_per_call_update_answer(db_path: str, quiz_id: str, team_id: int, answer_time: int) -> None:
+    with contextlib.closing(sqlite3.connect(db_path)) as db:
+        with db:
+            (update_id,) = db.execute('SELECT MAX(update_id) FROM answers').fetchone()
+            db.execute('INSERT OR REPLACE INTO answers (update_id, quiz_id, question, team_id, answer, timestamp) '
+                       'VALUES (?, ?, 1, ?, "Answer", ?)',
+                       ((update_id or 0) + 1, quiz_id, team_id, answer_time))
+
+
+def _create_db(db_path: str, teams: int) -> QuizDb:
+    quiz_db = QuizDb(db_path=db_path)
+    for team_id in range(teams):
+        quiz_db.update_team(quiz_id='bench', team_id=team_id, name=f'Team {team_id}', registration_time=1)
+    return quiz_db
+
+
+def _measure(calls: int, func: Callable[[int], None]) -> float:
+    start_time = time.perf_counter()
+    for i in range(calls):
+        func(i)
+    return 1e6 * (time.perf_counter() - start_time) / calls
+
+
+def main(args: List[str]) -> None:
+    parser = argparse.ArgumentParser(description='QuizDb connection handling benchmark.')
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--teams', type=int, default=70)
+    args = parser.parse_args(args)
+
+    with tempfile.TemporaryDirectory() as test_dir:
+        # Connections per call write to a database of their own, as their update ids would collide with the
+        # in-memory sequence of QuizDb.
+        per_call_db_path = os.path.join(test_dir, 'per_call.db')
+        _create_db(per_call_db_path, args.teams).close()
+        db_path = os.path.join(test_dir, 'quiz.db')
+        quiz_db = _create_db(db_path, args.teams)
+
+        results = [
+            ('get_teams, connect per call',
+             _measure(args.calls, lambda i: _connect_per_call_get_teams(per_call_db_path, 'bench'))),
+            ('get_teams, pooled',
+             _measure(args.calls, lambda i: quiz_db.get_teams(quiz_id='bench'))),
+            ('update_answer, connect per call',
+             _measure(args.calls, lambda i: _connect_per_call_update_answer(
+                 per_call_db_path, 'bench', i % args.teams, 2 * i))),
+            ('update_answer, pooled',
+             _measure(args.calls, lambda i: quiz_db.update_answer(
+                 quiz_id='bench', question=2, team_id=i % args.teams, answer='Answer', answer_time=2 * i))),
+        ]
+        quiz_db.close()
+
+    for name, latency in results:
+        print(f'{name:<35} {latency:10.1f} us/call')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,239 @@
+"""Replays a quiz night: teams register and answer in bursts while dashboards long-poll getUpdates.
+
+Telegram is replaced by a fake Updater, so messages go through the real dispatcher, handlers, writers and
+database. Reports the answer-to-dashboard latency, the throughput and the peak RSS of the process.
+
+Usage: python -m bench.quiz_night_bench [--teams N] [--questions N] [--clients N] [--question-seconds S]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import resource
+import sys
+import telegram
+import telegram.ext
+import tempfile
+import threading
+import time
+import tornado.httpclient
+import tornado.httpserver
+import tornado.ioloop
+import tornado.testing
+from quiz_db import QuizDb
+import quiz_http_server
+from telegram_quiz import TelegramQuiz
+from typing import Dict, List, Optional, Set, Tuple
+
+_QUIZ_ID = 'bench'
+
+
+class _FakeBot(telegram.Bot):
+    """Sends nothing, every call just takes as long as a call to Telegram would."""
+
+    def __init__(self, token: str, send_latency: float):
+        super().__init__(token)
+        self._send_latency = send_latency
+        # The dispatcher asks for the bot id, which would call Telegram otherwise.
+        self.bot = telegram.User(123, 'Quiz', is_bot=True)
+
+    def send_message(self, chat_id, text, *args, **kwargs):
+        time.sleep(self._send_latency)
+
+
+class _FakeUpdater(telegram.ext.Updater):
+    """Runs only the dispatcher, updates are put into update_queue by the load generator."""
+
+    def start_polling(self, *args, **kwargs):
+        self.running = True
+        dispatcher_ready = threading.Event()
+        self._init_thread(self.dispatcher.start, 'dispatcher', ready=dispatcher_ready)
+        dispatcher_ready.wait()
+        return self.update_queue
+
+
+class _Telegram:
+    """Stands in for Telegram: turns texts of teams into updates and remembers when each answer was sent."""
+
+    def __init__(self, send_latency: float):
+        self.updater: Optional[_FakeUpdater] = None
+        self.messages = 0
+        self.answer_times: Dict[Tuple[int, int, str], float] = {}
+        self._send_latency = send_latency
+        self._update_id = 0
+
+    def updater_factory(self, bot_api_token: str) -> telegram.ext.Updater:
+        self.updater = _FakeUpdater(bot=_FakeBot(bot_api_token, self._send_latency), use_context=True)
+        return self.updater
+
+    def send(self, team_id: int, text: str) -> None:
+        self._update_id += 1
+        self.messages += 1
+        message = telegram.Message(
+            message_id=self._update_id, from_user=None, date=datetime.datetime.now(),
+            chat=telegram.Chat(team_id, 'private'), text=text, bot=self.updater.bot)
+        self.updater.update_queue.put(telegram.Update(self._update_id, message=message))
+
+    def answer(self, team_id: int, question: int, text: str) -> None:
+        self.answer_times[(team_id, question, text)] = time.perf_counter()
+        self.send(team_id, text)
+
+
+def _answer_schedule(teams: int, window: float, corrections: float) -> List[Tuple[float, int, int]]:
+    """Returns (time, team_id, attempt) of every answer to a question, sorted by time.
+
+    Most teams answer in the last seconds of a question, a few of them change their answer right after.
+    """
+    schedule = []
+    for team_id in range(teams):
+        at = window * random.betavariate(5, 1.5)
+        schedule.append((at, team_id, 0))
+        if random.random() < corrections:
+            schedule.append((min(window, at + random.uniform(0.0, 0.1 * window)), team_id, 1))
+    return sorted(schedule)
+
+
+def _sleep_until(deadline: float) -> None:
+    delay = deadline - time.perf_counter()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def _play(quiz: TelegramQuiz, fake_telegram: _Telegram, args: argparse.Namespace) -> None:
+    quiz.start_registration()
+    start_time = time.perf_counter()
+    for team_id in random.sample(range(args.teams), args.teams):
+        _sleep_until(start_time + random.uniform(0.0, args.registration_seconds))
+        fake_telegram.send(team_id, '/start')
+    for team_id in range(args.teams):
+        fake_telegram.send(team_id, f'Team {team_id}')
+    while len(quiz.db.get_teams(quiz_id=_QUIZ_ID)) < args.teams:
+        time.sleep(0.01)
+    quiz.stop_registration()
+
+    for question in range(1, args.questions + 1):
+        quiz.start_question(question)
+        start_time = time.perf_counter()
+        for at, team_id, attempt in _answer_schedule(args.teams, args.question_seconds, args.corrections):
+            _sleep_until(start_time + at)
+            fake_telegram.answer(team_id, question, f'Answer {question}.{attempt}')
+        _sleep_until(start_time + args.question_seconds)
+        quiz.stop_question()
+
+
+class _Dashboard:
+    """Long-polls getUpdates the way static/api.js does and records when each answer shows up."""
+
+    def __init__(self, url: str, answer_times: Dict[Tuple[int, int, str], float]):
+        self.latencies: List[float] = []
+        self.requests = 0
+        self.answered: Set[Tuple[int, int]] = set()
+        self._url = url
+        self._answer_times = answer_times
+        self._seen: Set[Tuple[int, int, str]] = set()
+
+    async def run(self, stop: asyncio.Event) -> None:
+        client = tornado.httpclient.AsyncHTTPClient()
+        cursors = {'min_status_update_id': 0, 'min_teams_update_id': 0, 'min_answers_update_id': 0}
+        while not stop.is_set():
+            body = json.dumps(dict(cursors, timeout=1.0, format='columnar'))
+            response = await client.fetch(self._url, method='POST', body=body, request_timeout=10.0)
+            received_time = time.perf_counter()
+            self.requests += 1
+            updates = json.loads(response.body)
+            if updates['status']:
+                cursors['min_status_update_id'] = updates['status']['update_id'] + 1
+            if updates['teams']['update_id']:
+                cursors['min_teams_update_id'] = max(updates['teams']['update_id']) + 1
+            answers = updates['answers']
+            if answers['update_id']:
+                cursors['min_answers_update_id'] = max(answers['update_id']) + 1
+            for key in zip(answers['team_id'], answers['question'], answers['answer']):
+                if key in self._seen:
+                    continue
+                self._seen.add(key)
+                self.answered.add(key[:2])
+                sent_time = self._answer_times.get(key)
+                if sent_time is not None:
+                    self.latencies.append(received_time - sent_time)
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))] if values else float('nan')
+
+
+async def _run(quiz: TelegramQuiz, fake_telegram: _Telegram, port: int, args: argparse.Namespace) -> None:
+    url = f'http://127.0.0.1:{port}/api/getUpdates'
+    dashboards = [_Dashboard(url, fake_telegram.answer_times) for _ in range(args.clients)]
+    stop = asyncio.Event()
+    polls = [asyncio.ensure_future(d.run(stop)) for d in dashboards]
+
+    start_time = time.perf_counter()
+    await tornado.ioloop.IOLoop.current().run_in_executor(None, _play, quiz, fake_telegram, args)
+    play_time = time.perf_counter() - start_time
+    expected = args.teams * args.questions
+    deadline = time.perf_counter() + 30.0
+    while any(len(d.answered) < expected for d in dashboards) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    stop.set()
+    await asyncio.gather(*polls)
+    total_time = time.perf_counter() - start_time
+
+    latencies = [latency for d in dashboards for latency in d.latencies]
+    requests = sum(d.requests for d in dashboards)
+    missing = sum(expected - len(d.answered) for d in dashboards)
+    # ru_maxrss is in kilobytes on Linux.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f'teams: {args.teams}, questions: {args.questions}, dashboards: {args.clients}')
+    print(f'{"telegram messages":<25} {fake_telegram.messages:10} {fake_telegram.messages / play_time:10.1f} /s')
+    print(f'{"getUpdates responses":<25} {requests:10} {requests / total_time:10.1f} /s')
+    print(f'{"answer to dashboard p50":<25} {1000 * _percentile(latencies, 50):10.1f} ms')
+    print(f'{"answer to dashboard p99":<25} {1000 * _percentile(latencies, 99):10.1f} ms')
+    print(f'{"answer to dashboard max":<25} {1000 * max(latencies, default=float("nan")):10.1f} ms')
+    print(f'{"peak RSS":<25} {max_rss:10.1f} MiB')
+    if missing:
+        print(f'{missing} answers never reached a dashboard.')
+
+
+def main(args: List[str]) -> None:
+    parser = argparse.ArgumentParser(description='Quiz night load generator.')
+    parser.add_argument('--teams', type=int, default=70)
+    parser.add_argument('--questions', type=int, default=10)
+    parser.add_argument('--clients', type=int, default=5, help='Dashboards long-polling getUpdates.')
+    parser.add_argument('--question-seconds', type=float, default=3.0)
+    parser.add_argument('--registration-seconds', type=float, default=2.0)
+    parser.add_argument('--corrections', type=float, default=0.2,
+                        help='Share of teams that send a second answer to a question.')
+    parser.add_argument('--send-latency-ms', type=float, default=50.0,
+                        help='Time every message to Telegram takes.')
+    parser.add_argument('--notify-debounce-ms', type=float, default=20.0)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(args)
+    random.seed(args.seed)
+
+    strings_file = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'strings.json')
+    with tempfile.TemporaryDirectory() as test_dir:
+        notify_debounce = args.notify_debounce_ms / 1000
+        quiz_db = QuizDb(db_path=os.path.join(test_dir, 'quiz.db'), notify_debounce=notify_debounce)
+        quiz = TelegramQuiz(quiz_db=quiz_db, strings_file=strings_file, notify_debounce=notify_debounce)
+        fake_telegram = _Telegram(send_latency=args.send_latency_ms / 1000)
+        quiz.start(quiz_id=_QUIZ_ID, bot_api_token='123:TOKEN', language='en',
+                   updater_factory=fake_telegram.updater_factory)
+
+        tornado.httpclient.AsyncHTTPClient.configure(None, max_clients=args.clients)
+        sock, port = tornado.testing.bind_unused_port()
+        server = tornado.httpserver.HTTPServer(quiz_http_server.create_quiz_tornado_app(quiz=quiz))
+        server.add_sockets([sock])
+        try:
+            tornado.ioloop.IOLoop.current().run_sync(lambda: _run(quiz, fake_telegram, port, args))
+        finally:
+            server.stop()
+            quiz.stop()
+            quiz_db.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
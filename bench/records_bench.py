@@ -0,0 +1,87 @@
+"""Plain versus slotted answer records: memory held by a season of answers and the cost of encoding one quiz.
+
+Answer stays a plain dataclass: slots save a third of its memory, but orjson and json.dumps encode it several
+times slower, and the records of the active quiz are encoded for every getUpdates generation.
+Usage: python -m bench.records_bench [--quizzes N] [--teams N] [--questions N] [--calls N]
+"""
+import argparse
+from bench.timing import best_latency_us
+from dataclasses import dataclass, fields
+import json
+from quiz_db import Answer
+import quiz_http_server
+from quiz_http_server import encode_json
+import sys
+import tracemalloc
+from typing import Callable, List, Optional
+from unittest.mock import patch
+
+
+@dataclass(order=True)
+class _SlottedAnswer:
+    # Fields with slots can not have defaults, the benchmark always passes all of them.
+    __slots__ = ('quiz_id', 'question', 'team_id', 'answer', 'timestamp', 'points', 'update_id')
+    quiz_id: str
+    question: int
+    team_id: int
+    answer: str
+    timestamp: int
+    points: Optional[int]
+    update_id: Optional[int]
+
+
+def _encode_slotted(obj: object) -> bytes:
+    # Without an instance dict the json module needs a dict built for every record.
+    return json.dumps(obj, default=lambda r: {f.name: getattr(r, f.name) for f in fields(r)},
+                      separators=(',', ':'), check_circular=False).encode('utf-8')
+
+
+def _make_answers(quizzes: int, teams: int, questions: int, make: Callable[..., object]) -> List[object]:
+    # Strings are shared between records, so only the records themselves are counted.
+    quiz_ids = [f'quiz-{i}' for i in range(quizzes)]
+    texts = [f'Відповідь {q}' for q in range(questions + 1)]
+    return [make(quiz_id=quiz_id, question=question, team_id=team_id, answer=texts[question],
+                 timestamp=1000, points=1, update_id=1)
+            for quiz_id in quiz_ids
+            for question in range(1, questions + 1)
+            for team_id in range(teams)]
+
+
+def _measure_memory(quizzes: int, teams: int, questions: int, make: Callable[..., object]) -> int:
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    records = _make_answers(quizzes, teams, questions, make)
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return after - before
+
+
+def main(args: List[str]) -> None:
+    parser = argparse.ArgumentParser(description='Record memory and encoding benchmark.')
+    parser.add_argument('--quizzes', type=int, default=40)
+    parser.add_argument('--teams', type=int, default=70)
+    parser.add_argument('--questions', type=int, default=24)
+    parser.add_argument('--calls', type=int, default=50)
+    args = parser.parse_args(args)
+
+    count = args.quizzes * args.teams * args.questions
+    for name, make in (('plain Answer', Answer), ('slotted answer', _SlottedAnswer)):
+        size = _measure_memory(args.quizzes, args.teams, args.questions, make)
+        print(f'{name:<20} {count:8} answers {size / 2**20:8.1f} MiB {size / count:6.1f} bytes/answer')
+
+    print(f'Encoding the {args.teams * args.questions} answers of one quiz:')
+    for name, make, encode_stdlib in (('plain Answer', Answer, encode_json),
+                                      ('slotted answer', _SlottedAnswer, _encode_slotted)):
+        records = _make_answers(1, args.teams, args.questions, make)
+        with patch.object(quiz_http_server, 'orjson', None):
+            latencies = [('json module', best_latency_us(args.calls, lambda: encode_stdlib({'answers': records})))]
+        if quiz_http_server.orjson:
+            latencies.append(('orjson', best_latency_us(args.calls, lambda: encode_json({'answers': records}))))
+        print(f'{name:<20} ' + ', '.join(f'{encoder} {latency:7.1f} us/call' for encoder, latency in latencies))
+    if not quiz_http_server.orjson:
+        print('orjson is not installed, only the json module is measured.')
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
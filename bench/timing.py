@@ -0,0 +1,16 @@
+import time
+from typing import Callable
+
+
+def best_latency_us(calls: int, func: Callable[[], object], rounds: int = 5) -> float:
+    """Microseconds per call of the fastest of several rounds of calls.
+
+    Other processes slow down single rounds at random, the fastest round is the most repeatable.
+    """
+    best = float('inf')
+    for _ in range(rounds):
+        start_time = time.perf_counter()
+        for _ in range(calls):
+            func()
+        best = min(best, (time.perf_counter() - start_time) / calls)
+    return 1e6 * best
@@ -160,12 +160,14 @@ describe('Index', () => {
             const controller = new index.QuizController(document)
             controller.numberOfQuestions = numberOfQuestions
 
-            controller.teamsIndex = new Map([
-                [5001, { name: 'Austria' }],
-                [5002, { name: 'Belgium' }],
-            ])
-
-            controller.updateResultsTable()
+            controller.updateResultsTable({
+                quiz_id: 'test',
+                questions: 0,
+                team_ids: [5002, 5001],
+                names: ['Belgium', 'Austria'],
+                totals: [0, 0],
+                points: [[], []],
+            })
 
             assert.equal(table.rows.length, 2)
             assert.equal(table.rows[0].cells[0].textContent, 'Belgium')
@@ -175,7 +177,7 @@ describe('Index', () => {
         });
 
         it('#showsPoints', () => {
-            const numberOfQuestions = 4
+            const numberOfQuestions = 5
 
             const table = document.getElementById('results_table')
             const row = table.insertRow(-1)
@@ -186,25 +188,15 @@ describe('Index', () => {
 
             const controller = new index.QuizController(document)
             controller.numberOfQuestions = numberOfQuestions
-            controller.teamsIndex = new Map([
-                [5001, { name: 'Austria' }],
-                [5002, { name: 'Belgium' }],
-            ])
-            controller.answersIndex = new Map([
-                [1, new Map([
-                    [5001, { answer: 'Apple', points: 6 }],
-                    [5002, { answer: 'Banana', points: 3 }]
-                ])],
-                [3, new Map([
-                    [5001, { answer: 'Ant', points: 9 }],
-                    [5002, { answer: 'Bee' }]
-                ])],
-                [4, new Map([
-                    [5002, { answer: 'Bread', points: 4 }],
-                ])],
-            ])
 
-            controller.updateResultsTable()
+            controller.updateResultsTable({
+                quiz_id: 'test',
+                questions: 4,
+                team_ids: [5001, 5002],
+                names: ['Austria', 'Belgium'],
+                totals: [15, 7],
+                points: [[6, null, 9, null], [3, null, null, 4]],
+            })
 
             const austriaRow = table.querySelector('#results_team_5001_row')
             assert.strictEqual(austriaRow.cells[1].textContent, '15')
@@ -212,6 +204,7 @@ describe('Index', () => {
             assert.strictEqual(austriaRow.cells[3].textContent, '')
             assert.strictEqual(austriaRow.cells[4].textContent, '9')
             assert.strictEqual(austriaRow.cells[5].textContent, '')
+            assert.strictEqual(austriaRow.cells[6].textContent, '')
 
             const belgiumRow = table.querySelector('#results_team_5002_row')
             assert.strictEqual(belgiumRow.cells[1].textContent, '7')
@@ -219,6 +212,33 @@ describe('Index', () => {
             assert.strictEqual(belgiumRow.cells[3].textContent, '')
             assert.strictEqual(belgiumRow.cells[4].textContent, '')
             assert.strictEqual(belgiumRow.cells[5].textContent, '4')
+            assert.strictEqual(belgiumRow.cells[6].textContent, '')
+        });
+
+        it('#ranksRows', () => {
+            controller.numberOfQuestions = 1
+            controller.init()
+            const scoreboard = {
+                quiz_id: 'test',
+                questions: 1,
+                team_ids: [5001, 5002, 5003],
+                names: ['Austria', 'Belgium', 'Croatia'],
+                totals: [1, 0, 0],
+                points: [[1], [0], [null]],
+            }
+            controller.updateResultsTable(scoreboard)
+
+            controller.updateResultsTable(Object.assign(scoreboard, {
+                team_ids: [5003, 5001, 5002],
+                names: ['Croatia', 'Austria', 'Belgium'],
+                totals: [2, 1, 0],
+                points: [[2], [1], [0]],
+            }))
+
+            const table = document.getElementById('results_table')
+            assert.deepEqual(Array.from(table.rows).map(row => row.cells[0].textContent),
+                ['Team', 'Croatia', 'Austria', 'Belgium'])
+            assert.equal(table.rows[1].cells[1].textContent, '2')
         });
     });
 
@@ -471,6 +491,7 @@ describe('Index', () => {
 
             assert.equal(controller.currentQuestion, 1)
             assert.equal(controller.runningQuestion, 4)
+            assert.deepEqual(api.getScoreboardCalls, [[]])
 
             const statusTable = document.getElementById('status_table')
             assert.equal(statusTable.rows[0].cells[1].textContent, 'test')
@@ -632,6 +653,79 @@ describe('Index', () => {
         })
     })
 
+    describe('RefreshScoreboard', () => {
+        it('#fetchesScoreboardWhenPointsChange', async () => {
+            controller.numberOfQuestions = 2
+            controller.init()
+            api.mockGetScoreboard = async () => {
+                return {
+                    quiz_id: 'test',
+                    questions: 2,
+                    team_ids: [5001],
+                    names: ['Liverpool'],
+                    totals: [1],
+                    points: [[null, 1]],
+                }
+            }
+
+            controller.updateQuiz({
+                status: null,
+                teams: [{ update_id: 1, id: 5001, name: 'Liverpool' }],
+                answers: [{ update_id: 2, team_id: 5001, question: 2, answer: 'Apple', points: null }],
+            })
+            await controller.scoreboardRequest
+            controller.updateQuiz({
+                status: null,
+                teams: [],
+                answers: [{ update_id: 3, team_id: 5001, question: 2, answer: 'Apple', points: 1 }],
+            })
+            await controller.scoreboardRequest
+
+            assert.deepEqual(api.getScoreboardCalls, [[], []])
+            const row = document.getElementById('results_team_5001_row')
+            assert.equal(row.cells[0].textContent, 'Liverpool')
+            assert.equal(row.cells[1].textContent, '1')
+            assert.equal(row.cells[3].textContent, '1')
+        });
+
+        it('#skipsUnchangedPoints', async () => {
+            controller.updateQuiz({
+                status: null,
+                teams: [{ update_id: 1, id: 5001, name: 'Liverpool' }],
+                answers: [{ update_id: 2, team_id: 5001, question: 1, answer: 'Apple', points: 1 }],
+            })
+            await controller.scoreboardRequest
+
+            controller.updateQuiz({
+                status: { update_id: 3, quiz_id: 'test', language: 'lang', question: 2, registration: false },
+                teams: [{ update_id: 4, id: 5001, name: 'Liverpool' }],
+                answers: [{ update_id: 5, team_id: 5001, question: 1, answer: 'Apple', points: 1 }],
+            })
+
+            assert.equal(controller.scoreboardRequest, null)
+            assert.deepEqual(api.getScoreboardCalls, [[]])
+        });
+
+        it('#fetchesAgainAfterChangeDuringFetch', async () => {
+            var resolveFirst = null
+            api.mockGetScoreboard = () => new Promise(resolve => {
+                resolveFirst = resolve
+            })
+
+            const first = controller.refreshScoreboard()
+            const second = controller.refreshScoreboard()
+            api.mockGetScoreboard = async () => {
+                return { quiz_id: 'test', questions: 0, team_ids: [], names: [], totals: [], points: [] }
+            }
+            resolveFirst({ quiz_id: 'test', questions: 0, team_ids: [], names: [], totals: [], points: [] })
+            await first
+
+            assert.strictEqual(first, second)
+            assert.deepEqual(api.getScoreboardCalls, [[], []])
+            assert.equal(controller.scoreboardRequest, null)
+        });
+    })
+
     describe('HighlightResultsTable', () => {
 
         beforeEach(() => {
@@ -746,4 +840,58 @@ describe('Index', () => {
             ])
         })
     })
+
+    describe('ListenToServer', () => {
+        it('#streamsUpdates', () => {
+            controller.init()
+            var onUpdates = null
+            api.mockStreamUpdates = (a, b, c, u, e) => {
+                onUpdates = u
+                return {}
+            }
+            var polled = false
+            controller.pollServer = () => { polled = true }
+            controller.lastSeenStatusUpdateId = 4
+            controller.lastSeenTeamsUpdateId = 5
+            controller.lastSeenAnswersUpdateId = 6
+
+            controller.listenToServer()
+            onUpdates({
+                status: null,
+                teams: [{ id: 5001, name: 'Austria', update_id: 7 }],
+                answers: [],
+            })
+
+            assert.deepEqual(api.streamUpdatesCalls, [[5, 6, 7]])
+            assert.deepEqual(controller.teamsIndex.get(5001), { id: 5001, name: 'Austria', update_id: 7 })
+            assert.equal(controller.lastSeenTeamsUpdateId, 7)
+            assert.equal(polled, false)
+        })
+
+        it('#fallsBackToPollingWithoutStreaming', () => {
+            var polled = false
+            controller.pollServer = () => { polled = true }
+
+            controller.listenToServer()
+
+            assert.deepEqual(api.streamUpdatesCalls, [[1, 1, 1]])
+            assert.equal(polled, true)
+        })
+
+        it('#fallsBackToPollingWhenStreamCloses', () => {
+            var onError = null
+            api.mockStreamUpdates = (a, b, c, u, e) => {
+                onError = e
+                return {}
+            }
+            var polled = false
+            controller.pollServer = () => { polled = true }
+
+            controller.listenToServer()
+            assert.equal(polled, false)
+            onError()
+
+            assert.equal(polled, true)
+        })
+    })
 })
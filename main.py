@@ -1,7 +1,8 @@
 import argparse
 import logging
 import quiz_http_server
-from quiz_db import QuizDb
+from quiz_db import DB_PROFILES, DEFAULT_DB_PROFILE, QuizDb
+from quiz_logging import parse_module_levels, setup_logging
 from telegram_quiz import TelegramQuiz
 import tornado
 from typing import List
@@ -11,33 +12,59 @@ import sys
 def _parse_args(args: List[str]):
     parser = argparse.ArgumentParser(
         description='Application for hosting a quiz.')
-    parser.add_argument('--log-file', default='main.log')
+    parser.add_argument('--log-file', default='main.log', help='Log records are written to it as JSON lines.')
+    parser.add_argument('--log-level', default='INFO', type=str.upper,
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'])
+    parser.add_argument('--log-module-level', action='append', metavar='MODULE=LEVEL',
+                        help='Overrides the log level of a module, e.g. telegram_quiz=WARNING. May be repeated.')
+    parser.add_argument('--log-max-mb', type=float, default=10.0,
+                        help='The log file is rotated when it grows above this size.')
+    parser.add_argument('--log-backup-count', type=int, default=5)
     parser.add_argument('--quiz-db', default='quiz.db')
+    parser.add_argument('--db-profile', default=DEFAULT_DB_PROFILE, choices=sorted(DB_PROFILES))
     parser.add_argument('--quiz-id', required=True)
     parser.add_argument('--telegram-bot-token', required=True)
     parser.add_argument('--strings-file', default='strings.json')
     parser.add_argument('--language', default='uk')
-    return parser.parse_args()
+    parser.add_argument('--webhook-url',
+                        help='Public HTTPS URL of this server. If set, Telegram pushes updates to it instead of '
+                             'being polled. TLS must be terminated in front of the server, e.g. by a reverse proxy.')
+    parser.add_argument('--notify-debounce-ms', type=float, default=20.0,
+                        help='Bursts of changes within this window wake up the dashboards only once.')
+    args = parser.parse_args()
+    try:
+        args.log_module_level = parse_module_levels(args.log_module_level)
+    except ValueError as e:
+        parser.error(str(e))
+    return args
 
 
 def main(args: List[str]):
     args = _parse_args(args)
 
-    log_format = '%(asctime)s: %(process)s: %(levelname)s: %(filename)s:%(lineno)d - %(message)s'
-    logging.basicConfig(filename=args.log_file,
-                        format=log_format, level=logging.INFO)
+    log_listener = setup_logging(log_file=args.log_file, level=args.log_level,
+                                 module_levels=args.log_module_level,
+                                 max_bytes=int(args.log_max_mb * 2**20), backup_count=args.log_backup_count)
 
-    logging.info('')
     logging.info('Hello!')
 
-    quiz_db = QuizDb(db_path=args.quiz_db)
+    notify_debounce = args.notify_debounce_ms / 1000
+    quiz_db = QuizDb(db_path=args.quiz_db, profile=args.db_profile, notify_debounce=notify_debounce)
 
-    quiz = TelegramQuiz(quiz_db=quiz_db, strings_file=args.strings_file)
+    quiz = TelegramQuiz(quiz_db=quiz_db, strings_file=args.strings_file, webhook_url=args.webhook_url,
+                        notify_debounce=notify_debounce)
     quiz.start(quiz_id=args.quiz_id, bot_api_token=args.telegram_bot_token, language=args.language)
 
     app = quiz_http_server.create_quiz_tornado_app(quiz=quiz)
     app.listen(8000)
-    tornado.ioloop.IOLoop.current().start()
+    try:
+        tornado.ioloop.IOLoop.current().start()
+    finally:
+        # Writes the queued answers and messages and sends the queued replies before the database is closed.
+        if quiz.id:
+            quiz.stop()
+        quiz_db.close()
+        log_listener.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,213 @@
+import bisect
+import contextlib
+import functools
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+# Upper bounds in seconds, from a fast cache read to a Telegram call that is about to time out.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    labels = ','.join('{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+                      for name, value in zip(names, values))
+    return '{' + labels + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    """Metrics exposed together in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: List['_Metric'] = []
+
+    def register(self, metric: '_Metric') -> None:
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError(f'Metric {metric.name} is already registered.')
+            self._metrics.append(metric)
+
+    def expose(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.TYPE}')
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    TYPE = ''
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str], registry: Registry):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def collect(self) -> Iterator[str]:
+        return iter(())
+
+
+class Gauge(_Metric):
+    """A value that goes up and down, e.g. the number of requests waiting for updates."""
+
+    TYPE = 'gauge'
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = (), registry: Registry = REGISTRY):
+        super().__init__(name, help, label_names, registry)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        if not self.label_names:
+            self._values[()] = 0
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values: str, amount: float = 1) -> None:
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, value: float, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = value
+
+    def get(self, *label_values: str) -> float:
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    @contextlib.contextmanager
+    def track(self, *label_values: str) -> Iterator[None]:
+        """Counts the block in the gauge while it runs."""
+        self.inc(*label_values)
+        try:
+            yield
+        finally:
+            self.dec(*label_values)
+
+    def collect(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield f'{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}'
+
+
+class _HistogramValues:
+    __slots__ = ('counts', 'sum')
+
+    def __init__(self, buckets: int):
+        # One count per bucket and one for the values above the last bound, not cumulative.
+        self.counts = [0] * (buckets + 1)
+        self.sum = 0.0
+
+
+class Histogram(_Metric):
+    """Counts observed values, usually durations in seconds, in buckets with the given upper bounds."""
+
+    TYPE = 'histogram'
+
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        super().__init__(name, help, label_names, registry)
+        self._buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], _HistogramValues] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            values = self._values.get(label_values)
+            if values is None:
+                values = self._values[label_values] = _HistogramValues(len(self._buckets))
+            values.counts[index] += 1
+            values.sum += value
+
+    @contextlib.contextmanager
+    def time(self, *label_values: str) -> Iterator[None]:
+        """Observes how long the block takes, also when it raises."""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, *label_values)
+
+    def timed(self, func: Callable) -> Callable:
+        """Decorates a function, so that its duration is observed with the name of the function as the label."""
+        name = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.observe(time.perf_counter() - start_time, name)
+        return wrapper
+
+    def get_count(self, *label_values: str) -> int:
+        with self._lock:
+            values = self._values.get(label_values)
+            return sum(values.counts) if values else 0
+
+    def collect(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted((k, list(v.counts), v.sum) for k, v in self._values.items())
+        bucket_label_names = self.label_names + ('le',)
+        for label_values, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self._buckets + (float('inf'),), counts):
+                cumulative += count
+                labels = _format_labels(bucket_label_names, label_values + (_format_value(bound),))
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            labels = _format_labels(self.label_names, label_values)
+            yield f'{self.name}_sum{labels} {_format_value(total)}'
+            yield f'{self.name}_count{labels} {cumulative}'
+
+
+LOCK_WAIT_SECONDS = Histogram('quiz_lock_wait_seconds', 'Time spent waiting to acquire a lock.', ['lock'])
+
+
+class TimedLock:
+    """A threading.Lock that observes how long every acquire() waited in quiz_lock_wait_seconds."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        # An uncontended lock is taken without reading the clock.
+        if self._lock.acquire(blocking=False):
+            LOCK_WAIT_SECONDS.observe(0.0, self._name)
+            return True
+        if not blocking:
+            return False
+        start_time = time.perf_counter()
+        acquired = self._lock.acquire(timeout=timeout)
+        LOCK_WAIT_SECONDS.observe(time.perf_counter() - start_time, self._name)
+        return acquired
+
+    def release(self) -> None:
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *args) -> None:
+        self.release()
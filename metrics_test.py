@@ -0,0 +1,111 @@
+from metrics import Gauge, Histogram, LOCK_WAIT_SECONDS, Registry, TimedLock
+import threading
+import time
+import unittest
+
+
+class HistogramTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_exposes_cumulative_buckets(self):
+        histogram = Histogram('test_seconds', 'Test durations.', ['method'], buckets=(0.1, 1.0),
+                              registry=self.registry)
+
+        histogram.observe(0.05, 'get')
+        histogram.observe(0.1, 'get')
+        histogram.observe(0.5, 'get')
+        histogram.observe(3.0, 'get')
+
+        self.assertEqual('\n'.join([
+            '# HELP test_seconds Test durations.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{method="get",le="0.1"} 2',
+            'test_seconds_bucket{method="get",le="1.0"} 3',
+            'test_seconds_bucket{method="get",le="+Inf"} 4',
+            'test_seconds_sum{method="get"} 3.65',
+            'test_seconds_count{method="get"} 4',
+        ]) + '\n', self.registry.expose())
+
+    def test_timed_uses_function_name(self):
+        histogram = Histogram('test_seconds', 'Test durations.', ['method'], registry=self.registry)
+
+        @histogram.timed
+        def fails():
+            raise ValueError('Boom')
+
+        self.assertRaises(ValueError, fails)
+        self.assertEqual(1, histogram.get_count('fails'))
+
+    def test_time(self):
+        histogram = Histogram('test_seconds', 'Test durations.', registry=self.registry)
+
+        with histogram.time():
+            time.sleep(0.01)
+
+        self.assertEqual(1, histogram.get_count())
+        self.assertIn('test_seconds_bucket{le="0.005"} 0', self.registry.expose())
+        self.assertIn('test_seconds_bucket{le="0.025"} 1', self.registry.expose())
+
+    def test_rejects_duplicate_name(self):
+        Histogram('test_seconds', 'Test durations.', registry=self.registry)
+
+        self.assertRaisesRegex(ValueError, 'already registered', Histogram, 'test_seconds', 'Again.',
+                               registry=self.registry)
+
+
+class GaugeTest(unittest.TestCase):
+    def test_tracks_block(self):
+        registry = Registry()
+        gauge = Gauge('test_waiters', 'Test waiters.', ['handler'], registry=registry)
+
+        with gauge.track('poll'):
+            with gauge.track('poll'):
+                self.assertEqual(2, gauge.get('poll'))
+        gauge.inc('stream')
+
+        self.assertEqual(0, gauge.get('poll'))
+        self.assertIn('test_waiters{handler="poll"} 0\ntest_waiters{handler="stream"} 1\n', registry.expose())
+
+    def test_escapes_labels(self):
+        registry = Registry()
+        gauge = Gauge('test_value', 'Test value.', ['name'], registry=registry)
+
+        gauge.set(1.5, 'a"b\\c')
+
+        self.assertIn('test_value{name="a\\"b\\\\c"} 1.5', registry.expose())
+
+
+class TimedLockTest(unittest.TestCase):
+    def test_observes_wait(self):
+        lock = TimedLock('test_timed_lock')
+        acquired = threading.Event()
+
+        def hold():
+            with lock:
+                acquired.set()
+                time.sleep(0.05)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        acquired.wait()
+        with lock:
+            pass
+        thread.join()
+
+        self.assertEqual(2, LOCK_WAIT_SECONDS.get_count('test_timed_lock'))
+        self.assertIn('quiz_lock_wait_seconds_bucket{lock="test_timed_lock",le="0.01"} 1',
+                      '\n'.join(LOCK_WAIT_SECONDS.collect()))
+
+    def test_non_blocking(self):
+        lock = TimedLock('test_non_blocking_lock')
+
+        self.assertTrue(lock.acquire(blocking=False))
+        self.assertFalse(lock.acquire(blocking=False))
+        self.assertTrue(lock.locked())
+        lock.release()
+        self.assertFalse(lock.locked())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,8 +2,16 @@ export class MockApi {
     constructor() {
         this.getUpdatesCalls = []
         this.mockGetUpdates = async () => { }
+        this.getScoreboardCalls = []
+        this.mockGetScoreboard = async () => {
+            return { quiz_id: 'test', questions: 0, team_ids: [], names: [], totals: [], points: [] }
+        }
+        this.streamUpdatesCalls = []
+        this.mockStreamUpdates = () => null
         this.sendResultsCalls = []
         this.mockSendResults = async () => { }
+        this.sendAllResultsCalls = []
+        this.mockSendAllResults = async () => 0
         this.startRegistrationCalls = []
         this.mockStartRegistration = async () => { }
         this.stopRegistrationCalls = []
@@ -21,11 +29,26 @@ export class MockApi {
         return this.mockGetUpdates(a, b, c)
     }
 
+    async getScoreboard() {
+        this.getScoreboardCalls.push([])
+        return this.mockGetScoreboard()
+    }
+
+    streamUpdates(a, b, c, onUpdates, onError) {
+        this.streamUpdatesCalls.push([a, b, c])
+        return this.mockStreamUpdates(a, b, c, onUpdates, onError)
+    }
+
     async sendResults(t) {
         this.sendResultsCalls.push([t])
         return this.mockSendResults(t)
     }
 
+    async sendAllResults() {
+        this.sendAllResultsCalls.push([])
+        return this.mockSendAllResults()
+    }
+
     async startRegistration() {
         this.startRegistrationCalls.push([])
         return this.mockStartRegistration()
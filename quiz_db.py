@@ -1,10 +1,18 @@
+from collections import OrderedDict
 import contextlib
 from datetime import datetime
 from dataclasses import dataclass, field
 import logging
+import metrics
+import queue
 import sqlite3
 import threading
-from typing import Callable, List, Tuple, Optional, Set
+import time
+from typing import Any, Callable, Dict, Iterator, List, Tuple, Optional, Union
+from update_notifier import UpdateNotifier
+
+
+_logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -36,30 +44,302 @@ class Team:
     update_id: int = field(default=None, compare=False)
 
 
+@dataclass
+class Scoreboard:
+    """Teams of a quiz ranked by their total points, as parallel lists."""
+    quiz_id: str
+    # Number of questions in points, the highest question with points.
+    questions: int
+    team_ids: List[int]
+    names: List[str]
+    totals: List[int]
+    # Points of every team for questions 1..questions, None where the team has no points.
+    points: List[List[Optional[int]]]
+
+
+def _make_scoreboard(quiz_id: str, teams: List[Team], team_points: Dict[int, Dict[int, int]],
+                     totals: Dict[int, int]) -> Scoreboard:
+    questions = max((max(p) for p in team_points.values() if p), default=0)
+    teams = sorted(teams, key=lambda t: (-totals.get(t.id, 0), t.name, t.id))
+    points = []
+    for team in teams:
+        team_questions = team_points.get(team.id, {})
+        points.append([team_questions.get(q) for q in range(1, questions + 1)])
+    return Scoreboard(quiz_id=quiz_id, questions=questions, team_ids=[t.id for t in teams],
+                      names=[t.name for t in teams], totals=[totals.get(t.id, 0) for t in teams], points=points)
+
+
+@dataclass(frozen=True)
+class DbProfile:
+    journal_mode: str
+    synchronous: str
+    # Negative values are in KiB, positive ones in pages.
+    cache_size: int
+    mmap_size: int
+    temp_store: str
+
+
+DB_PROFILES: Dict[str, DbProfile] = {
+    # Every commit is fsynced, survives power loss.
+    'strict': DbProfile(journal_mode='WAL', synchronous='FULL', cache_size=-2000,
+                        mmap_size=0, temp_store='DEFAULT'),
+    # Commits survive a crash of the application, but the last ones may be lost on power loss.
+    'balanced': DbProfile(journal_mode='WAL', synchronous='NORMAL', cache_size=-16000,
+                          mmap_size=64 * 1024 * 1024, temp_store='MEMORY'),
+    # No fsync at all, the database may get corrupted on power loss.
+    'fast': DbProfile(journal_mode='WAL', synchronous='OFF', cache_size=-64000,
+                      mmap_size=256 * 1024 * 1024, temp_store='MEMORY'),
+}
+
+DEFAULT_DB_PROFILE = 'balanced'
+
+
+# Schema version N is reached by applying the N-th list of statements.
+# Only append new versions, existing databases are already at the older ones.
+_MIGRATIONS: List[List[str]] = [
+    [
+        '''CREATE TABLE IF NOT EXISTS teams (
+            update_id INTEGER PRIMARY KEY NOT NULL,
+            quiz_id TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            UNIQUE(quiz_id, id))''',
+        '''CREATE TABLE IF NOT EXISTS answers (
+            update_id INTEGER PRIMARY KEY NOT NULL,
+            quiz_id TEXT NOT NULL,
+            question INTEGER NOT NULL,
+            team_id INTEGER NOT NULL,
+            answer TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            points INTEGER,
+            UNIQUE(quiz_id, question, team_id))''',
+        '''CREATE TABLE IF NOT EXISTS messages (
+            insert_timestamp INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            update_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL)''',
+    ],
+    [
+        # update_id is the rowid, so it is stored in every index for free.
+        'CREATE INDEX IF NOT EXISTS teams_quiz_id_update_id ON teams (quiz_id, update_id)',
+        'CREATE INDEX IF NOT EXISTS answers_quiz_id_update_id ON answers (quiz_id, update_id)',
+        'CREATE INDEX IF NOT EXISTS answers_quiz_id_team_id ON answers (quiz_id, team_id)',
+    ],
+]
+
+
+class ConnectionPool:
+    """Long-lived SQLite connections: one writer and a bounded set of readers.
+
+    The writer connection is not synchronised here, callers must serialise writes themselves.
+    Reader connections are handed out to one thread at a time and returned to the pool afterwards.
+    """
+
+    def __init__(self, *, db_path: str, max_readers: int = 4, profile: DbProfile = DB_PROFILES[DEFAULT_DB_PROFILE]):
+        if max_readers < 1:
+            raise ValueError('Connection pool needs at least one reader connection.')
+        self._db_path = db_path
+        self._profile = profile
+        self._lock = threading.Lock()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._idle_readers: 'queue.LifoQueue[sqlite3.Connection]' = queue.LifoQueue()
+        self._readers_semaphore = threading.BoundedSemaphore(max_readers)
+        self._connections: List[sqlite3.Connection] = []
+        self._closed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._closed:
+                raise sqlite3.ProgrammingError('Connection pool is closed.')
+            db = sqlite3.connect(self._db_path, check_same_thread=False)
+            self._connections.append(db)
+        db.execute(f'PRAGMA journal_mode = {self._profile.journal_mode}')
+        db.execute(f'PRAGMA synchronous = {self._profile.synchronous}')
+        db.execute(f'PRAGMA cache_size = {self._profile.cache_size}')
+        db.execute(f'PRAGMA mmap_size = {self._profile.mmap_size}')
+        db.execute(f'PRAGMA temp_store = {self._profile.temp_store}')
+        return db
+
+    @contextlib.contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        if self._writer is None:
+            self._writer = self._connect()
+        yield self._writer
+
+    @contextlib.contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        with self._readers_semaphore:
+            try:
+                db = self._idle_readers.get_nowait()
+            except queue.Empty:
+                db = self._connect()
+            try:
+                yield db
+            finally:
+                if db.in_transaction:
+                    db.rollback()
+                self._idle_readers.put(db)
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            connections, self._connections = self._connections, []
+            self._writer = None
+            self._idle_readers = queue.LifoQueue()
+        for db in connections:
+            db.close()
+
+
+class _QuizCache:
+    """Teams and answers of one quiz, each kept in the order of their update_id."""
+
+    def __init__(self, quiz_id: str):
+        self.quiz_id = quiz_id
+        self._teams: Dict[int, Team] = {}
+        self._teams_by_update_id: 'OrderedDict[int, Team]' = OrderedDict()
+        self._answers: Dict[Tuple[int, int], Answer] = {}
+        self._answers_by_update_id: 'OrderedDict[int, Answer]' = OrderedDict()
+        # Points and their totals are kept up to date with the answers, so that the scoreboard is never recomputed.
+        self._team_points: Dict[int, Dict[int, int]] = {}
+        self._totals: Dict[int, int] = {}
+
+    # New update ids are always the largest ones, so appending keeps the order.
+    def put_team(self, team: Team) -> None:
+        old_team = self._teams.get(team.id)
+        if old_team:
+            del self._teams_by_update_id[old_team.update_id]
+        self._teams[team.id] = team
+        self._teams_by_update_id[team.update_id] = team
+
+    def put_answer(self, answer: Answer) -> None:
+        key = (answer.question, answer.team_id)
+        old_answer = self._answers.get(key)
+        if old_answer:
+            del self._answers_by_update_id[old_answer.update_id]
+            if old_answer.points is not None:
+                del self._team_points[answer.team_id][answer.question]
+                self._totals[answer.team_id] -= old_answer.points
+        self._answers[key] = answer
+        self._answers_by_update_id[answer.update_id] = answer
+        if answer.points is not None:
+            self._team_points.setdefault(answer.team_id, {})[answer.question] = answer.points
+            self._totals[answer.team_id] = self._totals.get(answer.team_id, 0) + answer.points
+
+    @staticmethod
+    def _since(items: 'OrderedDict[int, Any]', min_update_id: int) -> List[Any]:
+        result = []
+        for update_id, item in reversed(items.items()):
+            if update_id < min_update_id:
+                break
+            result.append(item)
+        result.reverse()
+        return result
+
+    def get_teams(self, *, team_id: Optional[int], min_update_id: int) -> List[Team]:
+        if team_id is not None:
+            team = self._teams.get(team_id)
+            return [team] if team and team.update_id >= min_update_id else []
+        return self._since(self._teams_by_update_id, min_update_id)
+
+    def get_scoreboard(self) -> Scoreboard:
+        return _make_scoreboard(self.quiz_id, list(self._teams.values()), self._team_points, self._totals)
+
+    def get_answer(self, *, question: int, team_id: int) -> Optional[Answer]:
+        return self._answers.get((question, team_id))
+
+    def get_answers(self, *, team_id: Optional[int], min_update_id: int) -> List[Answer]:
+        answers = self._since(self._answers_by_update_id, min_update_id)
+        if team_id is not None:
+            answers = [a for a in answers if a.team_id == team_id]
+        return answers
+
+
+_DB_CALL_SECONDS = metrics.Histogram('quiz_db_call_seconds', 'Duration of QuizDb calls.', ['method'])
+
+
 class QuizDb:
-    def __init__(self, *, db_path: str):
+    def __init__(self, *, db_path: str, profile: str = DEFAULT_DB_PROFILE, max_readers: int = 4,
+                 notify_debounce: float = 0.0):
+        """Subscribers are notified of changes at most once per notify_debounce seconds, see UpdateNotifier."""
+        if profile not in DB_PROFILES:
+            raise ValueError(f'Unknown database profile "{profile}". '
+                             f'Supported profiles: {", ".join(sorted(DB_PROFILES))}.')
         self.db_path = db_path
-        self._lock = threading.Lock()
-        self._db_lock = threading.Lock()
-        self.create_if_not_exists()
-        self._subscribers: Set[Callable[[], None]] = set()
+        self._db_lock = metrics.TimedLock('quiz_db')
+        self._pool = ConnectionPool(db_path=db_path, max_readers=max_readers, profile=DB_PROFILES[profile])
+        try:
+            self.create_if_not_exists()
+        except Exception:
+            self._pool.close()
+            raise
+        # Teams and answers share one sequence of update ids, so that a single cursor covers both.
+        # It lives in memory, nobody else may write teams or answers to the database file meanwhile.
+        self._last_update_id = self._select_last_update_id()
+        self._notifier = UpdateNotifier(debounce=notify_debounce, name='QuizDbNotifier')
+        self._cache_lock = threading.Lock()
+        self._cache: Optional[_QuizCache] = None
+
+    def close(self) -> None:
+        self._notifier.close()
+        with self._db_lock:
+            self._pool.close()
 
     def _on_update(self):
-        for sub in self._subscribers:
-            try:
-                sub()
-            except Exception:
-                logging.exception('Subscriber raised an error.')
+        self._notifier.notify()
+
+    @property
+    def last_update_id(self) -> int:
+        """The update id of the latest committed change of teams or answers."""
+        return self._last_update_id
 
     def add_updates_subscriber(self, callback: Callable[[], None]) -> None:
-        with self._lock:
-            self._subscribers.add(callback)
+        self._notifier.add_subscriber(callback)
 
     def remove_updates_subscriber(self, callback: Callable[[], None]) -> None:
-        with self._lock:
-            self._subscribers.remove(callback)
-
+        self._notifier.remove_subscriber(callback)
+
+    def flush_updates(self) -> None:
+        """Waits until subscribers have been notified of every change made before."""
+        self._notifier.flush()
+
+    @_DB_CALL_SECONDS.timed
+    def set_active_quiz(self, quiz_id: Optional[str]) -> None:
+        """Keeps teams and answers of the quiz in memory, so that reading them never touches the disk.
+
+        Writes made through this QuizDb go to both the database and the memory.
+        Writes made to the database file by anybody else are not seen until the quiz is activated again.
+        """
+        with self._db_lock:
+            cache = None
+            if quiz_id:
+                cache = _QuizCache(quiz_id)
+                with self._pool.reader() as db:
+                    for (update_id, id, name, timestamp) in db.execute(
+                            'SELECT update_id, id, name, timestamp FROM teams WHERE quiz_id = ? ORDER BY update_id',
+                            (quiz_id,)):
+                        cache.put_team(Team(update_id=update_id, quiz_id=quiz_id, id=id, name=name,
+                                            timestamp=timestamp))
+                    for (update_id, question, team_id, answer, timestamp, points) in db.execute(
+                            'SELECT update_id, question, team_id, answer, timestamp, points '
+                            'FROM answers WHERE quiz_id = ? ORDER BY update_id', (quiz_id,)):
+                        cache.put_answer(Answer(update_id=update_id, quiz_id=quiz_id, question=question,
+                                                team_id=team_id, answer=answer, timestamp=timestamp, points=points))
+            with self._cache_lock:
+                self._cache = cache
+
+    def _get_cache(self, quiz_id: str) -> Optional[_QuizCache]:
+        cache = self._cache
+        return cache if cache and quiz_id and cache.quiz_id == quiz_id else None
+
+    @_DB_CALL_SECONDS.timed
     def get_answers(self, quiz_id: str, *, team_id: Optional[int] = None, min_update_id: int = 0) -> List[Answer]:
+        with self._cache_lock:
+            cache = self._get_cache(quiz_id)
+            if cache:
+                return cache.get_answers(team_id=team_id, min_update_id=min_update_id)
+
         conditions = []
         params = []
 
@@ -78,7 +358,7 @@ class QuizDb:
         condition = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
 
         answers: List[Answer] = []
-        with contextlib.closing(sqlite3.connect(self.db_path)) as db:
+        with self._pool.reader() as db:
             with db:
                 cursor = db.execute(
                     'SELECT update_id, quiz_id, question, team_id, answer, timestamp, points FROM answers '
@@ -94,86 +374,148 @@ class QuizDb:
                                           points=points))
         return answers
 
-    def _select_answer(self, *, db: sqlite3.Connection, quiz_id: str, question: int, team_id: int) -> Tuple[int, int]:
-        return db.execute('SELECT update_id, timestamp '
-                          'FROM answers '
-                          'WHERE quiz_id = ? AND question = ? AND team_id = ?',
-                          (quiz_id, question, team_id)).fetchone() or (0, 0)
-
-    def _get_next_answer_update_id(self, db: sqlite3.Connection) -> int:
-        (update_id,) = db.execute('SELECT MAX(update_id) FROM answers').fetchone()
-        return update_id + 1 if update_id else 1
+    def _put_into_cache(self, item: Union[Team, Answer]) -> None:
+        with self._cache_lock:
+            cache = self._get_cache(item.quiz_id)
+            if not cache:
+                return
+            if isinstance(item, Team):
+                cache.put_team(item)
+            else:
+                cache.put_answer(item)
+
+    def _select_last_update_id(self) -> int:
+        with self._pool.reader() as db:
+            (update_id,) = db.execute('SELECT MAX(update_id) FROM '
+                                      '(SELECT MAX(update_id) AS update_id FROM teams '
+                                      'UNION ALL SELECT MAX(update_id) FROM answers)').fetchone()
+        return update_id or 0
 
     def update_answer(self, *, quiz_id: str, question: int, team_id: int, answer: str, answer_time: int) -> int:
-        with self._db_lock, contextlib.closing(sqlite3.connect(self.db_path)) as db:
+        return self.update_answers([Answer(quiz_id=quiz_id, question=question, team_id=team_id, answer=answer,
+                                           timestamp=answer_time)])[0]
+
+    @_DB_CALL_SECONDS.timed
+    def update_answers(self, answers: List[Answer]) -> List[int]:
+        """Upserts answers in one transaction and returns their update ids, 0 for answers older than the stored ones.
+
+        Answers of one team to one question are coalesced into a single write of the latest of them.
+        The earlier ones get the update id of that write, unless they are older than an answer before them
+        or than the stored answer, the same as if the answers were written one by one.
+        Points and update ids of the given answers are ignored, points of updated answers are reset.
+        Subscribers are notified once for the whole batch.
+        """
+        # Index of the answer to write for every (quiz_id, question, team_id), in the order of first appearance.
+        latest: Dict[Tuple[str, int, int], int] = {}
+        # Whether the i-th answer would have been written one by one, that is not older than an answer before it.
+        accepted: List[bool] = []
+        for i, a in enumerate(answers):
+            key = (a.quiz_id, a.question, a.team_id)
+            j = latest.get(key)
+            # Same as in the database, an answer is not overwritten by an older one.
+            if j is None or a.timestamp >= answers[j].timestamp:
+                latest[key] = i
+            accepted.append(latest[key] == i)
+
+        written: Dict[int, Answer] = {}
+        # Timestamps of the answers stored before the batch, coalesced answers older than them are outdated.
+        stored_timestamps: Dict[Tuple[str, int, int], int] = {}
+        with self._db_lock, self._pool.writer() as db:
+            last_update_id = self._last_update_id
             with db:
-                (update_id, timestamp,) = self._select_answer(
-                    db=db, quiz_id=quiz_id, question=question, team_id=team_id)
-
-                # Don't update the answer if it's older than the current one.
-                if timestamp > answer_time:
-                    return 0
-
-                new_update_id = self._get_next_answer_update_id(db)
-
-                if update_id:
-                    db.execute('UPDATE answers '
-                               'SET update_id = ?, answer = ?, timestamp = ?, points = NULL '
-                               'WHERE update_id = ?',
-                               (new_update_id, answer, answer_time, update_id))
-                else:
-                    db.execute('INSERT INTO answers (update_id, quiz_id, question, team_id, answer, timestamp) '
-                               'VALUES (?, ?, ?, ?, ?, ?)',
-                               (new_update_id, quiz_id, question, team_id, answer, answer_time))
-
-        self._on_update()
-        return new_update_id
-
+                for key, i in latest.items():
+                    a = answers[i]
+                    new_update_id = last_update_id + 1
+                    # Upserts are a read and a write, since ON CONFLICT needs SQLite 3.24.
+                    stored = db.execute('SELECT timestamp FROM answers WHERE quiz_id = ? AND question = ? AND team_id = ?',
+                                        key).fetchone()
+                    if stored is None:
+                        db.execute('INSERT INTO answers (update_id, quiz_id, question, team_id, answer, timestamp) '
+                                   'VALUES (?, ?, ?, ?, ?, ?)',
+                                   (new_update_id, a.quiz_id, a.question, a.team_id, a.answer, a.timestamp))
+                    else:
+                        stored_timestamps[key] = stored[0]
+                        # Don't update the answer if it's older than the current one.
+                        if a.timestamp < stored[0]:
+                            continue
+                        db.execute('UPDATE answers SET update_id = ?, answer = ?, timestamp = ?, points = NULL '
+                                   'WHERE quiz_id = ? AND question = ? AND team_id = ?',
+                                   (new_update_id, a.answer, a.timestamp, a.quiz_id, a.question, a.team_id))
+                    last_update_id = new_update_id
+                    written[i] = Answer(update_id=new_update_id, quiz_id=a.quiz_id, question=a.question,
+                                        team_id=a.team_id, answer=a.answer, timestamp=a.timestamp)
+            if written:
+                # Update ids are taken only once the transaction has been committed.
+                self._last_update_id = last_update_id
+                for answer in written.values():
+                    self._put_into_cache(answer)
+
+        update_ids: List[int] = []
+        for a, a_accepted in zip(answers, accepted):
+            key = (a.quiz_id, a.question, a.team_id)
+            answer = written.get(latest[key])
+            outdated = a.timestamp < stored_timestamps.get(key, a.timestamp)
+            update_ids.append(answer.update_id if a_accepted and answer and not outdated else 0)
+        if written:
+            self._on_update()
+        return update_ids
+
+    @_DB_CALL_SECONDS.timed
     def set_answer_points(self, *, quiz_id: str, question: int, team_id: int, points: int) -> int:
-        with self._db_lock, contextlib.closing(sqlite3.connect(self.db_path)) as db:
+        with self._db_lock, self._pool.writer() as db:
+            new_update_id = self._last_update_id + 1
             with db:
-                (update_id, _) = self._select_answer(
-                    db=db, quiz_id=quiz_id, question=question, team_id=team_id)
-
-                new_update_id = self._get_next_answer_update_id(db)
-
-                if update_id:
-                    db.execute('UPDATE answers '
-                               'SET update_id = ?, points = ? '
-                               'WHERE update_id = ?',
-                               (new_update_id, points, update_id))
-                else:
+                # Updated first and inserted only if there is no answer to update, without ON CONFLICT.
+                updated = db.execute('UPDATE answers SET update_id = ?, points = ? '
+                                     'WHERE quiz_id = ? AND question = ? AND team_id = ?',
+                                     (new_update_id, points, quiz_id, question, team_id)).rowcount
+                if not updated:
                     db.execute('INSERT INTO answers (update_id, quiz_id, question, team_id, answer, timestamp, points) '
-                               'VALUES (?, ?, ?, ?, "", 0, ?)',
+                               "VALUES (?, ?, ?, ?, '', 0, ?)",
                                (new_update_id, quiz_id, question, team_id, points))
+            self._last_update_id = new_update_id
+            with self._cache_lock:
+                cache = self._get_cache(quiz_id)
+                if cache:
+                    # Only the cache needs the rest of the answer, the database already has it.
+                    old_answer = cache.get_answer(question=question, team_id=team_id)
+                    cache.put_answer(Answer(update_id=new_update_id, quiz_id=quiz_id, question=question,
+                                            team_id=team_id, answer=old_answer.answer if old_answer else '',
+                                            timestamp=old_answer.timestamp if old_answer else 0, points=points))
 
         self._on_update()
         return new_update_id
 
+    @_DB_CALL_SECONDS.timed
     def update_team(self, quiz_id: str, team_id: int, name: str, registration_time: int) -> int:
-        with self._db_lock, contextlib.closing(sqlite3.connect(self.db_path)) as db:
+        with self._db_lock, self._pool.writer() as db:
+            new_update_id = self._last_update_id + 1
             with db:
-                (update_id, timestamp) = db.execute('SELECT update_id, timestamp FROM teams WHERE quiz_id = ? AND id = ?',
-                                                    (quiz_id, team_id)).fetchone() or (0, 0)
-                if timestamp > registration_time:
-                    return 0
-
-                (last_update_id,) = db.execute(
-                    'SELECT MAX(update_id) FROM teams').fetchone()
-                new_update_id = (last_update_id or 0) + 1
-
-                if update_id:
-                    db.execute('UPDATE teams SET update_id = ?, name = ?, timestamp = ? WHERE update_id = ?',
-                               (new_update_id, name, registration_time, update_id))
-                else:
-                    db.execute('INSERT INTO teams'
-                               '(update_id, quiz_id, id, name, timestamp)'
-                               'VALUES (?, ?, ?, ?, ?)',
+                # Same as for answers, the stored team is read first instead of using ON CONFLICT.
+                stored = db.execute('SELECT timestamp FROM teams WHERE quiz_id = ? AND id = ?',
+                                    (quiz_id, team_id)).fetchone()
+                changed = stored is None or registration_time >= stored[0]
+                if stored is None:
+                    db.execute('INSERT INTO teams (update_id, quiz_id, id, name, timestamp) VALUES (?, ?, ?, ?, ?)',
                                (new_update_id, quiz_id, team_id, name, registration_time))
+                elif changed:
+                    db.execute('UPDATE teams SET update_id = ?, name = ?, timestamp = ? WHERE quiz_id = ? AND id = ?',
+                               (new_update_id, name, registration_time, quiz_id, team_id))
+            if not changed:
+                return 0
+            self._last_update_id = new_update_id
+            self._put_into_cache(Team(update_id=new_update_id, quiz_id=quiz_id, id=team_id, name=name,
+                                      timestamp=registration_time))
         self._on_update()
         return new_update_id
 
+    @_DB_CALL_SECONDS.timed
     def get_teams(self, *, quiz_id: str, team_id: Optional[int] = None, min_update_id: int = 0) -> List[Team]:
+        with self._cache_lock:
+            cache = self._get_cache(quiz_id)
+            if cache:
+                return cache.get_teams(team_id=team_id, min_update_id=min_update_id)
+
         conditions = []
         params = []
 
@@ -192,7 +534,7 @@ class QuizDb:
         condition = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
 
         teams: List[Team] = []
-        with contextlib.closing(sqlite3.connect(self.db_path)) as db:
+        with self._pool.reader() as db:
             with db:
                 cursor = db.execute('SELECT update_id, quiz_id, id, name, timestamp '
                                     f'FROM teams {condition}', params)
@@ -206,54 +548,188 @@ class QuizDb:
                     ))
         return teams
 
+    @_DB_CALL_SECONDS.timed
+    def get_scoreboard(self, quiz_id: str) -> Scoreboard:
+        """Totals of the active quiz are kept in memory, those of other quizzes are summed up by the database."""
+        with self._cache_lock:
+            cache = self._get_cache(quiz_id)
+            if cache:
+                return cache.get_scoreboard()
+
+        team_points: Dict[int, Dict[int, int]] = {}
+        totals: Dict[int, int] = {}
+        with self._pool.reader() as db:
+            with db:
+                for (team_id, question, points) in db.execute(
+                        'SELECT team_id, question, points FROM answers WHERE quiz_id = ? AND points IS NOT NULL',
+                        (quiz_id,)):
+                    team_points.setdefault(team_id, {})[question] = points
+                    totals[team_id] = totals.get(team_id, 0) + points
+        return _make_scoreboard(quiz_id, self.get_teams(quiz_id=quiz_id), team_points, totals)
+
+    @_DB_CALL_SECONDS.timed
+    def get_correct_questions(self, quiz_id: str) -> Dict[int, List[int]]:
+        """Questions answered with points by every team of the quiz, in one query. Teams without points are omitted."""
+        questions: Dict[int, List[int]] = {}
+        with self._pool.reader() as db:
+            with db:
+                cursor = db.execute('SELECT team_id, question FROM answers WHERE quiz_id = ? AND points '
+                                    'ORDER BY team_id, question', (quiz_id,))
+                for (team_id, question) in cursor:
+                    questions.setdefault(team_id, []).append(question)
+        return questions
+
     def insert_message(self, message: Message):
-        insert_timestamp = message.insert_timestamp or int(
-            datetime.utcnow().timestamp())
-        with contextlib.closing(sqlite3.connect(self.db_path)) as db:
+        self.insert_messages([message])
+
+    @_DB_CALL_SECONDS.timed
+    def insert_messages(self, messages: List[Message]):
+        insert_timestamp = int(datetime.utcnow().timestamp())
+        with self._db_lock, self._pool.writer() as db:
             with db:
-                db.execute('''INSERT INTO messages
-                           (insert_timestamp, timestamp, update_id, chat_id, text)
-                           VALUES (?, ?, ?, ?, ?)''',
-                           (insert_timestamp, message.timestamp, message.update_id, message.chat_id, message.text))
+                db.executemany('''INSERT INTO messages
+                               (insert_timestamp, timestamp, update_id, chat_id, text)
+                               VALUES (?, ?, ?, ?, ?)''',
+                               ((m.insert_timestamp or insert_timestamp, m.timestamp, m.update_id, m.chat_id, m.text)
+                                for m in messages))
 
+    @_DB_CALL_SECONDS.timed
     def select_messages(self) -> List[Message]:
         messages: List[Message] = []
-        with contextlib.closing(sqlite3.connect(self.db_path)) as db:
-            db.row_factory = sqlite3.Row
+        with self._pool.reader() as db:
             with db:
                 cursor = db.execute(
                     'SELECT insert_timestamp, timestamp, update_id, chat_id, text FROM messages')
-                for row in cursor:
-                    message = Message(insert_timestamp=row['insert_timestamp'],
-                                      timestamp=row['timestamp'],
-                                      update_id=row['update_id'],
-                                      chat_id=row['chat_id'],
-                                      text=row['text'])
+                for (insert_timestamp, timestamp, update_id, chat_id, text) in cursor:
+                    message = Message(insert_timestamp=insert_timestamp,
+                                      timestamp=timestamp,
+                                      update_id=update_id,
+                                      chat_id=chat_id,
+                                      text=text)
                     messages.append(message)
         return messages
 
     def create_if_not_exists(self):
-        with contextlib.closing(sqlite3.connect(self.db_path)) as db:
+        with self._db_lock, self._pool.writer() as db:
             with db:
-                db.execute('''CREATE TABLE IF NOT EXISTS teams (
-                    update_id INTEGER PRIMARY KEY NOT NULL,
-                    quiz_id TEXT NOT NULL,
-                    id INTEGER NOT NULL,
-                    name TEXT NOT NULL,
-                    timestamp INTEGER NOT NULL,
-                    UNIQUE(quiz_id, id))''')
-                db.execute('''CREATE TABLE IF NOT EXISTS answers (
-                    update_id INTEGER PRIMARY KEY NOT NULL,
-                    quiz_id TEXT NOT NULL,
-                    question INTEGER NOT NULL,
-                    team_id INTEGER NOT NULL,
-                    answer TEXT NOT NULL,
-                    timestamp INTEGER NOT NULL,
-                    points INTEGER,
-                    UNIQUE(quiz_id, question, team_id))''')
-                db.execute('''CREATE TABLE IF NOT EXISTS messages (
-                    insert_timestamp INTEGER NOT NULL,
-                    timestamp INTEGER NOT NULL,
-                    update_id INTEGER NOT NULL,
-                    chat_id INTEGER NOT NULL,
-                    text TEXT NOT NULL)''')
+                db.execute('BEGIN IMMEDIATE')
+                db.execute('''CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY NOT NULL,
+                    timestamp INTEGER NOT NULL)''')
+                (version,) = db.execute('SELECT MAX(version) FROM schema_migrations').fetchone()
+                version = version or 0
+                if version > len(_MIGRATIONS):
+                    raise sqlite3.DatabaseError(f'Database schema version {version} is newer than '
+                                                f'the supported version {len(_MIGRATIONS)}.')
+
+                for version, statements in enumerate(_MIGRATIONS[version:], start=version + 1):
+                    _logger.info(f'Migrating database {self.db_path} to schema version {version}.')
+                    for statement in statements:
+                        db.execute(statement)
+                    db.execute('INSERT INTO schema_migrations (version, timestamp) VALUES (?, ?)',
+                               (version, int(datetime.utcnow().timestamp())))
+
+
+class _BatchedWriter:
+    """Writes items put from any thread to QuizDb from a background thread, many items per transaction.
+
+    A batch is written when it reaches max_batch_size items or when flush_interval seconds
+    have passed since its first item. stop() writes everything that was put before it.
+    """
+
+    _STOP = object()
+
+    def __init__(self, *, write: Callable[[List[Any]], None], name: str, max_batch_size: int = 100,
+                 flush_interval: float = 0.2, max_queue_size: int = 10000):
+        """write is called from the background thread with every batch, in the order the items were put."""
+        self._write = write
+        self._max_batch_size = max_batch_size
+        self._flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _put(self, item: Any) -> None:
+        # Blocks only when the database falls max_queue_size items behind.
+        self._queue.put(item)
+
+    def flush(self) -> None:
+        self._queue.join()
+
+    def stop(self) -> None:
+        self._queue.put(self._STOP)
+        self._thread.join()
+
+    def _next_batch(self) -> Tuple[List[Any], int, bool]:
+        batch: List[Any] = []
+        item = self._queue.get()
+        taken = 1
+        deadline = time.monotonic() + self._flush_interval
+        while True:
+            if item is self._STOP:
+                return batch, taken, True
+            batch.append(item)
+            timeout = deadline - time.monotonic()
+            if len(batch) >= self._max_batch_size or timeout <= 0:
+                return batch, taken, False
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                return batch, taken, False
+            taken += 1
+
+    def _run(self) -> None:
+        stopped = False
+        while not stopped:
+            batch, taken, stopped = self._next_batch()
+            try:
+                if batch:
+                    self._write(batch)
+            except Exception:
+                _logger.exception(f'Could not write {len(batch)} items.')
+            finally:
+                for _ in range(taken):
+                    self._queue.task_done()
+
+
+class BatchedMessageWriter(_BatchedWriter):
+    """Inserts messages into QuizDb from a background thread, many messages per transaction."""
+
+    def __init__(self, *, quiz_db: QuizDb, **kwargs):
+        super().__init__(write=quiz_db.insert_messages, name='BatchedMessageWriter', **kwargs)
+
+    def put(self, message: Message) -> None:
+        self._put(message)
+
+
+class BatchedAnswerWriter(_BatchedWriter):
+    """Upserts answers into QuizDb from a background thread, many answers per transaction.
+
+    on_done of every answer is called from the writer thread with the update id of the answer,
+    or 0 if the answer was older than the stored one or could not be written.
+    """
+
+    def __init__(self, *, quiz_db: QuizDb, max_batch_size: int = 100, flush_interval: float = 0.005, **kwargs):
+        # Teams wait for the confirmation of their answer, so batches are flushed much sooner than messages.
+        super().__init__(write=self._write_answers, name='BatchedAnswerWriter', max_batch_size=max_batch_size,
+                         flush_interval=flush_interval, **kwargs)
+        self._quiz_db = quiz_db
+
+    def put(self, answer: Answer, on_done: Optional[Callable[[int], None]] = None) -> None:
+        self._put((answer, on_done))
+
+    def _write_answers(self, batch: List[Tuple[Answer, Optional[Callable[[int], None]]]]) -> None:
+        try:
+            update_ids = self._quiz_db.update_answers([answer for (answer, _) in batch])
+        except Exception:
+            _logger.exception(f'Could not write {len(batch)} answers.')
+            update_ids = [0] * len(batch)
+        for (_, on_done), update_id in zip(batch, update_ids):
+            if not on_done:
+                continue
+            try:
+                on_done(update_id)
+            except Exception:
+                _logger.exception('Answer callback raised an error.')
@@ -1,5 +1,8 @@
-from quiz_db import Answer, Message, QuizDb, Team
+import contextlib
+from quiz_db import (_MIGRATIONS, Answer, BatchedAnswerWriter, BatchedMessageWriter, ConnectionPool, DB_PROFILES,
+                     Message, QuizDb, Scoreboard, Team)
 import tempfile
+import threading
 from typing import Any, Dict, List
 import unittest
 from unittest.mock import MagicMock
@@ -24,6 +27,7 @@ class BaseTestCase(unittest.TestCase):
         self.quiz_db = QuizDb(db_path=self.db_path)
 
     def tearDown(self):
+        self.quiz_db.close()
         self.test_dir.cleanup()
 
     def _select_answers(self):
@@ -37,6 +41,11 @@ class BaseTestCase(unittest.TestCase):
                 db.executemany('INSERT INTO answers '
                                'VALUES (:update_id, :quiz_id, :question, :team_id, :answer, :timestamp, :points)', values)
 
+    def _reopen_quiz_db(self):
+        # QuizDb reads the last update id only when it is created.
+        self.quiz_db.close()
+        self.quiz_db = QuizDb(db_path=self.db_path)
+
     def _select_teams(self):
         with sqlite3.connect(self.db_path) as db:
             return db.execute('SELECT update_id, quiz_id, id, name, timestamp FROM teams').fetchall()
@@ -79,6 +88,17 @@ class QuizDbTest(BaseTestCase):
             (124, 1234568, 1002, 2002, 'Unicode Юнікод 😎')
         ], self._select_messages())
 
+    def test_insert_messages(self):
+        self.quiz_db.insert_messages([
+            Message(timestamp=1234567, update_id=1001, chat_id=2001, text='Apple', insert_timestamp=123),
+            Message(timestamp=1234568, update_id=1002, chat_id=2002, text='Banana', insert_timestamp=124),
+        ])
+
+        self.assertListEqual([
+            (123, 1234567, 1001, 2001, 'Apple'),
+            (124, 1234568, 1002, 2002, 'Banana'),
+        ], self._select_messages())
+
     def test_get_teams_by_quiz_id(self):
         self._insert_into_teams(_INITIAL_TEAMS)
         teams = self.quiz_db.get_teams(quiz_id='test')
@@ -130,6 +150,218 @@ class QuizDbTest(BaseTestCase):
         self.assertListEqual(sorted([]), sorted(teams))
 
 
+class BatchedMessageWriterTest(BaseTestCase):
+    def _message(self, update_id: int) -> Message:
+        return Message(timestamp=1000 + update_id, update_id=update_id, chat_id=2001,
+                       text=f'Message {update_id}', insert_timestamp=123)
+
+    def test_writes_in_batches(self):
+        self.quiz_db.insert_messages = MagicMock(wraps=self.quiz_db.insert_messages)
+        writer = BatchedMessageWriter(quiz_db=self.quiz_db, max_batch_size=3, flush_interval=10)
+        for update_id in range(7):
+            writer.put(self._message(update_id))
+        writer.start()
+        writer.stop()
+
+        self.assertListEqual([3, 3, 1], [len(c[0][0]) for c in self.quiz_db.insert_messages.call_args_list])
+        self.assertListEqual([(123, 1000 + i, i, 2001, f'Message {i}') for i in range(7)], self._select_messages())
+
+    def test_flushes_after_interval(self):
+        writer = BatchedMessageWriter(quiz_db=self.quiz_db, max_batch_size=100, flush_interval=0.05)
+        writer.start()
+        writer.put(self._message(1))
+        writer.flush()
+
+        self.assertListEqual([(123, 1001, 1, 2001, 'Message 1')], self._select_messages())
+        writer.stop()
+
+    def test_stop_writes_pending_messages(self):
+        writer = BatchedMessageWriter(quiz_db=self.quiz_db, max_batch_size=100, flush_interval=10)
+        writer.start()
+        writer.put(self._message(1))
+        writer.put(self._message(2))
+        writer.stop()
+
+        self.assertEqual(2, len(self._select_messages()))
+
+    def test_survives_db_errors(self):
+        self.quiz_db.insert_messages = MagicMock(side_effect=[sqlite3.OperationalError('locked'), None])
+        writer = BatchedMessageWriter(quiz_db=self.quiz_db, max_batch_size=1, flush_interval=10)
+        writer.start()
+        writer.put(self._message(1))
+        writer.put(self._message(2))
+        writer.stop()
+
+        self.assertEqual(2, self.quiz_db.insert_messages.call_count)
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.pool = ConnectionPool(db_path=os.path.join(self.test_dir.name, 'pool.db'), max_readers=2)
+
+    def tearDown(self):
+        self.pool.close()
+        self.test_dir.cleanup()
+
+    def test_reuses_writer(self):
+        with self.pool.writer() as first:
+            pass
+        with self.pool.writer() as second:
+            pass
+        self.assertIs(first, second)
+
+    def test_reuses_readers(self):
+        with self.pool.reader() as first:
+            pass
+        with self.pool.reader() as second:
+            pass
+        self.assertIs(first, second)
+
+    def test_concurrent_readers_get_different_connections(self):
+        with self.pool.reader() as first, self.pool.reader() as second:
+            self.assertIsNot(first, second)
+
+    def test_readers_are_bounded(self):
+        acquired = threading.Event()
+
+        def _read():
+            with self.pool.reader():
+                acquired.set()
+
+        with self.pool.reader(), self.pool.reader():
+            thread = threading.Thread(target=_read)
+            thread.start()
+            self.assertFalse(acquired.wait(timeout=0.2))
+
+        thread.join()
+        self.assertTrue(acquired.is_set())
+
+    def test_readers_see_committed_writes(self):
+        with self.pool.reader() as reader:
+            reader.execute('SELECT 1').fetchall()
+        with self.pool.writer() as writer:
+            with writer:
+                writer.execute('CREATE TABLE t (x INTEGER)')
+                writer.execute('INSERT INTO t VALUES (1)')
+        with self.pool.reader() as reader:
+            self.assertListEqual([(1,)], reader.execute('SELECT x FROM t').fetchall())
+
+    def test_close(self):
+        with self.pool.reader() as reader:
+            pass
+        with self.pool.writer() as writer:
+            pass
+
+        self.pool.close()
+
+        self.assertRaises(sqlite3.ProgrammingError, reader.execute, 'SELECT 1')
+        self.assertRaises(sqlite3.ProgrammingError, writer.execute, 'SELECT 1')
+        with self.assertRaises(sqlite3.ProgrammingError):
+            with self.pool.reader():
+                pass
+
+
+class DbProfileTest(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.test_dir.name, 'quiz.db')
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def _get_pragmas(self, quiz_db: QuizDb):
+        with quiz_db._pool.reader() as db:
+            return tuple(db.execute(f'PRAGMA {pragma}').fetchone()[0]
+                         for pragma in ('journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store'))
+
+    def test_profiles(self):
+        expected = {
+            'strict': ('wal', 2, -2000, 0, 0),
+            'balanced': ('wal', 1, -16000, 64 * 1024 * 1024, 2),
+            'fast': ('wal', 0, -64000, 256 * 1024 * 1024, 2),
+        }
+        self.assertSetEqual(set(expected), set(DB_PROFILES))
+        for profile, pragmas in expected.items():
+            quiz_db = QuizDb(db_path=self.db_path, profile=profile)
+            self.assertTupleEqual(pragmas, self._get_pragmas(quiz_db), profile)
+            quiz_db.close()
+
+    def test_default_profile_is_wal(self):
+        quiz_db = QuizDb(db_path=self.db_path)
+        quiz_db.close()
+        with sqlite3.connect(self.db_path) as db:
+            self.assertEqual('wal', db.execute('PRAGMA journal_mode').fetchone()[0])
+
+    def test_unknown_profile(self):
+        self.assertRaisesRegex(ValueError, 'Unknown database profile', QuizDb, db_path=self.db_path, profile='unknown')
+
+
+class MigrationTest(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.test_dir.name, 'quiz.db')
+
+    def tearDown(self):
+        self.test_dir.cleanup()
+
+    def _select(self, query: str):
+        with contextlib.closing(sqlite3.connect(self.db_path)) as db:
+            return db.execute(query).fetchall()
+
+    def _get_indexes(self):
+        return sorted(name for (name,) in self._select(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"))
+
+    def test_creates_new_database(self):
+        QuizDb(db_path=self.db_path).close()
+
+        self.assertListEqual([1, 2], [v for (v,) in self._select('SELECT version FROM schema_migrations')])
+        self.assertListEqual(['answers_quiz_id_team_id', 'answers_quiz_id_update_id', 'teams_quiz_id_update_id'],
+                             self._get_indexes())
+
+    def test_upgrades_existing_database(self):
+        with contextlib.closing(sqlite3.connect(self.db_path)) as db:
+            with db:
+                for statement in _MIGRATIONS[0]:
+                    db.execute(statement)
+                db.execute("INSERT INTO teams VALUES (1, 'test', 5001, 'Liverpool', 123)")
+
+        quiz_db = QuizDb(db_path=self.db_path)
+
+        self.assertListEqual([1, 2], [v for (v,) in self._select('SELECT version FROM schema_migrations')])
+        self.assertEqual(3, len(self._get_indexes()))
+        self.assertListEqual([Team(quiz_id='test', id=5001, name='Liverpool', timestamp=123)],
+                             quiz_db.get_teams(quiz_id='test'))
+        quiz_db.close()
+
+    def test_migrates_once(self):
+        QuizDb(db_path=self.db_path).close()
+        QuizDb(db_path=self.db_path).close()
+
+        self.assertListEqual([1, 2], [v for (v,) in self._select('SELECT version FROM schema_migrations')])
+
+    def test_uses_indexes(self):
+        QuizDb(db_path=self.db_path).close()
+
+        plan = self._select('EXPLAIN QUERY PLAN SELECT update_id, quiz_id, id, name, timestamp FROM teams '
+                            "WHERE quiz_id = 'test' AND update_id >= 5")
+        self.assertIn('teams_quiz_id_update_id', str(plan))
+        plan = self._select('EXPLAIN QUERY PLAN SELECT * FROM answers '
+                            "WHERE quiz_id = 'test' AND update_id >= 5")
+        self.assertIn('answers_quiz_id_update_id', str(plan))
+        plan = self._select("EXPLAIN QUERY PLAN SELECT * FROM answers WHERE quiz_id = 'test' AND team_id = 5")
+        self.assertIn('answers_quiz_id_team_id', str(plan))
+
+    def test_newer_schema_version(self):
+        QuizDb(db_path=self.db_path).close()
+        with contextlib.closing(sqlite3.connect(self.db_path)) as db:
+            with db:
+                db.execute('INSERT INTO schema_migrations VALUES (100, 0)')
+
+        self.assertRaisesRegex(sqlite3.DatabaseError, 'newer', QuizDb, db_path=self.db_path)
+
+
 class GetAnswersSanityTest(BaseTestCase):
 
     def setUp(self):
@@ -170,6 +402,146 @@ class GetAnswersSanityTest(BaseTestCase):
         ]), sorted(answers))
 
 
+class ActiveQuizCacheTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self._insert_into_teams(_INITIAL_TEAMS)
+        self._insert_into_answers([
+            dict(update_id=2, quiz_id='test', question=5, team_id=5001,
+                 answer='Apple', timestamp=123, points=4),
+            dict(update_id=3, quiz_id='ignored', question=5, team_id=5001,
+                 answer='Ignored', timestamp=321, points=1),
+            dict(update_id=4, quiz_id='test', question=9, team_id=5000,
+                 answer='Banana', timestamp=34, points=None),
+        ])
+        self._reopen_quiz_db()
+        self.quiz_db.set_active_quiz('test')
+
+    def test_warms_from_db(self):
+        self.assertListEqual([
+            Team(update_id=2, quiz_id='test', id=5001, name='Unicode Юнікод 😎', timestamp=123),
+            Team(update_id=4, quiz_id='test', id=5000, name='Another team', timestamp=122),
+        ], self.quiz_db.get_teams(quiz_id='test'))
+        self.assertListEqual([
+            Answer(update_id=2, quiz_id='test', question=5, team_id=5001, answer='Apple', timestamp=123, points=4),
+            Answer(update_id=4, quiz_id='test', question=9, team_id=5000, answer='Banana', timestamp=34),
+        ], self.quiz_db.get_answers(quiz_id='test'))
+
+    def test_reads_do_not_touch_db(self):
+        self._insert_into_teams([dict(update_id=10, quiz_id='test', id=5002, name='Unseen', timestamp=1)])
+
+        self.assertEqual(2, len(self.quiz_db.get_teams(quiz_id='test')))
+        self.assertListEqual([], self.quiz_db.get_teams(quiz_id='test', team_id=5002))
+
+    def test_filters(self):
+        self.assertListEqual([Team(update_id=2, quiz_id='test', id=5001, name='Unicode Юнікод 😎', timestamp=123)],
+                             self.quiz_db.get_teams(quiz_id='test', team_id=5001))
+        self.assertListEqual([], self.quiz_db.get_teams(quiz_id='test', team_id=5001, min_update_id=3))
+        self.assertListEqual([Team(update_id=4, quiz_id='test', id=5000, name='Another team', timestamp=122)],
+                             self.quiz_db.get_teams(quiz_id='test', min_update_id=3))
+        self.assertListEqual([Answer(update_id=4, quiz_id='test', question=9, team_id=5000, answer='Banana',
+                                     timestamp=34)],
+                             self.quiz_db.get_answers(quiz_id='test', min_update_id=3))
+        self.assertListEqual([Answer(update_id=2, quiz_id='test', question=5, team_id=5001, answer='Apple',
+                                     timestamp=123, points=4)],
+                             self.quiz_db.get_answers(quiz_id='test', team_id=5001))
+
+    def test_write_through(self):
+        update_id = self.quiz_db.update_answer(quiz_id='test', question=5, team_id=5001, answer='Cherry',
+                                               answer_time=124)
+        points_update_id = self.quiz_db.set_answer_points(quiz_id='test', question=9, team_id=5000, points=1)
+        team_update_id = self.quiz_db.update_team(quiz_id='test', team_id=5002, name='New team',
+                                                  registration_time=1)
+
+        self.assertListEqual([
+            Answer(update_id=update_id, quiz_id='test', question=5, team_id=5001, answer='Cherry', timestamp=124),
+            Answer(update_id=points_update_id, quiz_id='test', question=9, team_id=5000, answer='Banana',
+                   timestamp=34, points=1),
+        ], self.quiz_db.get_answers(quiz_id='test'))
+        self.assertListEqual([
+            Team(update_id=team_update_id, quiz_id='test', id=5002, name='New team', timestamp=1),
+        ], self.quiz_db.get_teams(quiz_id='test', min_update_id=5))
+
+        cached_answers = self.quiz_db.get_answers(quiz_id='test')
+        cached_teams = self.quiz_db.get_teams(quiz_id='test')
+        self.quiz_db.set_active_quiz('test')
+        self.assertListEqual(cached_answers, self.quiz_db.get_answers(quiz_id='test'))
+        self.assertListEqual(cached_teams, self.quiz_db.get_teams(quiz_id='test'))
+
+    def test_other_quizzes_read_from_db(self):
+        self.quiz_db.update_answer(quiz_id='ignored', question=6, team_id=5001, answer='Cherry', answer_time=1)
+
+        self.assertEqual(2, len(self.quiz_db.get_answers(quiz_id='ignored')))
+        self.assertEqual(2, len(self.quiz_db.get_answers(quiz_id='test')))
+
+    def test_deactivate(self):
+        self._insert_into_teams([dict(update_id=10, quiz_id='test', id=5002, name='Seen', timestamp=1)])
+        self.quiz_db.set_active_quiz(None)
+
+        self.assertEqual(3, len(self.quiz_db.get_teams(quiz_id='test')))
+
+
+class GetCorrectQuestionsTest(BaseTestCase):
+    def test_groups_questions_by_team(self):
+        self._insert_into_answers([
+            dict(update_id=1, quiz_id='test', question=3, team_id=5001, answer='Apple', timestamp=1, points=1),
+            dict(update_id=2, quiz_id='test', question=1, team_id=5001, answer='Apple', timestamp=1, points=2),
+            dict(update_id=3, quiz_id='test', question=2, team_id=5001, answer='Apple', timestamp=1, points=0),
+            dict(update_id=4, quiz_id='test', question=1, team_id=5002, answer='Apple', timestamp=1, points=None),
+            dict(update_id=5, quiz_id='test', question=2, team_id=5003, answer='Apple', timestamp=1, points=1),
+            dict(update_id=6, quiz_id='other', question=1, team_id=5002, answer='Apple', timestamp=1, points=1),
+        ])
+
+        self.assertDictEqual({5001: [1, 3], 5003: [2]}, self.quiz_db.get_correct_questions('test'))
+
+
+class GetScoreboardTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self._insert_into_teams([
+            dict(update_id=1, quiz_id='test', id=5001, name='Liverpool', timestamp=1),
+            dict(update_id=2, quiz_id='test', id=5002, name='Arsenal', timestamp=1),
+            dict(update_id=3, quiz_id='test', id=5003, name='Chelsea', timestamp=1),
+            dict(update_id=4, quiz_id='other', id=5004, name='Other', timestamp=1),
+        ])
+        self._insert_into_answers([
+            dict(update_id=5, quiz_id='test', question=1, team_id=5001, answer='Apple', timestamp=1, points=1),
+            dict(update_id=6, quiz_id='test', question=3, team_id=5001, answer='Apple', timestamp=1, points=2),
+            dict(update_id=7, quiz_id='test', question=1, team_id=5002, answer='Apple', timestamp=1, points=0),
+            dict(update_id=8, quiz_id='test', question=2, team_id=5002, answer='Apple', timestamp=1, points=None),
+            dict(update_id=9, quiz_id='test', question=2, team_id=5003, answer='Apple', timestamp=1, points=3),
+            dict(update_id=10, quiz_id='other', question=4, team_id=5004, answer='Apple', timestamp=1, points=1),
+        ])
+        self._reopen_quiz_db()
+
+    # Teams with equal totals are ordered by name.
+    _EXPECTED = Scoreboard(quiz_id='test', questions=3, team_ids=[5003, 5001, 5002],
+                           names=['Chelsea', 'Liverpool', 'Arsenal'], totals=[3, 3, 0],
+                           points=[[None, 3, None], [1, None, 2], [0, None, None]])
+
+    def test_sums_up_points_in_db(self):
+        self.assertEqual(self._EXPECTED, self.quiz_db.get_scoreboard('test'))
+
+    def test_keeps_totals_of_active_quiz(self):
+        self.quiz_db.set_active_quiz('test')
+        self.assertEqual(self._EXPECTED, self.quiz_db.get_scoreboard('test'))
+
+        self.quiz_db.set_answer_points(quiz_id='test', question=2, team_id=5002, points=5)
+        self.quiz_db.update_answer(quiz_id='test', question=3, team_id=5001, answer='Banana', answer_time=2)
+        self.quiz_db.set_answer_points(quiz_id='test', question=4, team_id=5003, points=1)
+
+        expected = Scoreboard(quiz_id='test', questions=4, team_ids=[5002, 5003, 5001],
+                              names=['Arsenal', 'Chelsea', 'Liverpool'], totals=[5, 4, 1],
+                              points=[[0, 5, None, None], [None, 3, None, 1], [1, None, None, None]])
+        self.assertEqual(expected, self.quiz_db.get_scoreboard('test'))
+        self.quiz_db.set_active_quiz(None)
+        self.assertEqual(expected, self.quiz_db.get_scoreboard('test'))
+
+    def test_no_teams(self):
+        self.assertEqual(Scoreboard(quiz_id='none', questions=0, team_ids=[], names=[], totals=[], points=[]),
+                         self.quiz_db.get_scoreboard('none'))
+
+
 class GetAnswersManyItemsTest(BaseTestCase):
 
     def setUp(self):
@@ -230,11 +602,12 @@ class UpdateAnswerTest(BaseTestCase):
         sub.assert_called_with()
 
     def test_updates_old_answer_and_resets_points(self):
+        self._insert_into_answers([dict(update_id=2, quiz_id='test', question=5, team_id=5001,
+                                        answer='Apple', timestamp=123, points=4)])
+        self._reopen_quiz_db()
         sub = MagicMock()
         self.quiz_db.add_updates_subscriber(sub)
 
-        self._insert_into_answers([dict(update_id=2, quiz_id='test', question=5, team_id=5001,
-                                        answer='Apple', timestamp=123, points=4)])
         update_id = self.quiz_db.update_answer(quiz_id='test', question=5, team_id=5001,
                                                answer='Unicode Юнікод 😎', answer_time=124)
 
@@ -246,10 +619,11 @@ class UpdateAnswerTest(BaseTestCase):
         sub.assert_called_with()
 
     def test_outdated_answer(self):
-        sub = MagicMock()
-        self.quiz_db.add_updates_subscriber(sub)
         self._insert_into_answers([dict(update_id=2, quiz_id='test', question=5, team_id=5001,
                                         answer='Apple', timestamp=123, points=4)])
+        self._reopen_quiz_db()
+        sub = MagicMock()
+        self.quiz_db.add_updates_subscriber(sub)
 
         update_id = self.quiz_db.update_answer(quiz_id='test', question=5, team_id=5001,
                                                answer='Unicode Юнікод 😎', answer_time=122)
@@ -262,11 +636,154 @@ class UpdateAnswerTest(BaseTestCase):
         sub.assert_not_called()
 
 
-class UpdateAnswerPointsTest(BaseTestCase):
+class UpdateAnswersTest(BaseTestCase):
+    def test_writes_batch(self):
+        self.quiz_db.update_answer(quiz_id='test', question=1, team_id=5002, answer='Apple', answer_time=125)
+        sub = MagicMock()
+        self.quiz_db.add_updates_subscriber(sub)
 
-    def test_updates_points(self):
+        update_ids = self.quiz_db.update_answers([
+            Answer(quiz_id='test', question=1, team_id=5001, answer='Banana', timestamp=123),
+            Answer(quiz_id='test', question=1, team_id=5002, answer='Outdated', timestamp=124),
+            Answer(quiz_id='test', question=2, team_id=5001, answer='Cherry', timestamp=126),
+        ])
+
+        self.assertListEqual([2, 0, 3], update_ids)
+        self.assertListEqual([
+            (1, 'test', 1, 5002, 'Apple', 125, None),
+            (2, 'test', 1, 5001, 'Banana', 123, None),
+            (3, 'test', 2, 5001, 'Cherry', 126, None),
+        ], self._select_answers())
+        sub.assert_called_once_with()
+
+    def test_updates_cache(self):
+        self.quiz_db.set_active_quiz('test')
+
+        self.quiz_db.update_answers([
+            Answer(quiz_id='test', question=1, team_id=5001, answer='Banana', timestamp=123),
+        ])
+
+        self.assertListEqual([Answer(quiz_id='test', question=1, team_id=5001, answer='Banana', timestamp=123)],
+                             self.quiz_db.get_answers('test', min_update_id=1))
+
+    def test_failed_batch_does_not_use_update_ids(self):
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.quiz_db.update_answers([
+                Answer(quiz_id='test', question=1, team_id=5001, answer='Banana', timestamp=123),
+                Answer(quiz_id='test', question=1, team_id=5002, answer=None, timestamp=123),
+            ])
+
+        self.assertListEqual([], self._select_answers())
+        self.assertEqual(1, self.quiz_db.update_answer(
+            quiz_id='test', question=1, team_id=5001, answer='Banana', answer_time=123))
+
+    def test_coalesces_answers_of_one_team(self):
+        self.quiz_db.update_answer(quiz_id='test', question=1, team_id=5002, answer='Stored', answer_time=125)
         sub = MagicMock()
         self.quiz_db.add_updates_subscriber(sub)
+
+        update_ids = self.quiz_db.update_answers([
+            Answer(quiz_id='test', question=1, team_id=5001, answer='Apple', timestamp=123),
+            Answer(quiz_id='test', question=1, team_id=5002, answer='Outdated', timestamp=124),
+            Answer(quiz_id='test', question=1, team_id=5001, answer='Banana', timestamp=122),
+            Answer(quiz_id='test', question=2, team_id=5001, answer='Cherry', timestamp=124),
+            Answer(quiz_id='test', question=1, team_id=5001, answer='Durian', timestamp=126),
+            Answer(quiz_id='test', question=1, team_id=5002, answer='Elderberry', timestamp=126),
+        ])
+
+        self.assertListEqual([2, 0, 0, 4, 2, 3], update_ids)
+        self.assertListEqual([
+            (2, 'test', 1, 5001, 'Durian', 126, None),
+            (3, 'test', 1, 5002, 'Elderberry', 126, None),
+            (4, 'test', 2, 5001, 'Cherry', 124, None),
+        ], self._select_answers())
+        sub.assert_called_once_with()
+
+    def test_coalesced_outdated_answers(self):
+        self.quiz_db.update_answer(quiz_id='test', question=1, team_id=5001, answer='Stored', answer_time=125)
+        sub = MagicMock()
+        self.quiz_db.add_updates_subscriber(sub)
+
+        update_ids = self.quiz_db.update_answers([
+            Answer(quiz_id='test', question=1, team_id=5001, answer='Apple', timestamp=123),
+            Answer(quiz_id='test', question=1, team_id=5001, answer='Banana', timestamp=124),
+        ])
+
+        self.assertListEqual([0, 0], update_ids)
+        self.assertListEqual([(1, 'test', 1, 5001, 'Stored', 125, None)], self._select_answers())
+        sub.assert_not_called()
+
+    def test_coalesced_answer_older_than_stored(self):
+        self.quiz_db.update_answer(quiz_id='test', question=1, team_id=5001, answer='Stored', answer_time=4)
+
+        update_ids = self.quiz_db.update_answers([
+            Answer(quiz_id='test', question=1, team_id=5001, answer='Apple', timestamp=3),
+            Answer(quiz_id='test', question=1, team_id=5001, answer='Banana', timestamp=5),
+        ])
+
+        self.assertListEqual([0, 2], update_ids)
+        self.assertListEqual([(2, 'test', 1, 5001, 'Banana', 5, None)], self._select_answers())
+
+
+class BatchedAnswerWriterTest(BaseTestCase):
+    def _answer(self, team_id: int, timestamp: int) -> Answer:
+        return Answer(quiz_id='test', question=1, team_id=team_id, answer=f'Answer {timestamp}', timestamp=timestamp)
+
+    def test_writes_in_batches(self):
+        self.quiz_db.update_answers = MagicMock(wraps=self.quiz_db.update_answers)
+        writer = BatchedAnswerWriter(quiz_db=self.quiz_db, max_batch_size=2, flush_interval=10)
+        for team_id in range(5):
+            writer.put(self._answer(team_id, 100))
+        writer.start()
+        writer.stop()
+
+        self.assertListEqual([2, 2, 1], [len(c[0][0]) for c in self.quiz_db.update_answers.call_args_list])
+        self.assertEqual(5, len(self._select_answers()))
+
+    def test_calls_back_with_update_ids(self):
+        on_done = MagicMock()
+        writer = BatchedAnswerWriter(quiz_db=self.quiz_db, max_batch_size=100, flush_interval=0.01)
+        writer.start()
+        writer.put(self._answer(5001, 100), on_done=on_done)
+        writer.put(self._answer(5001, 99), on_done=on_done)
+        writer.put(self._answer(5002, 100))
+        writer.flush()
+
+        self.assertListEqual([((1,),), ((0,),)], on_done.call_args_list)
+        writer.stop()
+
+    def test_calls_back_on_db_errors(self):
+        self.quiz_db.update_answers = MagicMock(side_effect=[sqlite3.OperationalError('locked'), [1]])
+        on_done = MagicMock()
+        writer = BatchedAnswerWriter(quiz_db=self.quiz_db, max_batch_size=1, flush_interval=10)
+        writer.start()
+        writer.put(self._answer(5001, 100), on_done=on_done)
+        writer.put(self._answer(5002, 100), on_done=on_done)
+        writer.stop()
+
+        self.assertListEqual([((0,),), ((1,),)], on_done.call_args_list)
+
+
+class DebouncedUpdatesTest(BaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.quiz_db.close()
+        self.quiz_db = QuizDb(db_path=self.db_path, notify_debounce=0.5)
+
+    def test_notifies_once_per_burst(self):
+        sub = MagicMock()
+        self.quiz_db.add_updates_subscriber(sub)
+
+        for team_id in range(60):
+            self.quiz_db.update_answer(quiz_id='test', question=1, team_id=team_id, answer='Apple', answer_time=123)
+        self.quiz_db.flush_updates()
+
+        sub.assert_called_once_with()
+
+
+class UpdateAnswerPointsTest(BaseTestCase):
+
+    def test_updates_points(self):
         self._insert_into_answers([
             dict(update_id=1, quiz_id='test', question=5, team_id=5001,
                  answer='Apple', timestamp=123, points=9),
@@ -275,6 +792,9 @@ class UpdateAnswerPointsTest(BaseTestCase):
             dict(update_id=3, quiz_id='other', question=4, team_id=5001,
                  answer='Carrot', timestamp=125, points=9),
         ])
+        self._reopen_quiz_db()
+        sub = MagicMock()
+        self.quiz_db.add_updates_subscriber(sub)
 
         update_id = self.quiz_db.set_answer_points(
             quiz_id='test', question=5, team_id=5001, points=7)
@@ -288,8 +808,6 @@ class UpdateAnswerPointsTest(BaseTestCase):
         sub.assert_called_with()
 
     def test_non_existing_answer(self):
-        sub = MagicMock()
-        self.quiz_db.add_updates_subscriber(sub)
         self._insert_into_answers([
             dict(update_id=1, quiz_id='test', question=5, team_id=5001,
                  answer='Apple', timestamp=123, points=9),
@@ -298,6 +816,9 @@ class UpdateAnswerPointsTest(BaseTestCase):
             dict(update_id=3, quiz_id='other', question=4, team_id=5001,
                  answer='Carrot', timestamp=125, points=9),
         ])
+        self._reopen_quiz_db()
+        sub = MagicMock()
+        self.quiz_db.add_updates_subscriber(sub)
         update_id = self.quiz_db.set_answer_points(
             quiz_id='test', question=4, team_id=5001, points=7)
 
@@ -311,6 +832,38 @@ class UpdateAnswerPointsTest(BaseTestCase):
         sub.assert_called_with()
 
 
+class UpdateSequenceTest(BaseTestCase):
+    def test_teams_and_answers_share_update_ids(self):
+        self.assertEqual(1, self.quiz_db.update_team(
+            quiz_id='test', team_id=5001, name='Apple', registration_time=12))
+        self.assertEqual(2, self.quiz_db.update_answer(
+            quiz_id='test', question=1, team_id=5001, answer='Banana', answer_time=13))
+        self.assertEqual(3, self.quiz_db.set_answer_points(
+            quiz_id='test', question=1, team_id=5001, points=1))
+        self.assertEqual(4, self.quiz_db.update_team(
+            quiz_id='test', team_id=5001, name='Cherry', registration_time=14))
+
+    def test_continues_after_last_update_id(self):
+        self._insert_into_teams([dict(update_id=7, quiz_id='test', id=5001, name='Apple', timestamp=12)])
+        self._insert_into_answers([dict(update_id=5, quiz_id='test', question=1, team_id=5001,
+                                        answer='Banana', timestamp=13, points=None)])
+        self._reopen_quiz_db()
+
+        self.assertEqual(8, self.quiz_db.update_answer(
+            quiz_id='test', question=2, team_id=5001, answer='Cherry', answer_time=14))
+
+    def test_outdated_updates_do_not_use_update_ids(self):
+        self.quiz_db.update_team(quiz_id='test', team_id=5001, name='Apple', registration_time=12)
+        self.quiz_db.update_answer(quiz_id='test', question=1, team_id=5001, answer='Banana', answer_time=13)
+
+        self.assertEqual(0, self.quiz_db.update_team(
+            quiz_id='test', team_id=5001, name='Outdated', registration_time=11))
+        self.assertEqual(0, self.quiz_db.update_answer(
+            quiz_id='test', question=1, team_id=5001, answer='Outdated', answer_time=12))
+        self.assertEqual(3, self.quiz_db.update_team(
+            quiz_id='test', team_id=5002, name='Cherry', registration_time=14))
+
+
 class UpdateTeamTest(BaseTestCase):
     def test_inserts_new_team(self):
         sub = MagicMock()
@@ -328,12 +881,13 @@ class UpdateTeamTest(BaseTestCase):
         sub.assert_called_with()
 
     def test_updates_team(self):
-        sub = MagicMock()
-        self.quiz_db.add_updates_subscriber(sub)
         self._insert_into_teams([
             dict(update_id=1, quiz_id='test',
                  id=5001, name='Apple', timestamp=12)
         ])
+        self._reopen_quiz_db()
+        sub = MagicMock()
+        self.quiz_db.add_updates_subscriber(sub)
         prev_update_id = self._get_last_teams_update_id()
 
         update_id = self.quiz_db.update_team(
@@ -346,12 +900,13 @@ class UpdateTeamTest(BaseTestCase):
         sub.assert_called_with()
 
     def test_outdated_registration(self):
-        sub = MagicMock()
-        self.quiz_db.add_updates_subscriber(sub)
         self._insert_into_teams([
             dict(update_id=1, quiz_id='test',
                  id=5001, name='Apple', timestamp=12)
         ])
+        self._reopen_quiz_db()
+        sub = MagicMock()
+        self.quiz_db.add_updates_subscriber(sub)
         prev_update_id = self._get_last_teams_update_id()
 
         update_id = self.quiz_db.update_team(
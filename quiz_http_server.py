@@ -1,13 +1,57 @@
-import functools
+import asyncio
+import contextlib
+from dataclasses import dataclass, field, fields, is_dataclass
 import json
 import logging
-from telegram_quiz import TelegramQuiz, TelegramQuizError
-import threading
+import metrics
+from quiz_db import Answer, Team
+from sampling_profiler import ProfilerBusyError, SamplingProfiler
+from telegram_quiz import TelegramQuiz, TelegramQuizError, Updates, WEBHOOK_PATH_PREFIX
 import tornado.httpserver
 import tornado.ioloop
+import tornado.iostream
 import tornado.netutil
 import tornado.web
-from typing import Any, Dict, Optional, Tuple, Type, Union
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Type, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+_logger = logging.getLogger(__name__)
+
+
+def _to_json_object(obj: Any) -> Any:
+    # The instance dict of a dataclass is encoded as it is, without copying it.
+    if is_dataclass(obj):
+        return obj.__dict__
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable.')
+
+
+def encode_json(obj: Any) -> bytes:
+    """Encodes JSON values and dataclasses such as Team, Answer and QuizStatus as UTF-8 JSON.
+
+    Uses orjson when it is installed, which encodes dataclasses natively, and the json module otherwise.
+    """
+    if orjson:
+        return orjson.dumps(obj)
+    # Responses hold no cycles, and checking for them costs a dict insert per encoded record.
+    return json.dumps(obj, default=_to_json_object, separators=(',', ':'), check_circular=False).encode('utf-8')
+
+
+def decode_json(data: Union[bytes, str]) -> Any:
+    """Raises json.JSONDecodeError for invalid JSON, which orjson.JSONDecodeError is a subclass of."""
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+_REQUEST_SECONDS = metrics.Histogram(
+    'quiz_http_request_seconds', 'Time spent answering an API request, long polls included.', ['handler'])
+_LONG_POLL_WAITERS = metrics.Gauge(
+    'quiz_http_long_poll_waiters', 'getUpdates requests waiting for updates and open update streams.', ['handler'])
 
 
 class RequestParameterError(Exception):
@@ -20,6 +64,9 @@ class RootHandler(tornado.web.RequestHandler):
 
 
 class BaseQuizRequestHandler(tornado.web.RequestHandler):
+    # Whether the request only reads the quiz and may be made with GET.
+    ALLOW_GET = False
+
     def initialize(self, quiz: TelegramQuiz):
         self.quiz = quiz
 
@@ -44,72 +91,205 @@ class BaseQuizRequestHandler(tornado.web.RequestHandler):
                 f'Parameter {param} must be of type {str_types}.')
         return value
 
-    async def handle_quiz_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+    async def handle_quiz_request(self, request: Dict[str, Any]) -> Union[Dict[str, Any], bytes]:
         return {}
 
     async def post(self):
         try:
             if self.request.body:
-                request = json.loads(self.request.body, encoding='utf-8')
+                request = decode_json(self.request.body)
             else:
                 request = {}
         except json.JSONDecodeError:
             self.set_status(400)
-            self.write(json.dumps(
+            self.write(encode_json(
                 {'error': 'Request is not a valid JSON object.'}))
             return
-
+        await self._respond(request)
+
+    async def get(self):
+        """Read-only requests may be made with GET, so that their responses get an ETag and may be answered with 304.
+
+        Parameters are given as query arguments, each of them a JSON value or else a string.
+        """
+        if not self.ALLOW_GET:
+            raise tornado.web.HTTPError(405)
+        request = {}
+        for name in self.request.query_arguments:
+            value = self.get_query_argument(name)
+            try:
+                request[name] = decode_json(value)
+            except json.JSONDecodeError:
+                request[name] = value
+        await self._respond(request)
+
+    async def _respond(self, request: Dict[str, Any]):
         try:
             response = await self.handle_quiz_request(request)
-            status_code = 400 if response.get('error') else 200
+            # Bytes are a response that is already encoded as JSON.
+            status_code = 200 if isinstance(response, bytes) or not response.get('error') else 400
         except (RequestParameterError, TelegramQuizError) as e:
             response = {'error': str(e)}
             status_code = 400
         except Exception:
-            logging.exception('Internal server error')
+            _logger.exception('Internal server error')
             response = {'error': 'Internal server error'}
             status_code = 501
 
         self.set_status(status_code)
         self.add_header('Content-Type', 'application/json')
-        self.write(json.dumps(response))
+        self.write(response if isinstance(response, bytes) else encode_json(response))
 
+    def on_finish(self):
+        _REQUEST_SECONDS.observe(self.request.request_time(), type(self).__name__)
+
+
+class QuizStaticFileHandler(tornado.web.StaticFileHandler):
+    """Files are revalidated by their ETag on every load, so that a new version is picked up right away."""
+
+    def set_extra_headers(self, path: str) -> None:
+        self.set_header('Cache-Control', 'no-cache')
+
+
+_NEVER_UPDATE_ID = 2**31 - 1
+
+
+def _read_updates(quiz: TelegramQuiz, min_status_update_id: int, min_teams_update_id: int,
+                  min_answers_update_id: int) -> Updates:
+    if quiz.status_update_id >= min_status_update_id:
+        status = quiz.get_status()
+    else:
+        status = None
+
+    if quiz.id:
+        teams = quiz.db.get_teams(
+            quiz_id=quiz.id, min_update_id=min_teams_update_id)
+        answers = quiz.db.get_answers(
+            quiz_id=quiz.id, min_update_id=min_answers_update_id)
+    else:
+        teams = []
+        answers = []
+
+    return Updates(status=status, teams=teams, answers=answers)
 
-class GetUpdatesApiHandler(BaseQuizRequestHandler):
 
-    def _wait(self, *, timeout: float) -> bool:
-        with self.cond:
-            return self.cond.wait(timeout=timeout)
+def _updates_empty(updates: Updates) -> bool:
+    return not updates.status and not updates.teams and not updates.answers
+
+
+# Columns of teams and answers in the columnar format, quiz_id is sent once for all of them.
+_TEAM_COLUMNS = [f.name for f in fields(Team) if f.name != 'quiz_id']
+_ANSWER_COLUMNS = [f.name for f in fields(Answer) if f.name != 'quiz_id']
+
+
+def _to_columns(rows: List[Union[Team, Answer]], columns: List[str]) -> Dict[str, List[Any]]:
+    return {c: [getattr(row, c) for row in rows] for c in columns}
+
+
+def _to_columnar(updates: Updates) -> Dict[str, Any]:
+    """Sends every key once: teams and answers become a list of values per key, all lists in the same order."""
+    rows = updates.teams + updates.answers
+    return {
+        'quiz_id': rows[0].quiz_id if rows else None,
+        'status': updates.status,
+        'teams': _to_columns(updates.teams, _TEAM_COLUMNS),
+        'answers': _to_columns(updates.answers, _ANSWER_COLUMNS),
+    }
+
+
+@dataclass
+class UpdatesSnapshot:
+    updates: Updates
+    # The updates encoded as a JSON object.
+    body: bytes
+    _columnar_body: Optional[bytes] = field(default=None, repr=False)
+
+    @property
+    def columnar_body(self) -> bytes:
+        """The updates in the columnar format encoded as a JSON object, encoded once per snapshot."""
+        if self._columnar_body is None:
+            self._columnar_body = encode_json(_to_columnar(self.updates))
+        return self._columnar_body
+
+
+class UpdatesFanout:
+    """Reads every delta of updates once per generation and shares it between all requests.
+
+    A new generation starts whenever the quiz or its database changes. Snapshots are only cached while
+    at least one request listens, because only then the fan-out is subscribed to the changes.
+    All methods must be called on the IOLoop.
+    """
+
+    def __init__(self, quiz: TelegramQuiz):
+        self._quiz = quiz
+        self._listeners = 0
+        self._generation = 0
+        self._io_loop: Optional[tornado.ioloop.IOLoop] = None
+        self._next_generation_future: 'Optional[asyncio.Future[None]]' = None
+        self._snapshots: Dict[Tuple[int, int, int], UpdatesSnapshot] = {}
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    @contextlib.contextmanager
+    def listen(self) -> Iterator[None]:
+        if not self._listeners:
+            self._io_loop = tornado.ioloop.IOLoop.current()
+            self._next_generation_future = asyncio.Future()
+            self._quiz.add_updates_subscriber(self._notify)
+            self._quiz.db.add_updates_subscriber(self._notify)
+        self._listeners += 1
+        try:
+            yield
+        finally:
+            self._listeners -= 1
+            if not self._listeners:
+                self._quiz.remove_updates_subscriber(self._notify)
+                self._quiz.db.remove_updates_subscriber(self._notify)
+                self._snapshots.clear()
 
     def _notify(self):
-        with self.cond:
-            self.cond.notify()
-
-    def _get_updates(self, min_status_update_id: int, min_teams_update_id: int, min_answers_update_id: int) -> Dict[str, Any]:
-        if self.quiz.status_update_id >= min_status_update_id:
-            status = self.quiz.get_status()
-        else:
-            status = None
-
-        if self.quiz.id:
-            teams = self.quiz.db.get_teams(
-                quiz_id=self.quiz.id, min_update_id=min_teams_update_id)
-            answers = self.quiz.db.get_answers(
-                quiz_id=self.quiz.id, min_update_id=min_answers_update_id)
-        else:
-            teams = []
-            answers = []
-
-        return {
-            'status': status.__dict__ if status else None,
-            'teams': [t.__dict__ for t in teams],
-            'answers': [a.__dict__ for a in answers],
-        }
-
-    def _updates_empty(self, updates: Dict[str, Any]) -> bool:
-        return not updates.get('status') and not updates.get('teams') and not updates.get('answers')
+        # Called from the threads that change the quiz.
+        self._quiz.answer_tracer.notified(self._quiz.db.last_update_id)
+        self._io_loop.add_callback(self._start_next_generation)
+
+    def _start_next_generation(self):
+        self._generation += 1
+        self._snapshots.clear()
+        future, self._next_generation_future = self._next_generation_future, asyncio.Future()
+        if future and not future.done():
+            future.set_result(None)
+
+    def get_snapshot(self, min_status_update_id: int, min_teams_update_id: int,
+                     min_answers_update_id: int) -> UpdatesSnapshot:
+        key = (min_status_update_id, min_teams_update_id, min_answers_update_id)
+        snapshot = self._snapshots.get(key)
+        if snapshot is None:
+            updates = _read_updates(self._quiz, *key)
+            snapshot = UpdatesSnapshot(updates=updates, body=encode_json(updates))
+            if self._listeners:
+                self._snapshots[key] = snapshot
+        return snapshot
+
+    async def wait(self, *, generation: int, timeout: float, interrupt: 'asyncio.Future[None]') -> None:
+        """Waits until a generation after the given one starts, the timeout passes or interrupt resolves."""
+        if generation != self._generation:
+            return
+        await asyncio.wait([self._next_generation_future, interrupt], timeout=timeout,
+                           return_when=asyncio.FIRST_COMPLETED)
 
-    async def handle_quiz_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+
+class GetUpdatesApiHandler(BaseQuizRequestHandler):
+    ALLOW_GET = True
+
+    def initialize(self, quiz: TelegramQuiz, fanout: UpdatesFanout):
+        super().initialize(quiz)
+        self.fanout = fanout
+        self._connection_closed: 'asyncio.Future[None]' = asyncio.Future()
+        self._answers: List[Answer] = []
+
+    async def handle_quiz_request(self, request: Dict[str, Any]) -> Union[Dict[str, Any], bytes]:
         min_status_update_id = self.get_param_value(
             request, 'min_status_update_id', int)
         min_teams_update_id = self.get_param_value(
@@ -118,41 +298,188 @@ class GetUpdatesApiHandler(BaseQuizRequestHandler):
             request, 'min_answers_update_id', int)
         timeout = self.get_param_value(request, 'timeout', (float, int), 0.0)
         timeout = min(timeout, 30.0)
+        response_format = self.get_param_value(request, 'format', str, 'rows')
+        if response_format not in ('rows', 'columnar'):
+            raise RequestParameterError('Parameter format must be either "rows" or "columnar".')
 
         if min_status_update_id == -1:
-            min_status_update_id = 2**31 - 1
+            min_status_update_id = _NEVER_UPDATE_ID
 
         if min_teams_update_id == -1:
-            min_teams_update_id = 2**31 - 1
+            min_teams_update_id = _NEVER_UPDATE_ID
 
         if min_answers_update_id == -1:
-            min_answers_update_id = 2**31 - 1
+            min_answers_update_id = _NEVER_UPDATE_ID
+
+        # Listen before reading, so that no update is missed between reading and waiting.
+        with self.fanout.listen():
+            generation = self.fanout.generation
+            snapshot = self.fanout.get_snapshot(
+                min_status_update_id, min_teams_update_id, min_answers_update_id)
+            if _updates_empty(snapshot.updates) and timeout > 0:
+                with _LONG_POLL_WAITERS.track('getUpdates'):
+                    await self.fanout.wait(generation=generation, timeout=timeout,
+                                           interrupt=self._connection_closed)
+                snapshot = self.fanout.get_snapshot(
+                    min_status_update_id, min_teams_update_id, min_answers_update_id)
 
-        updates = self._get_updates(
-            min_status_update_id, min_teams_update_id, min_answers_update_id)
-        if not self._updates_empty(updates) or timeout <= 0:
-            return updates
+            self._answers = snapshot.updates.answers
+            return snapshot.columnar_body if response_format == 'columnar' else snapshot.body
 
-        self.cond = threading.Condition()
+    def on_finish(self):
+        super().on_finish()
+        if self._answers:
+            self.quiz.answer_tracer.delivered(a.update_id for a in self._answers)
 
+    def on_connection_close(self):
+        _logger.warning('Connection closed by the client.')
+        if not self._connection_closed.done():
+            self._connection_closed.set_result(None)
+
+
+class StreamUpdatesHandler(tornado.web.RequestHandler):
+    """Pushes updates as Server-Sent Events.
+
+    Takes the same min_*_update_id cursors as getUpdates as query arguments. The id of every event
+    holds the cursors to resume from, which the browser sends back in Last-Event-ID on reconnect.
+    """
+
+    KEEPALIVE_INTERVAL = 15.0
+
+    def initialize(self, quiz: TelegramQuiz, fanout: UpdatesFanout):
+        self.quiz = quiz
+        self.fanout = fanout
+        self._connection_closed: 'asyncio.Future[None]' = asyncio.Future()
+
+    def _get_cursors(self) -> Tuple[int, int, int]:
+        last_event_id = self.request.headers.get('Last-Event-ID')
         try:
-            self.quiz.add_updates_subscriber(self._notify)
-            self.quiz.db.add_updates_subscriber(self._notify)
+            if last_event_id:
+                (status, teams, answers) = (int(c) for c in last_event_id.split('.'))
+            else:
+                (status, teams, answers) = (int(self.get_query_argument(name)) for name in (
+                    'min_status_update_id', 'min_teams_update_id', 'min_answers_update_id'))
+        except (ValueError, tornado.web.MissingArgumentError):
+            raise RequestParameterError(
+                'Parameters min_status_update_id, min_teams_update_id and min_answers_update_id '
+                'must be provided as integers.')
+        return tuple(_NEVER_UPDATE_ID if c == -1 else c for c in (status, teams, answers))
 
-            await tornado.ioloop.IOLoop.current().run_in_executor(None,
-                                                                  functools.partial(self._wait, timeout=timeout))
+    @staticmethod
+    def _advance_cursor(cursor: int, items: List[Union[Team, Answer]]) -> int:
+        if cursor == _NEVER_UPDATE_ID or not items:
+            return cursor
+        return max(cursor, max(item.update_id for item in items) + 1)
 
-            updates = self._get_updates(
-                min_status_update_id, min_teams_update_id, min_answers_update_id)
+    async def get(self):
+        try:
+            (min_status_update_id, min_teams_update_id, min_answers_update_id) = self._get_cursors()
+        except RequestParameterError as e:
+            self.set_status(400)
+            self.add_header('Content-Type', 'application/json')
+            self.write(encode_json({'error': str(e)}))
+            return
 
-            return updates
-        finally:
-            self.quiz.remove_updates_subscriber(self._notify)
-            self.quiz.db.remove_updates_subscriber(self._notify)
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+
+        with self.fanout.listen(), _LONG_POLL_WAITERS.track('streamUpdates'):
+            while not self._connection_closed.done():
+                generation = self.fanout.generation
+                snapshot = self.fanout.get_snapshot(
+                    min_status_update_id, min_teams_update_id, min_answers_update_id)
+                updates = snapshot.updates
+                if _updates_empty(updates):
+                    self.write(': keepalive\n\n')
+                else:
+                    if updates.status:
+                        min_status_update_id = max(min_status_update_id, updates.status.update_id + 1)
+                    min_teams_update_id = self._advance_cursor(min_teams_update_id, updates.teams)
+                    min_answers_update_id = self._advance_cursor(min_answers_update_id, updates.answers)
+                    self.write(f'id: {min_status_update_id}.{min_teams_update_id}.{min_answers_update_id}\n'
+                               f'event: updates\n'
+                               f'data: '.encode('utf-8') + snapshot.body + b'\n\n')
+                try:
+                    await self.flush()
+                except tornado.iostream.StreamClosedError:
+                    break
+                if updates.answers:
+                    self.quiz.answer_tracer.delivered(a.update_id for a in updates.answers)
+                await self.fanout.wait(generation=generation, timeout=self.KEEPALIVE_INTERVAL,
+                                       interrupt=self._connection_closed)
 
     def on_connection_close(self):
-        logging.warning('Connection closed by the client.')
-        self._notify()
+        if not self._connection_closed.done():
+            self._connection_closed.set_result(None)
+
+
+class TelegramWebhookHandler(tornado.web.RequestHandler):
+    """Receives updates that Telegram POSTs when the quiz runs with a webhook."""
+
+    def initialize(self, quiz: TelegramQuiz):
+        self.quiz = quiz
+
+    def post(self, token: str):
+        try:
+            update = decode_json(self.request.body)
+        except json.JSONDecodeError:
+            raise tornado.web.HTTPError(400)
+        if not isinstance(update, dict):
+            raise tornado.web.HTTPError(400)
+        if not self.quiz.put_webhook_update(token, update):
+            raise tornado.web.HTTPError(404)
+
+
+class GetAnswerTracesApiHandler(BaseQuizRequestHandler):
+    """Returns the stage times of the latest answers, oldest first, with the milliseconds spent in each stage."""
+    ALLOW_GET = True
+
+    async def handle_quiz_request(self, request: Dict[str, Any]) -> Union[Dict[str, Any], bytes]:
+        limit = self.get_param_value(request, 'limit', int, 100)
+        if limit <= 0:
+            raise RequestParameterError('Parameter limit must be a positive integer.')
+        traces = self.quiz.answer_tracer.get_traces(limit)
+        return encode_json({'traces': [dict(t.__dict__, latency_ms=t.breakdown()) for t in traces]})
+
+
+class ProfileHandler(tornado.web.RequestHandler):
+    """Profiles all threads for ?seconds=N and returns the collapsed stacks, e.g. for flamegraph.pl."""
+
+    MAX_SECONDS = 60.0
+
+    def initialize(self, profiler: SamplingProfiler):
+        self.profiler = profiler
+
+    def _write_error(self, error: str):
+        self.set_status(400)
+        self.add_header('Content-Type', 'application/json')
+        self.write(encode_json({'error': error}))
+
+    async def get(self):
+        try:
+            seconds = float(self.get_query_argument('seconds', '10'))
+        except ValueError:
+            seconds = -1.0
+        if not 0 < seconds <= self.MAX_SECONDS:
+            self._write_error(f'Parameter seconds must be a number from 0 to {self.MAX_SECONDS:g}.')
+            return
+        try:
+            # Sampling blocks, so that it runs on an executor thread, the IOLoop is sampled while it waits.
+            stacks = await tornado.ioloop.IOLoop.current().run_in_executor(None, self.profiler.profile, seconds)
+        except ProfilerBusyError as e:
+            self._write_error(str(e))
+            return
+        self.set_header('Content-Type', 'text/plain; charset=utf-8')
+        self.set_header('Content-Disposition', 'attachment; filename="profile.folded"')
+        self.write(stacks)
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Serves all metrics in the Prometheus text exposition format."""
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(metrics.REGISTRY.expose())
 
 
 class SendResultsApiHandler(BaseQuizRequestHandler):
@@ -162,6 +489,21 @@ class SendResultsApiHandler(BaseQuizRequestHandler):
         return {}
 
 
+class SendAllResultsApiHandler(BaseQuizRequestHandler):
+    async def handle_quiz_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        teams = self.quiz.send_all_results()
+        return {'teams': teams}
+
+
+class GetScoreboardApiHandler(BaseQuizRequestHandler):
+    ALLOW_GET = True
+
+    async def handle_quiz_request(self, request: Dict[str, Any]) -> Union[Dict[str, Any], bytes]:
+        if not self.quiz.id:
+            return {'error': 'Quiz is not started.'}
+        return encode_json(self.quiz.db.get_scoreboard(self.quiz.id))
+
+
 class SetAnswerPointsApiHandler(BaseQuizRequestHandler):
     async def handle_quiz_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
         question = self.get_param_value(request, 'question', int)
@@ -229,9 +571,15 @@ class StopQuizApiHandler(BaseQuizRequestHandler):
 
 def create_quiz_tornado_app(*, quiz: TelegramQuiz) -> tornado.web.Application:
     args = dict(quiz=quiz)
+    updates_args = dict(quiz=quiz, fanout=UpdatesFanout(quiz))
+    # Responses of at least 1 KiB are gzipped for clients that accept it.
     return tornado.web.Application([
         ('/', RootHandler),
-        ('/api/getUpdates', GetUpdatesApiHandler, args),
+        ('/api/debug/profile', ProfileHandler, dict(profiler=SamplingProfiler())),
+        ('/api/debug/traces', GetAnswerTracesApiHandler, args),
+        ('/api/getScoreboard', GetScoreboardApiHandler, args),
+        ('/api/getUpdates', GetUpdatesApiHandler, updates_args),
+        ('/api/sendAllResults', SendAllResultsApiHandler, args),
         ('/api/sendResults', SendResultsApiHandler, args),
         ('/api/setAnswerPoints', SetAnswerPointsApiHandler, args),
         ('/api/startRegistration', StartRegistrationApiHandler, args),
@@ -240,5 +588,8 @@ def create_quiz_tornado_app(*, quiz: TelegramQuiz) -> tornado.web.Application:
         ('/api/startQuiz', StartQuizApiHandler, args),
         ('/api/stopQuestion', StopQuestionApiHandler, args),
         ('/api/stopQuiz', StopQuizApiHandler, args),
-        ('/(.*)', tornado.web.StaticFileHandler, {'path': 'static'}),
-    ])
+        ('/api/streamUpdates', StreamUpdatesHandler, updates_args),
+        ('/metrics', MetricsHandler),
+        (WEBHOOK_PATH_PREFIX + '([^/]+)', TelegramWebhookHandler, args),
+        ('/(.*)', QuizStaticFileHandler, {'path': 'static'}),
+    ], compress_response=True)
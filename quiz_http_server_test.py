@@ -1,17 +1,23 @@
+import gzip
 import json
 import os
 from quiz_db import Answer, Team, QuizDb
-from quiz_http_server import create_quiz_tornado_app
-from telegram_quiz import QuizStatus, Updates, TelegramQuiz
+import quiz_http_server
+from quiz_http_server import create_quiz_tornado_app, decode_json, encode_json, StreamUpdatesHandler
+from telegram_quiz import QuizStatus, Updates, TelegramQuiz, TelegramQuizError
 from telegram_quiz_test import STRINGS
 import telegram
 import tempfile
 import threading
 import time
+import tornado.gen
+import tornado.httpclient
+import tornado.iostream
+import tornado.tcpclient
 import tornado.testing
-from typing import Any, Dict
+from typing import Any, Callable, Dict, List
 import unittest
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 
 def _remove_key(d: Dict, key) -> Dict:
@@ -26,6 +32,31 @@ def _json_to_updates(obj: Dict[str, Any]) -> Updates:
     return Updates(status=status, teams=teams, answers=answers)
 
 
+class JsonTest(unittest.TestCase):
+    def _test_encodes_dataclasses(self):
+        updates = Updates(
+            status=None,
+            teams=[Team(quiz_id='test', id=5001, name='Unicode Юнікод 😎', timestamp=123, update_id=1)],
+            answers=[Answer(quiz_id='test', question=1, team_id=5001, answer='Apple', timestamp=124, update_id=2)])
+
+        self.assertDictEqual({
+            'status': None,
+            'teams': [dict(quiz_id='test', id=5001, name='Unicode Юнікод 😎', timestamp=123, update_id=1)],
+            'answers': [dict(quiz_id='test', question=1, team_id=5001, answer='Apple', timestamp=124,
+                             points=None, update_id=2)],
+        }, json.loads(encode_json(updates).decode('utf-8')))
+        self.assertDictEqual({'a': [1, 'Юнікод']}, decode_json('{"a": [1, "Юнікод"]}'.encode('utf-8')))
+        self.assertRaises(json.JSONDecodeError, decode_json, b'#$%')
+        self.assertRaises(TypeError, encode_json, object())
+
+    def test_encodes_dataclasses(self):
+        self._test_encodes_dataclasses()
+
+    def test_encodes_dataclasses_without_orjson(self):
+        with patch.object(quiz_http_server, 'orjson', None):
+            self._test_encodes_dataclasses()
+
+
 class BaseTestCase(tornado.testing.AsyncHTTPTestCase):
     def get_app(self):
         self.test_dir = tempfile.TemporaryDirectory()
@@ -40,6 +71,7 @@ class BaseTestCase(tornado.testing.AsyncHTTPTestCase):
         return create_quiz_tornado_app(quiz=self.quiz)
 
     def tearDown(self):
+        self.quiz_db.close()
         self.test_dir.cleanup()
         super().tearDown()
 
@@ -128,6 +160,161 @@ class TestQuizHttpServer(StartedQuizBaseTestCase):
         self.assertIsNone(self.quiz._question)
 
 
+class GetAnswerTracesApiTest(StartedQuizBaseTestCase):
+    def test_traces_answer_to_long_poll(self):
+        self.quiz_db.update_team(quiz_id='test', team_id=5001, name='Liverpool', registration_time=1)
+        answer = Answer(quiz_id='test', question=1, team_id=5001, answer='Apple', timestamp=int(time.time()))
+        trace = self.quiz.answer_tracer.start(answer, time.time())
+        request = {'min_status_update_id': -1, 'min_teams_update_id': -1,
+                   'min_answers_update_id': self.quiz_db.last_update_id + 1, 'timeout': 5.0}
+
+        def _write():
+            update_id = self.quiz_db.update_answer(quiz_id='test', question=1, team_id=5001, answer='Apple',
+                                                   answer_time=answer.timestamp)
+            self.quiz.answer_tracer.committed(trace, update_id)
+
+        self.io_loop.call_later(0.05, _write)
+        response = self.fetch('/api/getUpdates', method='POST', body=json.dumps(request))
+        self.assertEqual(1, len(json.loads(response.body)['answers']))
+
+        response = self.fetch('/api/debug/traces?limit=1')
+
+        self.assertEqual(200, response.code)
+        (trace_json,) = json.loads(response.body)['traces']
+        self.assertEqual(5001, trace_json['team_id'])
+        self.assertEqual(self.quiz_db.last_update_id, trace_json['update_id'])
+        for stage in ('sent', 'received', 'committed', 'notified', 'delivered'):
+            self.assertIsNotNone(trace_json[stage], stage)
+        self.assertEqual(['telegram', 'write', 'notify', 'deliver', 'total'], list(trace_json['latency_ms']))
+
+    def test_no_traces(self):
+        response = self.fetch('/api/debug/traces')
+
+        self.assertEqual(200, response.code)
+        self.assertDictEqual({'traces': []}, json.loads(response.body))
+
+    def test_invalid_limit(self):
+        for limit in ('0', '-1', 'abc'):
+            response = self.fetch(f'/api/debug/traces?limit={limit}')
+
+            self.assertEqual(400, response.code)
+            self.assertIn('error', json.loads(response.body))
+
+
+class ProfileTest(BaseTestCase):
+    def test_returns_collapsed_stacks(self):
+        response = self.fetch('/api/debug/profile?seconds=0.05')
+
+        self.assertEqual(200, response.code)
+        self.assertIn('profile.folded', response.headers['Content-Disposition'])
+        lines = response.body.decode('utf-8').splitlines()
+        self.assertTrue(lines)
+        for line in lines:
+            self.assertRegex(line, r'^[^ ].* \d+$')
+        self.assertTrue([line for line in lines if line.startswith('MainThread;')])
+
+    def test_invalid_seconds(self):
+        for seconds in ('abc', '0', '1000'):
+            response = self.fetch(f'/api/debug/profile?seconds={seconds}')
+
+            self.assertEqual(400, response.code)
+            self.assertIn('Parameter seconds must be', json.loads(response.body)['error'])
+
+
+class MetricsTest(StartedQuizBaseTestCase):
+    def test_exposes_metrics(self):
+        self.fetch('/api/getScoreboard', method='POST', body='')
+        self.quiz_db.get_teams(quiz_id='test')
+
+        response = self.fetch('/metrics')
+
+        self.assertEqual(200, response.code)
+        self.assertTrue(response.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.body.decode('utf-8')
+        self.assertIn('# TYPE quiz_http_request_seconds histogram', body)
+        self.assertIn('quiz_http_request_seconds_count{handler="GetScoreboardApiHandler"}', body)
+        self.assertIn('quiz_db_call_seconds_count{method="get_teams"}', body)
+        self.assertIn('# TYPE quiz_lock_wait_seconds histogram', body)
+        self.assertIn('# TYPE quiz_telegram_handler_seconds histogram', body)
+        self.assertIn('# TYPE quiz_telegram_call_seconds histogram', body)
+        self.assertIn('# TYPE quiz_http_long_poll_waiters gauge', body)
+
+    def test_counts_long_poll_waiters(self):
+        waiters = quiz_http_server._LONG_POLL_WAITERS
+        request = {'min_status_update_id': -1, 'min_teams_update_id': -1, 'min_answers_update_id': -1,
+                   'timeout': 0.2}
+        initial = waiters.get('getUpdates')
+        seen = []
+
+        def _poll():
+            seen.append(waiters.get('getUpdates'))
+            if len(seen) < 100:
+                self.io_loop.call_later(0.01, _poll)
+
+        self.io_loop.call_later(0.05, _poll)
+        self.fetch('/api/getUpdates', method='POST', body=json.dumps(request))
+
+        self.assertIn(initial + 1, seen)
+        self.assertEqual(initial, waiters.get('getUpdates'))
+
+
+class CachingAndCompressionTest(StartedQuizBaseTestCase):
+    def test_revalidates_static_files(self):
+        response = self.fetch('/index.js')
+        self.assertEqual(200, response.code)
+        self.assertEqual('no-cache', response.headers['Cache-Control'])
+
+        response = self.fetch('/index.js', headers={'If-None-Match': response.headers['Etag']})
+        self.assertEqual(304, response.code)
+
+    def test_compresses_large_responses(self):
+        for team_id in range(100):
+            self.quiz_db.update_team(quiz_id='test', team_id=team_id, name=f'Team {team_id}', registration_time=1)
+        request = {'min_status_update_id': 1, 'min_teams_update_id': 1, 'min_answers_update_id': 1}
+
+        response = self.fetch('/api/getUpdates', method='POST', body=json.dumps(request),
+                              headers={'Accept-Encoding': 'gzip'}, decompress_response=False)
+
+        self.assertEqual(200, response.code)
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertEqual(100, len(json.loads(gzip.decompress(response.body))['teams']))
+
+    def test_does_not_compress_small_responses(self):
+        response = self.fetch('/api/getScoreboard', method='POST', body='',
+                              headers={'Accept-Encoding': 'gzip'}, decompress_response=False)
+
+        self.assertEqual(200, response.code)
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_get_snapshot_with_etag(self):
+        self.quiz_db.update_team(quiz_id='test', team_id=5001, name='Liverpool', registration_time=1)
+
+        response = self.fetch('/api/getScoreboard')
+        self.assertEqual(200, response.code)
+        self.assertListEqual(['Liverpool'], json.loads(response.body)['names'])
+
+        response = self.fetch('/api/getScoreboard', headers={'If-None-Match': response.headers['Etag']})
+        self.assertEqual(304, response.code)
+
+        self.quiz_db.set_answer_points(quiz_id='test', question=1, team_id=5001, points=1)
+        response = self.fetch('/api/getScoreboard', headers={'If-None-Match': response.headers['Etag']})
+        self.assertEqual(200, response.code)
+
+    def test_get_updates_query_arguments(self):
+        self.quiz_db.update_team(quiz_id='test', team_id=5001, name='Liverpool', registration_time=1)
+
+        response = self.fetch('/api/getUpdates?min_status_update_id=-1&min_teams_update_id=1'
+                              '&min_answers_update_id=-1&format=columnar')
+
+        self.assertEqual(200, response.code)
+        self.assertListEqual(['Liverpool'], json.loads(response.body)['teams']['name'])
+
+    def test_get_not_allowed_for_changes(self):
+        response = self.fetch('/api/startRegistration')
+        self.assertEqual(405, response.code)
+        self.assertFalse(self.quiz.is_registration())
+
+
 class StartQuizApiTest(BaseTestCase):
     def test_starts_quiz(self):
         self.quiz.start = MagicMock()
@@ -330,7 +517,10 @@ class GetUpdatesApiTest(StartedQuizBaseTestCase):
                 'language': 'lang',
                 'question': None,
                 'registration': False,
-                'time': '2020-02-03 04:05:06'
+                'time': '2020-02-03 04:05:06',
+                'results_total': 0,
+                'results_sent': 0,
+                'results_failed': 0,
             },
             'teams': [
                 dict(quiz_id='test', id=5001, name='Liverpool',
@@ -351,6 +541,74 @@ class GetUpdatesApiTest(StartedQuizBaseTestCase):
         self.quiz._quiz_db.get_answers.assert_called_with(
             quiz_id='test', min_update_id=789)
 
+    def test_returns_columnar_updates(self):
+        self.quiz._quiz_db.get_answers = MagicMock(return_value=[
+            Answer(quiz_id='test', question=5, team_id=5001,
+                   answer='Apple', timestamp=1234, update_id=201, points=3),
+            Answer(quiz_id='test', question=8, team_id=5002,
+                   answer='Unicode Юнікод', timestamp=1236, update_id=202, points=None),
+        ])
+        self.quiz._quiz_db.get_teams = MagicMock(return_value=[
+            Team(quiz_id='test', id=5001, name='Liverpool',
+                 timestamp=1235, update_id=301),
+        ])
+        request = {
+            'min_status_update_id': -1,
+            'min_teams_update_id': 456,
+            'min_answers_update_id': 789,
+            'format': 'columnar',
+        }
+        response = self.fetch('/api/getUpdates', method='POST',
+                              body=json.dumps(request))
+        self.assertEqual(200, response.code)
+        self.assertDictEqual({
+            'quiz_id': 'test',
+            'status': None,
+            'teams': {
+                'id': [5001],
+                'name': ['Liverpool'],
+                'timestamp': [1235],
+                'update_id': [301],
+            },
+            'answers': {
+                'question': [5, 8],
+                'team_id': [5001, 5002],
+                'answer': ['Apple', 'Unicode Юнікод'],
+                'timestamp': [1234, 1236],
+                'points': [3, None],
+                'update_id': [201, 202],
+            },
+        }, json.loads(response.body))
+
+    def test_columnar_no_updates(self):
+        request = {
+            'min_status_update_id': -1,
+            'min_teams_update_id': -1,
+            'min_answers_update_id': -1,
+            'format': 'columnar',
+        }
+        response = self.fetch('/api/getUpdates', method='POST',
+                              body=json.dumps(request))
+        self.assertEqual(200, response.code)
+        self.assertDictEqual({
+            'quiz_id': None,
+            'status': None,
+            'teams': {'id': [], 'name': [], 'timestamp': [], 'update_id': []},
+            'answers': {'question': [], 'team_id': [], 'answer': [], 'timestamp': [], 'points': [], 'update_id': []},
+        }, json.loads(response.body))
+
+    def test_unknown_format(self):
+        request = {
+            'min_status_update_id': 1,
+            'min_teams_update_id': 1,
+            'min_answers_update_id': 1,
+            'format': 'xml',
+        }
+        response = self.fetch('/api/getUpdates', method='POST',
+                              body=json.dumps(request))
+        self.assertEqual(400, response.code)
+        self.assertIn('error', json.loads(response.body))
+
     def test_stopped_quiz(self):
         update_id = self.quiz.status_update_id
         self.quiz.get_status = MagicMock(return_value=QuizStatus(
@@ -391,7 +649,10 @@ class GetUpdatesApiTest(StartedQuizBaseTestCase):
                 'language': None,
                 'question': None,
                 'registration': False,
-                'time': '2020-02-03 04:05:06'
+                'time': '2020-02-03 04:05:06',
+                'results_total': 0,
+                'results_sent': 0,
+                'results_failed': 0,
             },
             'teams': [],
             'answers': [],
@@ -450,7 +711,7 @@ class GetUpdatesApiTest(StartedQuizBaseTestCase):
         self.assertLess(time.time(), start_time + 3.0)
         self.assertIsNotNone(json.loads(response.body)['status'])
         self.assertEqual(200, response.code)
-        self.assertSetEqual(set(), self.quiz_db._subscribers)
+        self.assertSetEqual(set(), self.quiz_db._notifier._subscribers)
 
     def test_long_polling_db_change(self):
         request = {
@@ -489,7 +750,7 @@ class GetUpdatesApiTest(StartedQuizBaseTestCase):
             'answers': [],
         }, json.loads(response.body))
         self.assertEqual(200, response.code)
-        self.assertSetEqual(set(), self.quiz_db._subscribers)
+        self.assertSetEqual(set(), self.quiz_db._notifier._subscribers)
 
     def test_long_polling_instant_status_update(self):
         request = {
@@ -514,7 +775,7 @@ class GetUpdatesApiTest(StartedQuizBaseTestCase):
         self.assertListEqual([], updates['teams'])
         self.assertListEqual([], updates['answers'])
         self.assertEqual(200, response.code)
-        self.assertSetEqual(set(), self.quiz_db._subscribers)
+        self.assertSetEqual(set(), self.quiz_db._notifier._subscribers)
 
     def test_long_polling_instant_db_update(self):
         request = {
@@ -545,7 +806,7 @@ class GetUpdatesApiTest(StartedQuizBaseTestCase):
             'answers': [],
         }, json.loads(response.body))
         self.assertEqual(200, response.code)
-        self.assertSetEqual(set(), self.quiz_db._subscribers)
+        self.assertSetEqual(set(), self.quiz_db._notifier._subscribers)
 
     def test_long_polling_timeout(self):
         request = {
@@ -567,7 +828,68 @@ class GetUpdatesApiTest(StartedQuizBaseTestCase):
             'answers': [],
         }, json.loads(response.body))
         self.assertEqual(200, response.code)
-        self.assertSetEqual(set(), self.quiz_db._subscribers)
+        self.assertSetEqual(set(), self.quiz_db._notifier._subscribers)
+
+    def test_long_polling_does_not_use_threads(self):
+        request = {
+            'min_status_update_id': self.quiz.status_update_id + 1,
+            'min_teams_update_id': 1,
+            'min_answers_update_id': 1,
+            'timeout': 3,
+        }
+        http_client = tornado.httpclient.AsyncHTTPClient(force_instance=True, max_clients=100)
+
+        async def _long_poll():
+            return await http_client.fetch(self.get_url('/api/getUpdates'), method='POST', body=json.dumps(request))
+
+        async def _long_poll_many():
+            responses = tornado.gen.multi([_long_poll() for _ in range(50)])
+            await tornado.gen.sleep(0.5)
+            self.quiz_db.update_team(
+                quiz_id='test', team_id=5001, name='Liverpool', registration_time=123)
+            return await responses
+
+        start_time = time.time()
+        with patch.object(tornado.ioloop.IOLoop, 'run_in_executor') as run_in_executor:
+            responses = self.io_loop.run_sync(_long_poll_many)
+        http_client.close()
+
+        self.assertLess(time.time(), start_time + 3.0)
+        run_in_executor.assert_not_called()
+        for response in responses:
+            self.assertEqual(200, response.code)
+            self.assertEqual('Liverpool', json.loads(response.body)['teams'][0]['name'])
+        self.assertSetEqual(set(), self.quiz_db._notifier._subscribers)
+
+    def test_shares_snapshots_between_waiters(self):
+        self.quiz_db.get_teams = MagicMock(wraps=self.quiz_db.get_teams)
+        self.quiz_db.get_answers = MagicMock(wraps=self.quiz_db.get_answers)
+        request = {
+            'min_status_update_id': self.quiz.status_update_id + 1,
+            'min_teams_update_id': 1,
+            'min_answers_update_id': 1,
+            'timeout': 3,
+        }
+        http_client = tornado.httpclient.AsyncHTTPClient(force_instance=True, max_clients=100)
+
+        async def _long_poll_many():
+            responses = tornado.gen.multi([
+                http_client.fetch(self.get_url('/api/getUpdates'), method='POST', body=json.dumps(request))
+                for _ in range(10)])
+            await tornado.gen.sleep(0.5)
+            self.quiz_db.update_team(
+                quiz_id='test', team_id=5001, name='Liverpool', registration_time=123)
+            return await responses
+
+        responses = self.io_loop.run_sync(_long_poll_many)
+        http_client.close()
+
+        self.assertEqual(1, len(set(r.body for r in responses)))
+        self.assertEqual('Liverpool', json.loads(responses[0].body)['teams'][0]['name'])
+        # Once before the change and once after it.
+        self.assertEqual(2, self.quiz_db.get_teams.call_count)
+        self.assertEqual(2, self.quiz_db.get_answers.call_count)
+        self.assertSetEqual(set(), self.quiz_db._notifier._subscribers)
 
     def test_no_min_status_update_id_given(self):
         request = {
@@ -645,6 +967,141 @@ class GetUpdatesApiTest(StartedQuizBaseTestCase):
         self.assertIn('error', json.loads(response.body))
 
 
+class StreamUpdatesTest(StartedQuizBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        # Closed connections are noticed on the next write.
+        patcher = patch.object(StreamUpdatesHandler, 'KEEPALIVE_INTERVAL', 0.05)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _stream_events(self, path: str, count: int, headers: Dict[str, str] = None,
+                       on_connect: Callable[[], None] = None) -> List[Dict[str, str]]:
+        events: List[Dict[str, str]] = []
+
+        async def _read_chunk(stream: tornado.iostream.IOStream) -> str:
+            size = int(await stream.read_until(b'\r\n'), 16)
+            return (await stream.read_bytes(size + 2))[:-2].decode('utf-8')
+
+        async def _stream():
+            stream = await tornado.tcpclient.TCPClient().connect('127.0.0.1', self.get_http_port())
+            request_headers = ''.join(f'{k}: {v}\r\n' for k, v in (headers or {}).items())
+            await stream.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n{request_headers}\r\n'.encode('utf-8'))
+            response_headers = (await stream.read_until(b'\r\n\r\n')).decode('utf-8')
+            self.assertIn('text/event-stream', response_headers)
+            if on_connect:
+                on_connect()
+
+            buffer = ''
+            while len(events) < count:
+                buffer += await _read_chunk(stream)
+                while '\n\n' in buffer:
+                    raw_event, buffer = buffer.split('\n\n', 1)
+                    if not raw_event.startswith(':'):
+                        events.append(dict(line.split(': ', 1) for line in raw_event.split('\n')))
+            stream.close()
+            # The server notices the closed connection on its next write.
+            await tornado.gen.sleep(0.2)
+
+        self.io_loop.run_sync(_stream, timeout=3)
+        return events
+
+    def test_streams_current_updates(self):
+        self.quiz_db.update_team(
+            quiz_id='test', team_id=5001, name='Liverpool', registration_time=123)
+        status_update_id = self.quiz.status_update_id
+
+        events = self._stream_events(
+            '/api/streamUpdates?min_status_update_id=1&min_teams_update_id=1&min_answers_update_id=1', 1)
+
+        self.assertEqual('updates', events[0]['event'])
+        self.assertEqual(f'{status_update_id + 1}.2.1', events[0]['id'])
+        updates = json.loads(events[0]['data'])
+        self.assertEqual('test', updates['status']['quiz_id'])
+        self.assertListEqual([dict(quiz_id='test', id=5001, name='Liverpool', timestamp=123, update_id=1)],
+                             updates['teams'])
+        self.assertListEqual([], updates['answers'])
+        self.assertSetEqual(set(), self.quiz_db._notifier._subscribers)
+
+    def test_streams_changes(self):
+        def _change():
+            self.quiz_db.update_team(
+                quiz_id='test', team_id=5001, name='Liverpool', registration_time=123)
+            self.quiz_db.update_answer(
+                quiz_id='test', question=1, team_id=5001, answer='Apple', answer_time=124)
+
+        events = self._stream_events(
+            f'/api/streamUpdates?min_status_update_id={self.quiz.status_update_id + 1}'
+            '&min_teams_update_id=1&min_answers_update_id=1', 1, on_connect=_change)
+
+        updates = json.loads(events[0]['data'])
+        self.assertIsNone(updates['status'])
+        self.assertEqual('Liverpool', updates['teams'][0]['name'])
+        self.assertEqual('Apple', updates['answers'][0]['answer'])
+        # Teams and answers share one sequence of update ids.
+        self.assertEqual(f'{self.quiz.status_update_id + 1}.2.3', events[0]['id'])
+        self.assertSetEqual(set(), self.quiz_db._notifier._subscribers)
+
+    def test_resumes_from_last_event_id(self):
+        self.quiz_db.update_team(
+            quiz_id='test', team_id=5001, name='Liverpool', registration_time=123)
+        self.quiz_db.update_team(
+            quiz_id='test', team_id=5002, name='Tottenham', registration_time=123)
+
+        events = self._stream_events(
+            '/api/streamUpdates?min_status_update_id=1&min_teams_update_id=1&min_answers_update_id=1', 1,
+            headers={'Last-Event-ID': f'{self.quiz.status_update_id + 1}.2.1'})
+
+        updates = json.loads(events[0]['data'])
+        self.assertIsNone(updates['status'])
+        self.assertListEqual(['Tottenham'], [t['name'] for t in updates['teams']])
+
+    def test_ignores_minus_one_cursors(self):
+        self.quiz_db.update_team(
+            quiz_id='test', team_id=5001, name='Liverpool', registration_time=123)
+        self.quiz_db.update_answer(
+            quiz_id='test', question=1, team_id=5001, answer='Apple', answer_time=124)
+
+        events = self._stream_events(
+            '/api/streamUpdates?min_status_update_id=-1&min_teams_update_id=0&min_answers_update_id=-1', 1)
+
+        updates = json.loads(events[0]['data'])
+        self.assertIsNone(updates['status'])
+        self.assertListEqual([], updates['answers'])
+        self.assertEqual(1, len(updates['teams']))
+        self.assertEqual(f'{2**31 - 1}.2.{2**31 - 1}', events[0]['id'])
+
+    def test_invalid_cursors(self):
+        response = self.fetch('/api/streamUpdates?min_status_update_id=1&min_teams_update_id=a')
+        self.assertEqual(400, response.code)
+        self.assertIn('error', json.loads(response.body))
+
+
+class GetScoreboardApiTest(StartedQuizBaseTestCase):
+    def test_returns_scoreboard(self):
+        self.quiz_db.update_team(quiz_id='test', team_id=5001, name='Liverpool', registration_time=1)
+        self.quiz_db.update_team(quiz_id='test', team_id=5002, name='Arsenal', registration_time=1)
+        self.quiz_db.set_answer_points(quiz_id='test', question=2, team_id=5002, points=1)
+
+        response = self.fetch('/api/getScoreboard', method='POST', body='')
+
+        self.assertEqual(200, response.code)
+        self.assertDictEqual({
+            'quiz_id': 'test',
+            'questions': 2,
+            'team_ids': [5002, 5001],
+            'names': ['Arsenal', 'Liverpool'],
+            'totals': [1, 0],
+            'points': [[None, 1], [None, None]],
+        }, json.loads(response.body))
+
+    def test_quiz_not_started(self):
+        self.quiz.stop()
+        response = self.fetch('/api/getScoreboard', method='POST', body='')
+        self.assertEqual(400, response.code)
+        self.assertDictEqual({'error': 'Quiz is not started.'}, json.loads(response.body))
+
+
 class SendResultsApiTest(StartedQuizBaseTestCase):
     def test_sends_results(self):
         self.quiz.send_results = MagicMock()
@@ -674,5 +1131,78 @@ class SendResultsApiTest(StartedQuizBaseTestCase):
         self.quiz.send_results.assert_not_called()
 
 
+class SendAllResultsApiTest(StartedQuizBaseTestCase):
+    def test_sends_all_results(self):
+        self.quiz.send_all_results = MagicMock(return_value=3)
+        response = self.fetch('/api/sendAllResults', method='POST', body='')
+        self.assertDictEqual({'teams': 3}, json.loads(response.body))
+        self.assertEqual(200, response.code)
+        self.quiz.send_all_results.assert_called_with()
+
+    def test_already_sending(self):
+        self.quiz.send_all_results = MagicMock(side_effect=TelegramQuizError('Results are already being sent.'))
+        response = self.fetch('/api/sendAllResults', method='POST', body='')
+        self.assertDictEqual({'error': 'Results are already being sent.'}, json.loads(response.body))
+        self.assertEqual(400, response.code)
+
+
+class TelegramWebhookTest(BaseTestCase):
+    """Plays Telegram by POSTing updates to the webhook of a started quiz."""
+
+    def _updater_factory(self, bot_api_token: str) -> telegram.ext.Updater:
+        updater = telegram.ext.Updater(bot_api_token, use_context=True)
+        updater.start_polling = MagicMock()
+        updater.bot.set_webhook = MagicMock()
+        updater.bot.delete_webhook = MagicMock()
+        # The dispatcher asks for the bot id, which would call Telegram otherwise.
+        updater.bot.bot = telegram.User(123, 'Quiz', is_bot=True)
+        return updater
+
+    def get_app(self):
+        app = super().get_app()
+        self.quiz._webhook_url = 'https://quiz.example.com'
+        self.quiz.start(quiz_id='test', bot_api_token='123:TOKEN', language='lang',
+                        updater_factory=self._updater_factory)
+        return app
+
+    def tearDown(self):
+        self.quiz.stop()
+        super().tearDown()
+
+    def _post_update(self, token: str, update_id: int, chat_id: int, text: str):
+        update = {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': 1001001001,
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': text,
+            },
+        }
+        return self.fetch(f'/telegram/{token}', method='POST', body=json.dumps(update))
+
+    def test_registers_team(self):
+        self.quiz._outbox.send = MagicMock()
+        self.quiz.start_registration()
+
+        self.assertEqual(200, self._post_update(self.quiz._webhook_token, 1001, 5001, '/start').code)
+        self.assertEqual(200, self._post_update(self.quiz._webhook_token, 1002, 5001, 'Liverpool').code)
+        self.quiz._updater.update_queue.join()
+
+        self.assertListEqual(['Liverpool'], [t.name for t in self.quiz_db.get_teams(quiz_id='test')])
+        self.quiz._message_writer.flush()
+        self.assertListEqual([1001, 1002], [m.update_id for m in self.quiz_db.select_messages()])
+
+    def test_wrong_token(self):
+        self.assertEqual(404, self._post_update('wrong', 1001, 5001, 'Apple').code)
+        self.assertTrue(self.quiz._updater.update_queue.empty())
+
+    def test_invalid_update(self):
+        response = self.fetch(f'/telegram/{self.quiz._webhook_token}', method='POST', body='#$%')
+        self.assertEqual(400, response.code)
+        response = self.fetch(f'/telegram/{self.quiz._webhook_token}', method='POST', body='[]')
+        self.assertEqual(400, response.code)
+
+
 if __name__ == '__main__':
     unittest.main()
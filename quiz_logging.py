@@ -0,0 +1,73 @@
+from datetime import datetime, timezone
+import json
+import logging
+import logging.handlers
+import queue
+from typing import Dict, Optional
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formats every record as one JSON object per line."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.process,
+            'thread': record.threadName,
+            'file': record.filename,
+            'line': record.lineno,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _LazyQueueHandler(logging.handlers.QueueHandler):
+    """Puts records into the queue as they are, the listener thread merges their arguments into the message."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def parse_module_levels(specs: Optional[list]) -> Dict[str, str]:
+    """Parses MODULE=LEVEL pairs, e.g. ["telegram_quiz=DEBUG", "quiz_db=WARNING"]."""
+    levels = {}
+    for spec in specs or []:
+        module, sep, level = spec.partition('=')
+        level = level.upper()
+        if not sep or not module or not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f'Invalid module log level "{spec}", expected MODULE=LEVEL.')
+        levels[module] = level
+    return levels
+
+
+def setup_logging(*, log_file: str, level: str = 'INFO', module_levels: Optional[Dict[str, str]] = None,
+                  max_bytes: int = 10 * 2**20, backup_count: int = 5) -> logging.handlers.QueueListener:
+    """Sends the records of all loggers through a queue to a rotating file of JSON lines.
+
+    Threads that log only put records into the queue, a listener thread formats and writes them.
+    The returned listener is started, it must be stopped to write the remaining records before exit.
+    """
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    file_handler.setFormatter(JsonLinesFormatter())
+    log_queue = queue.Queue()
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_LazyQueueHandler(log_queue))
+    root.setLevel(level.upper())
+    for module, module_level in (module_levels or {}).items():
+        logging.getLogger(module).setLevel(module_level)
+
+    listener.start()
+    return listener
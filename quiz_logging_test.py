@@ -0,0 +1,106 @@
+import json
+import logging
+import os
+from quiz_logging import parse_module_levels, setup_logging
+import tempfile
+import threading
+import unittest
+
+
+class _Unformattable:
+    def __str__(self):
+        raise AssertionError('Formatted on the logging thread.')
+
+
+class SetupLoggingTest(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = tempfile.TemporaryDirectory()
+        self.log_file = os.path.join(self.test_dir.name, 'main.log')
+        root = logging.getLogger()
+        self.root_handlers = list(root.handlers)
+        self.root_level = root.level
+
+    def tearDown(self):
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for handler in self.root_handlers:
+            root.addHandler(handler)
+        root.setLevel(self.root_level)
+        logging.getLogger('quiz_logging_test.quiet').setLevel(logging.NOTSET)
+        self.test_dir.cleanup()
+
+    def _read_records(self):
+        with open(self.log_file, encoding='utf-8') as file:
+            return [json.loads(line) for line in file]
+
+    def test_writes_json_lines(self):
+        listener = setup_logging(log_file=self.log_file)
+        logger = logging.getLogger('quiz_logging_test')
+
+        logger.info('Answer received. team: "%s", answer: "%s"', 'Юнікод', 'Apple')
+        try:
+            raise ValueError('Boom')
+        except ValueError:
+            logger.exception('Failed.')
+        listener.stop()
+
+        (info, error) = self._read_records()
+        self.assertEqual('INFO', info['level'])
+        self.assertEqual('quiz_logging_test', info['logger'])
+        self.assertEqual('quiz_logging_test.py', info['file'])
+        self.assertEqual('Answer received. team: "Юнікод", answer: "Apple"', info['message'])
+        self.assertEqual(threading.current_thread().name, info['thread'])
+        self.assertIn('ValueError: Boom', error['exception'])
+
+    def test_formats_on_listener_thread(self):
+        formatted_on = []
+
+        class _Recorder:
+            def __str__(self):
+                formatted_on.append(threading.current_thread())
+                return 'value'
+
+        listener = setup_logging(log_file=self.log_file)
+        logging.getLogger('quiz_logging_test').info('Lazy %s', _Recorder())
+        listener.stop()
+
+        self.assertEqual('Lazy value', self._read_records()[0]['message'])
+        self.assertNotIn(threading.current_thread(), formatted_on)
+
+    def test_module_levels(self):
+        listener = setup_logging(log_file=self.log_file, level='info',
+                                 module_levels={'quiz_logging_test.quiet': 'WARNING'})
+
+        logging.getLogger('quiz_logging_test.quiet').info('Skipped %s', _Unformattable())
+        logging.getLogger('quiz_logging_test.quiet').warning('Kept.')
+        logging.getLogger('quiz_logging_test').debug('Skipped %s', _Unformattable())
+        listener.stop()
+
+        self.assertEqual(['Kept.'], [r['message'] for r in self._read_records()])
+
+    def test_rotates(self):
+        listener = setup_logging(log_file=self.log_file, max_bytes=1000, backup_count=2)
+        for i in range(100):
+            logging.getLogger('quiz_logging_test').info('Message %d', i)
+        listener.stop()
+
+        self.assertTrue(os.path.exists(self.log_file + '.1'))
+        self.assertTrue(os.path.exists(self.log_file + '.2'))
+        self.assertFalse(os.path.exists(self.log_file + '.3'))
+        self.assertLessEqual(os.path.getsize(self.log_file), 1000)
+
+
+class ParseModuleLevelsTest(unittest.TestCase):
+    def test_parses(self):
+        self.assertDictEqual({'telegram_quiz': 'DEBUG', 'quiz_db': 'WARNING'},
+                             parse_module_levels(['telegram_quiz=debug', 'quiz_db=WARNING']))
+        self.assertDictEqual({}, parse_module_levels(None))
+
+    def test_rejects_invalid(self):
+        for spec in ('telegram_quiz', '=DEBUG', 'telegram_quiz=LOUD'):
+            self.assertRaisesRegex(ValueError, 'expected MODULE=LEVEL', parse_module_levels, [spec])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import collections
+import os
+import sys
+import threading
+import time
+from typing import Dict, List
+
+
+class ProfilerBusyError(Exception):
+    pass
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads and counts them in the collapsed format of flamegraph.pl.
+
+    Nothing runs between profiles: samples are taken by the thread that calls profile(), and only while it runs.
+    """
+
+    def __init__(self, *, interval: float = 0.005):
+        self._interval = interval
+        self._lock = threading.Lock()
+
+    def profile(self, seconds: float) -> str:
+        """Samples for the given number of seconds and returns one line per stack: frames from the root, the count.
+
+        The first frame of every stack is the name of its thread. Raises ProfilerBusyError if a profile runs already.
+        """
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError('Another profile is running.')
+        try:
+            counts = self._sample(seconds)
+        finally:
+            self._lock.release()
+        return ''.join(f'{stack} {count}\n' for stack, count in sorted(counts.items()))
+
+    def _sample(self, seconds: float) -> Dict[str, int]:
+        counts: Dict[str, int] = collections.Counter()
+        own_thread_id = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while True:
+            thread_names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread_id:
+                    continue
+                frames: List[str] = []
+                while frame is not None:
+                    frames.append(_frame_name(frame))
+                    frame = frame.f_back
+                frames.append(thread_names.get(thread_id, str(thread_id)))
+                counts[';'.join(reversed(frames))] += 1
+            now = time.monotonic()
+            if now >= deadline:
+                return counts
+            time.sleep(min(self._interval, deadline - now))
@@ -0,0 +1,52 @@
+from sampling_profiler import ProfilerBusyError, SamplingProfiler
+import threading
+import time
+import unittest
+
+
+def _busy_loop(stop: threading.Event):
+    while not stop.is_set():
+        time.sleep(0.001)
+
+
+class SamplingProfilerTest(unittest.TestCase):
+    def test_samples_other_threads(self):
+        stop = threading.Event()
+        thread = threading.Thread(target=_busy_loop, args=(stop,), name='busy')
+        thread.start()
+        try:
+            stacks = SamplingProfiler(interval=0.001).profile(0.05)
+        finally:
+            stop.set()
+            thread.join()
+
+        lines = stacks.splitlines()
+        busy = [line for line in lines if line.startswith('busy;')]
+        self.assertTrue(busy)
+        stack, count = busy[0].rsplit(' ', 1)
+        self.assertGreater(int(count), 0)
+        self.assertTrue(stack.endswith(';_busy_loop (sampling_profiler_test.py:7)'), stack)
+        self.assertFalse([line for line in lines if '_sample (sampling_profiler.py' in line])
+
+    def test_one_profile_at_a_time(self):
+        profiler = SamplingProfiler()
+        started = threading.Event()
+        thread = threading.Thread(target=lambda: (started.set(), profiler.profile(0.2)))
+        thread.start()
+        started.wait()
+        time.sleep(0.05)
+
+        self.assertRaises(ProfilerBusyError, profiler.profile, 0.01)
+        thread.join()
+        profiler.profile(0.01)
+
+    def test_runs_no_thread_when_idle(self):
+        threads = threading.active_count()
+
+        SamplingProfiler(interval=0.001).profile(0.01)
+
+        self.assertEqual(threads, threading.active_count())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -122,6 +122,27 @@ describe('Init', () => {
             assert.equal(checkbox5003.parentElement.style.color, 'green')
         })
 
+        it('#sendsToAllTeams', async () => {
+            api.mockSendAllResults = async () => 3
+            await controller.init()
+
+            await document.getElementById('send_all_results_button').onclick()
+
+            assert.deepEqual(api.sendAllResultsCalls, [[]])
+            assert.deepEqual(api.sendResultsCalls, [])
+            assert.equal(document.getElementById('send_all_results_status').textContent, 'Sending results to 3 teams.')
+        })
+
+        it('#sendToAllTeamsThrows', async () => {
+            api.mockSendAllResults = async () => { throw 'already being sent' }
+            await controller.init()
+
+            await document.getElementById('send_all_results_button').onclick()
+
+            assert.equal(document.getElementById('send_all_results_status').textContent,
+                'Could not send results: already being sent')
+        })
+
         it('#oneTeamThrows', async () => {
             api.mockSendResults = async (teamId) => {
                 console.log('Mock send results: ' + teamId)
@@ -1,3 +1,18 @@
+// Turns teams or answers of a columnar getUpdates response back into a list of objects.
+function fromColumns(quizId, columns) {
+    const keys = Object.keys(columns)
+    const length = keys.length > 0 ? columns[keys[0]].length : 0
+    const rows = []
+    for (let i = 0; i < length; i++) {
+        const row = { quiz_id: quizId }
+        for (const key of keys) {
+            row[key] = columns[key][i]
+        }
+        rows.push(row)
+    }
+    return rows
+}
+
 export class Api {
     constructor(fetcher) {
         this.fetcher = fetcher
@@ -9,7 +24,17 @@ export class Api {
             body: JSON.stringify(args),
             headers: { 'Content-Type': 'application/json' },
         })
+        return await this.parseResponse(response)
+    }
+
+    // Read-only commands are made with GET, the browser revalidates its cached response by the ETag
+    // and the server answers with 304 while nothing has changed.
+    async readServer(command) {
+        const response = await this.fetcher('/api/' + command, { method: 'GET', cache: 'no-cache' })
+        return await this.parseResponse(response)
+    }
 
+    async parseResponse(response) {
         const text = await response.text()
 
         try {
@@ -33,9 +58,47 @@ export class Api {
             min_teams_update_id: minTeamsUpdateId,
             min_answers_update_id: minAnswersUpdateId,
             timeout: 30,
+            format: 'columnar',
         })
 
-        return response
+        return {
+            status: response.status,
+            teams: fromColumns(response.quiz_id, response.teams),
+            answers: fromColumns(response.quiz_id, response.answers),
+        }
+    }
+
+    // Returns null when the browser can not stream updates. onError is called once the stream is closed for good.
+    streamUpdates(minStatusUpdateId, minTeamsUpdateId, minAnswersUpdateId, onUpdates, onError) {
+        if (typeof (EventSource) === 'undefined') {
+            return null
+        }
+
+        const params = new URLSearchParams({
+            min_status_update_id: minStatusUpdateId,
+            min_teams_update_id: minTeamsUpdateId,
+            min_answers_update_id: minAnswersUpdateId,
+        })
+        const source = new EventSource('/api/streamUpdates?' + params.toString())
+
+        source.addEventListener('updates', (event) => {
+            onUpdates(JSON.parse(event.data))
+        })
+
+        source.onerror = () => {
+            // The browser reconnects by itself unless the server refused the stream.
+            if (source.readyState === EventSource.CLOSED) {
+                onError()
+            }
+        }
+
+        return source
+    }
+
+    // Teams ranked by their total points. Lists team_ids, names, totals and points are parallel,
+    // points of a team are given for questions 1..questions.
+    async getScoreboard() {
+        return await this.readServer('getScoreboard')
     }
 
     async startRegistration() {
@@ -92,4 +155,10 @@ export class Api {
             'team_id': teamId,
         })
     }
+
+    // Returns the number of teams. The results are sent in the background, the progress is reported in the status.
+    async sendAllResults() {
+        const response = await this.callServer('sendAllResults')
+        return response.teams
+    }
 }
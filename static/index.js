@@ -9,6 +9,10 @@ function updateTextContent(element, newTextContent) {
     }
 }
 
+function pointsOf(answer) {
+    return answer == null || answer.points == null ? null : answer.points
+}
+
 export class QuizController {
     constructor(document, api) {
         this.document = document
@@ -23,6 +27,8 @@ export class QuizController {
         this.lastSeenStatusUpdateId = 0
         this.lastSeenTeamsUpdateId = 0
         this.lastSeenAnswersUpdateId = 0
+        this.scoreboardRequest = null
+        this.scoreboardStale = false
     }
 
     init() {
@@ -131,11 +137,13 @@ export class QuizController {
         }
     }
 
-    updateResultsTable() {
+    // Teams are shown in the order of the scoreboard, ranked by their total points.
+    updateResultsTable(scoreboard) {
         const table = this.document.getElementById('results_table')
 
-        for (const [teamId, team] of this.teamsIndex) {
-            const rowId = 'results_team_' + teamId + '_row'
+        var previousRow = null
+        for (let i = 0; i < scoreboard.team_ids.length; i++) {
+            const rowId = 'results_team_' + scoreboard.team_ids[i] + '_row'
             var row = this.document.getElementById(rowId)
             if (!row) {
                 row = table.insertRow()
@@ -146,34 +154,46 @@ export class QuizController {
                 }
             }
 
-            var totalPoints = 0
+            const nextRow = previousRow ? previousRow.nextElementSibling : table.querySelector('tr[id^="results_team_"]')
+            if (nextRow !== row) {
+                row.parentNode.insertBefore(row, nextRow)
+            }
+            previousRow = row
 
+            // Points are given for questions up to the last one that has any.
+            const points = scoreboard.points[i]
             for (let question = 1; question <= this.numberOfQuestions; question++) {
-                if (this.answersIndex.has(question)) {
-                    var answers = this.answersIndex.get(question)
-                    if (answers.has(teamId)) {
-                        var points = answers.get(teamId).points
-                    } else {
-                        var points = null
-                    }
-                } else {
-                    var points = null
-                }
-
-                if (points != null) {
-                    totalPoints += points
-                }
-
-                updateTextContent(row.cells[question + 1], points)
+                updateTextContent(row.cells[question + 1], question <= points.length ? points[question - 1] : null)
             }
 
-            updateTextContent(row.cells[0], team.name)
-            updateTextContent(row.cells[1], totalPoints)
+            updateTextContent(row.cells[0], scoreboard.names[i])
+            updateTextContent(row.cells[1], scoreboard.totals[i])
         }
 
         this.hightlightResultsTable()
     }
 
+    // Totals are summed up by the server. A scoreboard requested while another one is being fetched
+    // is fetched once more afterwards, so that the table never stays behind the last change.
+    refreshScoreboard() {
+        if (this.scoreboardRequest) {
+            this.scoreboardStale = true
+            return this.scoreboardRequest
+        }
+        this.scoreboardRequest = (async () => {
+            do {
+                this.scoreboardStale = false
+                try {
+                    this.updateResultsTable(await this.api.getScoreboard())
+                } catch (error) {
+                    console.error('Could not get scoreboard: ' + error)
+                }
+            } while (this.scoreboardStale)
+            this.scoreboardRequest = null
+        })()
+        return this.scoreboardRequest
+    }
+
     highlightQuestionHeader() {
         const header = this.document.getElementById('question_header')
         if (this.currentQuestion === this.runningQuestion) {
@@ -287,9 +307,16 @@ export class QuizController {
             this.updateStartStopQuestionButtons(updates.status)
         }
 
+        // Whether a team or the points of an answer have changed, which the results table shows.
+        var resultsChanged = false
+
         // Update teams index.
         for (const team of updates.teams) {
             this.lastSeenTeamsUpdateId = Math.max(this.lastSeenTeamsUpdateId, team.update_id)
+            const oldTeam = this.teamsIndex.get(team.id)
+            if (!oldTeam || oldTeam.name !== team.name) {
+                resultsChanged = true
+            }
             this.teamsIndex.set(team.id, team)
             console.log('Team update. Name: "' + team.name + '". Id: ' + team.id)
         }
@@ -300,17 +327,41 @@ export class QuizController {
             if (!this.answersIndex.has(answer.question)) {
                 this.answersIndex.set(answer.question, new Map())
             }
-            this.answersIndex.get(answer.question).set(answer.team_id, answer)
+            const answers = this.answersIndex.get(answer.question)
+            if (pointsOf(answers.get(answer.team_id)) !== pointsOf(answer)) {
+                resultsChanged = true
+            }
+            answers.set(answer.team_id, answer)
             console.log('Answer update. Question: ' + answer.question +
                 '. Team Id: ' + answer.team_id + '. Answer: "' + answer.answer + '"')
         }
 
-        this.updateResultsTable()
+        if (resultsChanged) {
+            this.refreshScoreboard()
+        }
+        this.hightlightResultsTable()
         this.updateAnswersTable()
         this.highlightQuestionHeader()
     }
 
-    async listenToServer() {
+    listenToServer() {
+        const source = this.api.streamUpdates(
+            this.lastSeenStatusUpdateId + 1,
+            this.lastSeenTeamsUpdateId + 1,
+            this.lastSeenAnswersUpdateId + 1,
+            (updates) => this.updateQuiz(updates),
+            () => {
+                console.warn('Update stream closed, falling back to long polling.')
+                this.pollServer()
+            }
+        )
+
+        if (source == null) {
+            this.pollServer()
+        }
+    }
+
+    async pollServer() {
         var failedAttempts = 0
         while (failedAttempts < 60) {
             var updates = null
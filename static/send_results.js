@@ -42,6 +42,18 @@ export class Controller {
                 }
             }
         }
+
+        const sendAllButton = this.document.getElementById('send_all_results_button')
+        const sendAllStatus = this.document.getElementById('send_all_results_status')
+        sendAllButton.onclick = async () => {
+            try {
+                const count = await this.api.sendAllResults()
+                sendAllStatus.textContent = 'Sending results to ' + count + ' teams.'
+            } catch (e) {
+                console.error('Could not send results to all teams: ' + e)
+                sendAllStatus.textContent = 'Could not send results: ' + e
+            }
+        }
     }
 }
 
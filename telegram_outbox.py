@@ -0,0 +1,204 @@
+import collections
+from dataclasses import dataclass
+import heapq
+import itertools
+import logging
+import metrics
+import queue
+import telegram
+import telegram.error
+import threading
+import time
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+
+_logger = logging.getLogger(__name__)
+
+TELEGRAM_CALL_SECONDS = metrics.Histogram(
+    'quiz_telegram_call_seconds', 'Duration of calls to the Telegram Bot API.', ['method'])
+
+
+@dataclass
+class OutboundMessage:
+    chat_id: int
+    text: str
+    # Called from a worker thread with True once the message is sent, or with False if it is given up.
+    on_done: Optional[Callable[[bool], None]] = None
+
+
+class TokenBucket:
+    """Allows rate events per second on average, with bursts of up to capacity events."""
+
+    def __init__(self, *, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self._rate = rate
+        self._capacity = capacity
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._tokens = capacity
+        self._last_time = clock()
+
+    def reserve(self) -> float:
+        """Takes a token and returns the number of seconds to wait before it may be used."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self._capacity, self._tokens + (now - self._last_time) * self._rate)
+            self._last_time = now
+            # Tokens go negative while callers wait, so that they are served in the order they came.
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self._rate)
+
+
+class OutboundDispatcher:
+    """Sends Telegram messages from a pool of worker threads.
+
+    Messages to one chat always go to the same worker, so they arrive in the order they were sent.
+    Sending is paced to stay within Telegram limits: about 30 messages per second overall
+    and about one message per second to the same chat, with short bursts allowed.
+    A worker holds back the messages of a chat over its rate and meanwhile sends the messages of other chats,
+    it only sleeps for the overall rate.
+    Flood control (RetryAfter) is retried after the delay Telegram asks for, network errors are
+    retried with an exponential backoff. Other errors are logged and the message is dropped.
+    """
+
+    _STOP = object()
+
+    def __init__(self, *, bot: telegram.Bot, workers: int = 4, max_queue_size: int = 1000, max_retries: int = 5,
+                 backoff: float = 0.5, global_rate: float = 30.0, global_burst: float = 30.0,
+                 chat_rate: float = 1.0, chat_burst: float = 3.0):
+        if workers < 1:
+            raise ValueError('Outbound dispatcher needs at least one worker.')
+        self._bot = bot
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._global_bucket = TokenBucket(rate=global_rate, capacity=global_burst)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chat_buckets_lock = threading.Lock()
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._started = False
+        self._stopping = threading.Event()
+        self._queues: List[queue.Queue] = [queue.Queue() for _ in range(workers)]
+        # Messages held back by a worker are not in its queue any more, but still count towards its size.
+        self._slots = [threading.BoundedSemaphore(max(1, max_queue_size // workers)) for _ in range(workers)]
+        self._threads = [threading.Thread(target=self._run, args=(i,), name=f'OutboundDispatcher-{i}', daemon=True)
+                         for i in range(workers)]
+
+    def start(self) -> None:
+        self._started = True
+        for thread in self._threads:
+            thread.start()
+
+    def send(self, chat_id: int, text: str, on_done: Optional[Callable[[bool], None]] = None) -> bool:
+        """Queues a message without blocking. Returns False if the queue is full and the message is dropped."""
+        index = chat_id % len(self._queues)
+        if not self._slots[index].acquire(blocking=False):
+            _logger.warning('Outbound queue is full, dropping message. chat_id: %s, text: "%s"', chat_id, text)
+            return False
+        self._queues[index].put(OutboundMessage(chat_id=chat_id, text=text, on_done=on_done))
+        return True
+
+    def flush(self) -> None:
+        for q in self._queues:
+            q.join()
+
+    def stop(self) -> None:
+        """Sends the queued messages once more and stops the workers, pending retries are abandoned."""
+        if not self._started or self._stopping.is_set():
+            return
+        self._stopping.set()
+        for q in self._queues:
+            q.put(self._STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def _get_chat_bucket(self, chat_id: int) -> TokenBucket:
+        with self._chat_buckets_lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if not bucket:
+                bucket = self._chat_buckets[chat_id] = TokenBucket(rate=self._chat_rate, capacity=self._chat_burst)
+            return bucket
+
+    def _wait_for_global_rate_limit(self) -> None:
+        delay = self._global_bucket.reserve()
+        if delay:
+            time.sleep(delay)
+
+    def _send(self, message: OutboundMessage) -> bool:
+        attempt = 0
+        while True:
+            self._wait_for_global_rate_limit()
+            try:
+                with TELEGRAM_CALL_SECONDS.time('send_message'):
+                    self._bot.send_message(message.chat_id, message.text)
+                return True
+            except telegram.error.RetryAfter as e:
+                delay = e.retry_after
+            except telegram.error.BadRequest:
+                _logger.exception(f'Telegram rejected message. chat_id: {message.chat_id}, text: "{message.text}"')
+                return False
+            except telegram.error.NetworkError:
+                delay = self._backoff * 2**attempt
+            except telegram.error.TelegramError:
+                _logger.exception(f'Could not send message. chat_id: {message.chat_id}, text: "{message.text}"')
+                return False
+
+            attempt += 1
+            if attempt > self._max_retries or self._stopping.wait(delay):
+                _logger.error(f'Giving up sending message after {attempt} attempts. '
+                              f'chat_id: {message.chat_id}, text: "{message.text}"')
+                return False
+            _logger.warning('Retrying message in %.3f s. chat_id: %s, attempt: %s', delay, message.chat_id, attempt)
+
+    def _process(self, index: int, message: OutboundMessage) -> None:
+        try:
+            sent = False
+            try:
+                sent = self._send(message)
+            finally:
+                if message.on_done:
+                    message.on_done(sent)
+        except Exception:
+            _logger.exception('Outbound dispatcher error.')
+        finally:
+            self._slots[index].release()
+            self._queues[index].task_done()
+
+    def _send_within_chat_rate(self, index: int, chat_id: int, held: Dict[int, Deque[OutboundMessage]],
+                               ready_times: List[Tuple[float, int, int]], sequence: Iterator[int]) -> None:
+        """Sends held messages of the chat while its rate allows, then schedules the next one."""
+        chat_messages = held[chat_id]
+        while chat_messages:
+            delay = self._get_chat_bucket(chat_id).reserve()
+            if delay:
+                # The token is taken, the message is sent once the time comes without asking the bucket again.
+                heapq.heappush(ready_times, (time.monotonic() + delay, next(sequence), chat_id))
+                return
+            self._process(index, chat_messages.popleft())
+        del held[chat_id]
+
+    def _run(self, index: int) -> None:
+        messages = self._queues[index]
+        # Messages of chats over their rate in the order they came, and when the first of them may be sent.
+        held: Dict[int, Deque[OutboundMessage]] = {}
+        ready_times: List[Tuple[float, int, int]] = []
+        sequence = itertools.count()
+        stopping = False
+        while not stopping or held:
+            timeout = max(0.0, ready_times[0][0] - time.monotonic()) if ready_times else None
+            try:
+                message = messages.get(timeout=timeout)
+            except queue.Empty:
+                message = None
+            if message is self._STOP:
+                stopping = True
+                messages.task_done()
+            elif message is not None:
+                if message.chat_id in held:
+                    held[message.chat_id].append(message)
+                else:
+                    held[message.chat_id] = collections.deque([message])
+                    self._send_within_chat_rate(index, message.chat_id, held, ready_times, sequence)
+            while ready_times and ready_times[0][0] <= time.monotonic():
+                _, _, chat_id = heapq.heappop(ready_times)
+                self._process(index, held[chat_id].popleft())
+                self._send_within_chat_rate(index, chat_id, held, ready_times, sequence)
@@ -0,0 +1,192 @@
+import telegram.error
+from telegram_outbox import OutboundDispatcher, TokenBucket
+import threading
+import time
+import unittest
+from unittest.mock import call, MagicMock
+
+
+class OutboundDispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.bot = MagicMock()
+        self.outbox = OutboundDispatcher(bot=self.bot, workers=2, max_queue_size=10, max_retries=2, backoff=0.001,
+                                         chat_rate=1000, chat_burst=1000)
+
+    def tearDown(self):
+        self.outbox.stop()
+
+    def test_sends_messages(self):
+        self.outbox.start()
+        self.assertTrue(self.outbox.send(5001, 'Apple'))
+        self.assertTrue(self.outbox.send(5002, 'Banana'))
+        self.outbox.flush()
+
+        self.assertCountEqual([call(5001, 'Apple'), call(5002, 'Banana')], self.bot.send_message.call_args_list)
+
+    def test_keeps_order_within_chat(self):
+        self.outbox.start()
+        for i in range(5):
+            self.outbox.send(5001, f'Message {i}')
+        self.outbox.flush()
+
+        self.assertListEqual([call(5001, f'Message {i}') for i in range(5)], self.bot.send_message.call_args_list)
+
+    def test_retries_after_flood_control(self):
+        self.bot.send_message.side_effect = [telegram.error.RetryAfter(0), None]
+        self.outbox.start()
+        self.outbox.send(5001, 'Apple')
+        self.outbox.flush()
+
+        self.assertListEqual([call(5001, 'Apple')] * 2, self.bot.send_message.call_args_list)
+
+    def test_retries_network_errors(self):
+        self.bot.send_message.side_effect = [telegram.error.TimedOut(), telegram.error.NetworkError('reset'), None]
+        self.outbox.start()
+        self.outbox.send(5001, 'Apple')
+        self.outbox.flush()
+
+        self.assertEqual(3, self.bot.send_message.call_count)
+
+    def test_gives_up_after_max_retries(self):
+        self.bot.send_message.side_effect = telegram.error.NetworkError('reset')
+        self.outbox.start()
+        self.outbox.send(5001, 'Apple')
+        self.outbox.flush()
+
+        self.assertEqual(3, self.bot.send_message.call_count)
+
+    def test_does_not_retry_rejected_messages(self):
+        self.bot.send_message.side_effect = [telegram.error.BadRequest('Chat not found'), None]
+        self.outbox.start()
+        self.outbox.send(5001, 'Apple')
+        self.outbox.send(5001, 'Banana')
+        self.outbox.flush()
+
+        self.assertListEqual([call(5001, 'Apple'), call(5001, 'Banana')], self.bot.send_message.call_args_list)
+
+    def test_reports_outcome(self):
+        self.bot.send_message.side_effect = [None, telegram.error.Unauthorized('Blocked')]
+        on_done = MagicMock()
+        self.outbox.start()
+        self.outbox.send(5001, 'Apple', on_done=on_done)
+        self.outbox.send(5001, 'Banana', on_done=on_done)
+        self.outbox.flush()
+
+        self.assertListEqual([call(True), call(False)], on_done.call_args_list)
+
+    def test_paces_messages_to_one_chat(self):
+        outbox = OutboundDispatcher(bot=self.bot, workers=2, chat_rate=20, chat_burst=1)
+        outbox.start()
+        start_time = time.monotonic()
+        for i in range(3):
+            outbox.send(5001, f'Message {i}')
+        outbox.flush()
+        outbox.stop()
+
+        self.assertGreaterEqual(time.monotonic() - start_time, 0.09)
+        self.assertEqual(3, self.bot.send_message.call_count)
+
+    def test_busy_chat_does_not_delay_other_chats(self):
+        idle_sent = threading.Event()
+        calls = []
+
+        def _send_message(chat_id, text):
+            calls.append((chat_id, text))
+            if chat_id == 5008:
+                idle_sent.set()
+
+        self.bot.send_message.side_effect = _send_message
+        # Both chats share the only worker.
+        outbox = OutboundDispatcher(bot=self.bot, workers=1, chat_rate=5, chat_burst=1)
+        outbox.start()
+        for i in range(3):
+            outbox.send(5004, f'Message {i}')
+        start_time = time.monotonic()
+        outbox.send(5008, 'Idle')
+
+        self.assertTrue(idle_sent.wait(timeout=5))
+        self.assertLess(time.monotonic() - start_time, 0.1)
+        self.assertListEqual([(5004, 'Message 0'), (5008, 'Idle')], calls)
+        outbox.flush()
+        outbox.stop()
+        self.assertListEqual([(5004, 'Message 0'), (5008, 'Idle'), (5004, 'Message 1'), (5004, 'Message 2')], calls)
+
+    def test_stop_sends_held_messages(self):
+        outbox = OutboundDispatcher(bot=self.bot, workers=1, chat_rate=20, chat_burst=1)
+        outbox.start()
+        for i in range(3):
+            outbox.send(5001, f'Message {i}')
+        outbox.stop()
+
+        self.assertListEqual([call(5001, f'Message {i}') for i in range(3)], self.bot.send_message.call_args_list)
+
+    def test_paces_all_messages(self):
+        outbox = OutboundDispatcher(bot=self.bot, workers=2, global_rate=20, global_burst=1)
+        outbox.start()
+        start_time = time.monotonic()
+        for chat_id in range(5001, 5004):
+            outbox.send(chat_id, 'Apple')
+        outbox.flush()
+        outbox.stop()
+
+        self.assertGreaterEqual(time.monotonic() - start_time, 0.09)
+        self.assertEqual(3, self.bot.send_message.call_count)
+
+    def test_drops_messages_when_full(self):
+        # 5 messages per worker, chats 5000 and 5002 share a worker.
+        for i in range(5):
+            self.assertTrue(self.outbox.send(5000, f'Message {i}'))
+        self.assertFalse(self.outbox.send(5002, 'Dropped'))
+        self.assertTrue(self.outbox.send(5001, 'Other worker'))
+
+    def test_stop_sends_queued_messages(self):
+        self.outbox.send(5001, 'Apple')
+        self.outbox.send(5002, 'Banana')
+        self.outbox.start()
+        self.outbox.stop()
+
+        self.assertEqual(2, self.bot.send_message.call_count)
+
+    def test_stop_abandons_retries(self):
+        sent = threading.Event()
+
+        def _send_message(*args):
+            sent.set()
+            raise telegram.error.RetryAfter(1000)
+
+        self.bot.send_message.side_effect = _send_message
+        self.outbox.start()
+        self.outbox.send(5001, 'Apple')
+        self.assertTrue(sent.wait(timeout=5))
+        self.outbox.stop()
+
+        self.assertEqual(1, self.bot.send_message.call_count)
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 100.0
+        self.bucket = TokenBucket(rate=2, capacity=3, clock=lambda: self.now)
+
+    def test_allows_bursts(self):
+        self.assertListEqual([0, 0, 0], [self.bucket.reserve() for _ in range(3)])
+
+    def test_delays_after_burst(self):
+        for _ in range(3):
+            self.bucket.reserve()
+        self.assertEqual(0.5, self.bucket.reserve())
+        self.assertEqual(1.0, self.bucket.reserve())
+
+    def test_refills(self):
+        for _ in range(3):
+            self.bucket.reserve()
+        self.now += 1
+        self.assertListEqual([0, 0, 0.5], [self.bucket.reserve() for _ in range(3)])
+
+    def test_does_not_refill_above_capacity(self):
+        self.now += 100
+        self.assertListEqual([0, 0, 0, 0.5], [self.bucket.reserve() for _ in range(4)])
+
+
+if __name__ == '__main__':
+    unittest.main()
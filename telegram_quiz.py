@@ -1,14 +1,30 @@
+from answer_tracer import AnswerTracer
 from dataclasses import dataclass, field
 from datetime import datetime
+import hmac
 import json
 import logging
-from quiz_db import Answer, Message, QuizDb, Team
+import metrics
+from quiz_db import Answer, BatchedAnswerWriter, BatchedMessageWriter, Message, QuizDb, Team
 import telegram
+from telegram_outbox import OutboundDispatcher, TELEGRAM_CALL_SECONDS
 from telegram.ext import MessageHandler, Updater
 import telegram.update
+import secrets
 import threading
 import time
-from typing import Callable, List, Optional, Set
+from typing import Any, Callable, Dict, List, Optional
+from update_notifier import UpdateNotifier
+
+
+_logger = logging.getLogger(__name__)
+
+
+# Telegram POSTs updates to this path followed by a secret token, see TelegramQuiz(webhook_url=...).
+WEBHOOK_PATH_PREFIX = '/telegram/'
+
+_HANDLER_SECONDS = metrics.Histogram(
+    'quiz_telegram_handler_seconds', 'Time spent handling a Telegram update.', ['handler'])
 
 
 class TelegramQuizError(Exception):
@@ -32,29 +48,61 @@ class QuizStatus:
     question: Optional[int]
     registration: bool
     time: str = field(default=None, compare=False)
+    # Progress of the last send_all_results().
+    results_total: int = 0
+    results_sent: int = 0
+    results_failed: int = 0
+
+
+@dataclass(frozen=True)
+class _QuestionState:
+    """Everything an answer handler needs, replaced as a whole, so that handlers read it without the lock."""
+    quiz_id: str
+    question: int
+    strings: Strings
+    answer_writer: BatchedAnswerWriter
+    outbox: OutboundDispatcher
 
 
 @dataclass
 class Updates:
-    status: QuizStatus
+    status: Optional[QuizStatus]
     teams: List[Team]
     answers: List[Answer]
 
 
 class TelegramQuiz:
-    def __init__(self, *, quiz_db: QuizDb, strings_file: str):
+    def __init__(self, *, quiz_db: QuizDb, strings_file: str, webhook_url: Optional[str] = None,
+                 notify_debounce: float = 0.0):
+        """If webhook_url is given, Telegram sends updates to the HTTP server at this public URL instead of being polled.
+
+        Subscribers are notified of status changes at most once per notify_debounce seconds, see UpdateNotifier.
+        """
         self._quiz_db = quiz_db
         self._strings_file = strings_file
-        self._lock = threading.Lock()
+        self._webhook_url = webhook_url
+        self._webhook_token: Optional[str] = None
+        self._dispatcher_thread: Optional[threading.Thread] = None
+        self._lock = metrics.TimedLock('telegram_quiz')
+        # Serializes start() and stop(), which call Telegram without holding the quiz lock.
+        self._start_stop_lock = threading.Lock()
         self._id: Optional[str] = None
         self._question: Optional[int] = None
         self._registration_handler: Optional[MessageHandler] = None
         self._question_handler: Optional[MessageHandler] = None
+        self._question_state: Optional[_QuestionState] = None
         self._updater: Optional[Updater] = None
+        self._message_writer: Optional[BatchedMessageWriter] = None
+        self._answer_writer: Optional[BatchedAnswerWriter] = None
+        self._outbox: Optional[OutboundDispatcher] = None
         self._language: Optional[str] = None
         self._strings: Optional[Strings] = None
         self._status_update_id = 0
-        self._subscribers: Set[Callable[[], None]] = set()
+        self._results_total = 0
+        self._results_sent = 0
+        self._results_failed = 0
+        self._notifier = UpdateNotifier(debounce=notify_debounce, name='TelegramQuizNotifier')
+        self._answer_tracer = AnswerTracer()
 
     def _get_strings(self, strings_file: str, language: str) -> Strings:
         try:
@@ -83,21 +131,20 @@ class TelegramQuiz:
         return strings
 
     def add_updates_subscriber(self, callback: Callable[[], None]) -> None:
-        with self._lock:
-            self._subscribers.add(callback)
+        self._notifier.add_subscriber(callback)
 
     def remove_updates_subscriber(self, callback: Callable[[], None]) -> None:
-        with self._lock:
-            self._subscribers.remove(callback)
+        self._notifier.remove_subscriber(callback)
 
+    @_HANDLER_SECONDS.timed
     def _handle_registration_update(self, update: telegram.update.Update, context: telegram.ext.CallbackContext):
-        start_time = time.time()
+        reply = None
         with self._lock:
             if self._registration_handler is None:
-                logging.warning('Skipping registration update as registration closed.')
+                _logger.warning('Skipping registration update as registration closed.')
                 return
             chat_id = update.message.chat_id
-            message: telegram.message.Message = update.message
+            outbox = self._outbox
 
             if context.chat_data.get('typing_name'):
                 del context.chat_data['typing_name']
@@ -106,35 +153,33 @@ class TelegramQuiz:
 
                 text = ' '.join(text.split())[:30]
 
-                logging.info(
-                    f'Registration message. chat_id: {chat_id}, quiz_id: "{self._id}", name: "{text}"')
+                _logger.info('Registration message. chat_id: %s, quiz_id: "%s", name: "%s"', chat_id, self._id, text)
                 update_id = self._quiz_db.update_team(
                     quiz_id=self._id, team_id=chat_id, name=text, registration_time=registration_time)
                 if update_id:
-                    message.reply_text(
-                        self._strings.registration_confirmation.format(team=text))
+                    reply = self._strings.registration_confirmation.format(team=text)
                 else:
-                    logging.warning(
-                        f'Outdated registration. quiz_id: "{self._id}", chat_id: {chat_id}, name: {text}')
+                    _logger.warning('Outdated registration. quiz_id: "%s", chat_id: %s, name: %s',
+                                    self._id, chat_id, text)
             else:
-                logging.info(
-                    f'Requesting a team to send their name. chat_id: {chat_id}, quiz_id: "{self._id}"')
+                _logger.info('Requesting a team to send their name. chat_id: %s, quiz_id: "%s"', chat_id, self._id)
                 context.chat_data['typing_name'] = True
-                message.reply_text(self._strings.registration_invitation)
-        logging.info(
-            f'Registration update took {1000*(time.time() - start_time):.3f} ms.')
+                reply = self._strings.registration_invitation
+        # Replies are sent outside of the lock, so that a slow Telegram never blocks the quiz.
+        if reply:
+            outbox.send(chat_id, reply)
 
     def start_registration(self):
         with self._lock:
             if not self._id:
                 raise TelegramQuizError('Can not start registration, because quiz is not started.')
             if self._question is not None:
-                logging.warning(f'Can not start registration for quiz "{self._id}", '
+                _logger.warning(f'Can not start registration for quiz "{self._id}", '
                                 f'because question {self._question} is already started.')
                 raise TelegramQuizError(
                     f'Can not start registration of quiz "{self._id}" when question {self._question} is running.')
             if self._registration_handler:
-                logging.warning(
+                _logger.warning(
                     f'Can not start registration for quiz "{self._id}", because registration is already started.')
                 raise TelegramQuizError(
                     f'Can not start registration of quiz "{self._id}" because registration is already started.')
@@ -143,15 +188,15 @@ class TelegramQuiz:
             self._updater.dispatcher.add_handler(
                 self._registration_handler, group=1)
             self._on_status_update()
-            logging.info(f'Registration for quiz "{self._id}" has started.')
+            _logger.info(f'Registration for quiz "{self._id}" has started.')
 
     def stop_registration(self):
         with self._lock:
             if not self._id:
-                logging.warning('Can not stop registration, because quiz is not started.')
+                _logger.warning('Can not stop registration, because quiz is not started.')
                 raise TelegramQuizError('Can not stop registration, because quiz is not started.')
             if not self._registration_handler:
-                logging.warning(
+                _logger.warning(
                     f'Can not stop registration for quiz "{self._id}", because registration is not started.')
                 raise TelegramQuizError(
                     f'Can not stop registration of quiz "{self._id}" because registration is not started.')
@@ -159,50 +204,46 @@ class TelegramQuiz:
                 self._registration_handler, group=1)
             self._registration_handler = None
             self._on_status_update()
-            logging.info(f'Registration for quiz "{self._id}" has ended.')
+            _logger.info(f'Registration for quiz "{self._id}" has ended.')
 
     def is_registration(self) -> bool:
         return self._registration_handler is not None
 
+    @_HANDLER_SECONDS.timed
     def _handle_answer_update(self, update: telegram.update.Update, context: telegram.ext.CallbackContext):
-        start_time = time.time()
-        with self._lock:
-            if self._question is None:
-                logging.warning('Answer update skipped as question is not started.')
-                return
-            chat_id = update.message.chat_id
-            answer = update.message.text
-            answer_time = update.message.date.timestamp()
+        received_time = time.time()
+        # The quiz lock is not taken, answers of all teams are written by the answer writer in batches.
+        state = self._question_state
+        if state is None:
+            _logger.warning('Answer update skipped as question is not started.')
+            return
+        chat_id = update.message.chat_id
+        answer = update.message.text
+        answer_time = update.message.date.timestamp()
 
-            answer = ' '.join(answer.split())[:50]
+        answer = ' '.join(answer.split())[:50]
 
-            teams = self._quiz_db.get_teams(quiz_id=self._id, team_id=chat_id)
-            if not teams:
-                return
-            team = teams[0]
-            logging.info(f'Answer received. '
-                         f'question: {self._question}, quiz_id: {self._id}, team_id: {team.id}, '
-                         f'team: "{team.name}", answer: "{answer}"')
+        teams = self._quiz_db.get_teams(quiz_id=state.quiz_id, team_id=chat_id)
+        if not teams:
+            return
+        team = teams[0]
+        _logger.info('Answer received. question: %s, quiz_id: %s, team_id: %s, team: "%s", answer: "%s"',
+                     state.question, state.quiz_id, team.id, team.name, answer)
 
-            update_id = self._quiz_db.update_answer(
-                quiz_id=self._id,
-                question=self._question,
-                team_id=chat_id,
-                answer=answer,
-                answer_time=answer_time,
-            )
+        answer_record = Answer(quiz_id=state.quiz_id, question=state.question, team_id=chat_id,
+                               answer=answer, timestamp=answer_time)
+        trace = self._answer_tracer.start(answer_record, received_time)
 
+        def _on_written(update_id: int):
+            self._answer_tracer.committed(trace, update_id)
             if update_id:
-                reply = self._strings.answer_confirmation.format(
-                    answer=answer, question=self._question)
-                self._updater.dispatcher.run_async(
-                    update.message.reply_text, reply)
+                state.outbox.send(chat_id, state.strings.answer_confirmation.format(
+                    answer=answer, question=state.question))
             else:
-                logging.warning(
-                    f'Outdated answer. quiz_id: "{self._id}", question: {self._question}, '
-                    'team_id: {chat_id}, answer: {answer}, time: {answer_time}')
-        logging.info(
-            f'Answer update took {1000*(time.time() - start_time):.3f} ms.')
+                _logger.warning('Outdated answer. quiz_id: "%s", question: %s, team_id: %s, answer: %s, time: %s',
+                                state.quiz_id, state.question, chat_id, answer, answer_time)
+
+        state.answer_writer.put(answer_record, on_done=_on_written)
 
     def start_question(self, question: int):
         with self._lock:
@@ -212,12 +253,12 @@ class TelegramQuiz:
                 raise TelegramQuizError(
                     f'Can not start question {question}, because quiz is not started.')
             if self._registration_handler:
-                logging.warning(f'Can not start question {question} for quiz "{self._id}", '
+                _logger.warning(f'Can not start question {question} for quiz "{self._id}", '
                                 f'because registration is started.')
                 raise TelegramQuizError(
                     'Can not start a question during registration.')
             if self._question is not None:
-                logging.warning(f'Trying to start question {question} for quiz "{self._id}", '
+                _logger.warning(f'Trying to start question {question} for quiz "{self._id}", '
                                 f'but question {self._question} is already started.')
                 raise TelegramQuizError(
                     f'Can not start question {question} because question {self._question} is already running.')
@@ -226,8 +267,10 @@ class TelegramQuiz:
             self._updater.dispatcher.add_handler(
                 self._question_handler, group=1)
             self._question = question
+            self._question_state = _QuestionState(quiz_id=self._id, question=question, strings=self._strings,
+                                                  answer_writer=self._answer_writer, outbox=self._outbox)
             self._on_status_update()
-            logging.info(
+            _logger.info(
                 f'Question {question} for quiz "{self._id}" has started.')
 
     def stop_question(self):
@@ -235,7 +278,7 @@ class TelegramQuiz:
             if not self._id:
                 raise TelegramQuizError('Can not stop a question, because quiz is not started.')
             if self._question is None:
-                logging.warning(
+                _logger.warning(
                     f'Can not stop a question, because question is not started. quiz_id: "{self._id}".')
                 raise TelegramQuizError(
                     'Can not stop a question, because question is not started.')
@@ -243,31 +286,32 @@ class TelegramQuiz:
                 self._question_handler, group=1)
             self._question = None
             self._question_handler = None
+            self._question_state = None
             self._on_status_update()
-            logging.info(
+            _logger.info(
                 f'Question {self} for quiz "{self._id}" has stopped.')
 
+    @_HANDLER_SECONDS.timed
     def _handle_log_update(self, update: telegram.update.Update, context):
-        start_time = time.time()
         update_id = update.update_id or 0
         message: telegram.message.Message = update.message
         if not message:
-            logging.warning(
-                f'Telegram update with no message. update_id: {update_id}.')
+            _logger.warning('Telegram update with no message. update_id: %s.', update_id)
             return
         timestamp = int(message.date.timestamp()) if message.date else 0
         chat_id = message.chat_id or 0
         text = message.text or ''
 
-        logging.info(
-            f'message: timestamp:{timestamp}, chat_id:{chat_id}, text: "{text}"')
-        self._quiz_db.insert_message(Message(
-            timestamp=timestamp, update_id=update_id, chat_id=chat_id, text=text))
-        logging.info(
-            f'Log update took {1000*(time.time() - start_time):.3f} ms.')
+        _logger.info('message: timestamp:%s, chat_id:%s, text: "%s"', timestamp, chat_id, text)
+        message = Message(timestamp=timestamp, update_id=update_id, chat_id=chat_id, text=text)
+        message_writer = self._message_writer
+        if message_writer:
+            message_writer.put(message)
+        else:
+            self._quiz_db.insert_message(message)
 
     def _handle_error(self, update, context):
-        logging.error('Update "%s" caused error "%s"', update, context.error)
+        _logger.error('Update "%s" caused error "%s"', update, context.error)
 
     def start(self, *, quiz_id: str, bot_api_token: str, language: str, updater_factory: Callable[[str], Updater] = None):
 
@@ -277,41 +321,115 @@ class TelegramQuiz:
         if not updater_factory:
             updater_factory = default_updater_factory
 
-        with self._lock:
+        with self._start_stop_lock:
             if self._id:
                 raise TelegramQuizError(f'Could not start quiz "{quiz_id}", '
                                         f'because quiz "{self._id}" is already running.')
-
-            self._updater = updater_factory(bot_api_token)
-            self._updater.dispatcher.add_error_handler(self._handle_error)
-            self._updater.dispatcher.add_handler(telegram.ext.MessageHandler(
-                telegram.ext.Filters.text, self._handle_log_update))
+            updater = updater_factory(bot_api_token)
+            # Setting the webhook is a call to Telegram, which must not be made under the quiz lock.
+            webhook_token = self._set_webhook(updater) if self._webhook_url else None
+            with self._lock:
+                self._start(quiz_id=quiz_id, language=language, updater=updater, webhook_token=webhook_token)
+
+    def _start(self, *, quiz_id: str, language: str, updater: Updater, webhook_token: Optional[str]):
+        self._updater = updater
+        self._webhook_token = webhook_token
+        self._message_writer = BatchedMessageWriter(quiz_db=self._quiz_db)
+        self._message_writer.start()
+        self._answer_writer = BatchedAnswerWriter(quiz_db=self._quiz_db)
+        self._answer_writer.start()
+        self._outbox = OutboundDispatcher(bot=self._updater.bot)
+        self._outbox.start()
+        self._updater.dispatcher.add_error_handler(self._handle_error)
+        self._updater.dispatcher.add_handler(telegram.ext.MessageHandler(
+            telegram.ext.Filters.text, self._handle_log_update))
+        self._quiz_db.set_active_quiz(quiz_id)
+        if self._webhook_token:
+            # Updates come from put_webhook_update(), only the dispatcher needs to run.
+            # Waits until the dispatcher runs, otherwise a quick stop() would not stop it.
+            dispatcher_ready = threading.Event()
+            self._dispatcher_thread = threading.Thread(
+                target=self._updater.dispatcher.start, kwargs={'ready': dispatcher_ready},
+                name='dispatcher', daemon=True)
+            self._dispatcher_thread.start()
+            while not dispatcher_ready.wait(timeout=0.1):
+                if not self._dispatcher_thread.is_alive():
+                    raise TelegramQuizError('Could not start the dispatcher.')
+        else:
             self._updater.start_polling()
-            self._id = quiz_id
-            self._language = language
-            self._strings = self._get_strings(self._strings_file, language)
-            self._on_status_update()
+        self._id = quiz_id
+        self._language = language
+        self._strings = self._get_strings(self._strings_file, language)
+        self._on_status_update()
 
     def stop(self):
+        with self._start_stop_lock:
+            self._stop()
+
+    def _stop(self):
         with self._lock:
             if not self._id:
                 raise TelegramQuizError('Can not stop the quiz as it is not started.')
+            updater = self._updater
             self._updater.stop()
             self._updater = None
+            webhook_token, self._webhook_token = self._webhook_token, None
+            if self._dispatcher_thread:
+                updater.dispatcher.stop()
+                self._dispatcher_thread.join()
+                self._dispatcher_thread = None
+            # The updater has stopped all handlers, so nothing is put into the writers after this.
+            self._message_writer.stop()
+            self._message_writer = None
+            # Confirmations of the last answers go to the outbox, so it is stopped after the writer.
+            self._answer_writer.stop()
+            self._answer_writer = None
+            outbox, self._outbox = self._outbox, None
+            self._quiz_db.set_active_quiz(None)
             self._id = None
             self._language = None
             self._strings = None
             self._registration_handler = None
             self._question_handler = None
+            self._question_state = None
+            self._results_total = 0
+            self._results_sent = 0
+            self._results_failed = 0
             self._on_status_update()
+        # Replies queued by the stopped handlers are still sent, but not under the lock.
+        outbox.stop()
+        if webhook_token:
+            try:
+                with TELEGRAM_CALL_SECONDS.time('delete_webhook'):
+                    updater.bot.delete_webhook()
+            except telegram.error.TelegramError:
+                _logger.exception('Could not delete webhook.')
+
+    def _set_webhook(self, updater: Updater) -> str:
+        """Returns the token in the path of the webhook."""
+        # The token keeps anybody who does not know the URL from posting fake updates.
+        token = secrets.token_urlsafe(32)
+        try:
+            with TELEGRAM_CALL_SECONDS.time('set_webhook'):
+                updater.bot.set_webhook(url=self._webhook_url.rstrip('/') + WEBHOOK_PATH_PREFIX + token)
+        except telegram.error.TelegramError as e:
+            _logger.exception('Could not set webhook.')
+            raise TelegramQuizError(f'Could not set webhook: {e}')
+        _logger.info(f'Webhook set to {self._webhook_url}.')
+        return token
+
+    def put_webhook_update(self, token: str, update: Dict[str, Any]) -> bool:
+        """Queues an update received by the webhook. Returns False if the token is not the one of the running quiz."""
+        updater = self._updater
+        webhook_token = self._webhook_token
+        if not updater or not webhook_token or not hmac.compare_digest(token.encode(), webhook_token.encode()):
+            return False
+        updater.update_queue.put(telegram.update.Update.de_json(update, updater.bot))
+        return True
 
     def _on_status_update(self):
         self._status_update_id += 1
-        for sub in self._subscribers:
-            try:
-                sub()
-            except Exception:
-                logging.exception('Subscriber raised an error.')
+        self._notifier.notify()
 
     @property
     def id(self) -> Optional[str]:
@@ -321,6 +439,10 @@ class TelegramQuiz:
     def status_update_id(self) -> int:
         return self._status_update_id
 
+    @property
+    def answer_tracer(self) -> AnswerTracer:
+        return self._answer_tracer
+
     @property
     def db(self) -> QuizDb:
         return self._quiz_db
@@ -334,8 +456,19 @@ class TelegramQuiz:
                 question=self._question,
                 registration=bool(self._registration_handler),
                 time=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                results_total=self._results_total,
+                results_sent=self._results_sent,
+                results_failed=self._results_failed,
             )
 
+    def _format_results(self, correct_answers: List[int]) -> str:
+        if not correct_answers:
+            return self._strings.send_results_zero_correct_answers
+        str_answers = ', '.join(
+            [str(a) for a in correct_answers])
+        return self._strings.send_results_correct_answers.format(
+            correctly_answered_questions=str_answers, total_score=len(correct_answers))
+
     def send_results(self, *, team_id: int) -> None:
         with self._lock:
             if not self._id:
@@ -351,16 +484,47 @@ class TelegramQuiz:
             correct_answers = sorted(
                 [a.question for a in answers if bool(a.points)])
 
-            if not correct_answers:
-                message = self._strings.send_results_zero_correct_answers
-            else:
-                str_answers = ', '.join(
-                    [str(a) for a in correct_answers])
-                message = self._strings.send_results_correct_answers.format(
-                    correctly_answered_questions=str_answers, total_score=len(correct_answers))
+            message = self._format_results(correct_answers)
 
         try:
-            self._updater.bot.send_message(team_id, message)
+            with TELEGRAM_CALL_SECONDS.time('send_message'):
+                self._updater.bot.send_message(team_id, message)
         except telegram.error.TelegramError:
-            logging.exception('Send results message error.')
+            _logger.exception('Send results message error.')
             raise TelegramQuizError('Could not send a message to the user.')
+
+    def send_all_results(self) -> int:
+        """Queues results for every team and returns the number of teams.
+
+        Messages are sent in the background within Telegram rate limits, the progress is reported in the status.
+        """
+        with self._lock:
+            if not self._id:
+                raise TelegramQuizError('Could not send results, because the quiz is not started.')
+            if self._results_sent + self._results_failed < self._results_total:
+                raise TelegramQuizError('Could not send results, because results are already being sent.')
+            teams = self._quiz_db.get_teams(quiz_id=self._id)
+            correct_questions = self._quiz_db.get_correct_questions(self._id)
+            messages = [(team.id, self._format_results(correct_questions.get(team.id, []))) for team in teams]
+            outbox = self._outbox
+            self._results_total = len(messages)
+            self._results_sent = 0
+            self._results_failed = 0
+            self._on_status_update()
+            _logger.info(f'Sending results of quiz "{self._id}" to {len(messages)} teams.')
+
+        def _on_done(sent: bool):
+            with self._lock:
+                # Results of a stopped quiz are still being sent, but no longer reported.
+                if self._outbox is not outbox:
+                    return
+                if sent:
+                    self._results_sent += 1
+                else:
+                    self._results_failed += 1
+                self._on_status_update()
+
+        for (team_id, message) in messages:
+            if not outbox.send(team_id, message, on_done=_on_done):
+                _on_done(False)
+        return len(messages)
@@ -5,9 +5,10 @@ import tempfile
 import telegram
 import telegram.ext
 import textwrap
+import threading
 import unittest
 import os
-from unittest.mock import patch, MagicMock
+from unittest.mock import call, patch, MagicMock
 
 STRINGS = textwrap.dedent('''
     {
@@ -33,6 +34,7 @@ class BaseTestCase(unittest.TestCase):
         self.quiz = TelegramQuiz(strings_file=self.strings_file, quiz_db=self.quiz_db)
 
     def tearDown(self):
+        self.quiz_db.close()
         self.test_dir.cleanup()
 
 
@@ -64,6 +66,7 @@ class StartTest(BaseTestCase):
         self.assertEqual('test', self.quiz._id)
         self.assertEqual('lang', self.quiz._language)
         self.assertEqual('Hello!', self.quiz._strings.registration_invitation)
+        self.assertEqual('test', self.quiz_db._cache.quiz_id)
         self.assertEqual(update_id+1, self.quiz.status_update_id)
         sub.assert_called_with()
 
@@ -104,6 +107,8 @@ class StopTest(StartedQuizBaseTestCase):
         self.assertIsNone(self.quiz._language)
         self.assertIsNone(self.quiz._strings)
         self.assertIsNone(self.quiz._updater)
+        self.assertIsNone(self.quiz._outbox)
+        self.assertIsNone(self.quiz_db._cache)
         self.assertEqual(update_id+1, self.quiz.status_update_id)
         sub.assert_called_with()
 
@@ -118,6 +123,14 @@ class StopTest(StartedQuizBaseTestCase):
         self.assertEqual(update_id, self.quiz.status_update_id)
         sub.assert_not_called()
 
+    def test_sends_queued_replies(self):
+        send_message = self.quiz._updater.bot.send_message = MagicMock()
+        self.quiz._outbox.send(5001, 'Bye!')
+
+        self.quiz.stop()
+
+        send_message.assert_called_once_with(5001, 'Bye!')
+
     def test_stops_registration(self):
         self.quiz.stop()
         self.assertIsNone(self.quiz._registration_handler)
@@ -243,6 +256,33 @@ class HandleLogUpdateTest(BaseTestCase):
         ], self.quiz_db.select_messages())
 
 
+class HandleLogUpdateStartedQuizTest(StartedQuizBaseTestCase):
+    def _update(self, update_id: int, text: str) -> telegram.update.Update:
+        return telegram.update.Update(update_id, message=telegram.message.Message(
+            2001, None,
+            datetime.fromtimestamp(1001001001),
+            chat=telegram.Chat(5001, 'private'), text=text))
+
+    def test_writes_messages_in_background(self):
+        self.quiz._handle_log_update(self._update(1001, 'Apple'), context=None)
+        self.quiz._handle_log_update(self._update(1002, 'Banana'), context=None)
+        self.quiz._message_writer.flush()
+
+        self.assertListEqual([
+            Message(timestamp=1001001001, update_id=1001, chat_id=5001, text='Apple'),
+            Message(timestamp=1001001001, update_id=1002, chat_id=5001, text='Banana'),
+        ], self.quiz_db.select_messages())
+
+    def test_stop_flushes_messages(self):
+        self.quiz._handle_log_update(self._update(1001, 'Apple'), context=None)
+        self.quiz.stop()
+
+        self.assertIsNone(self.quiz._message_writer)
+        self.assertListEqual([
+            Message(timestamp=1001001001, update_id=1001, chat_id=5001, text='Apple'),
+        ], self.quiz_db.select_messages())
+
+
 class HandleRegistrationUpdateTest(StartedQuizBaseTestCase):
 
     @patch('telegram.ext.CallbackContext')
@@ -251,7 +291,7 @@ class HandleRegistrationUpdateTest(StartedQuizBaseTestCase):
             2001, None,
             datetime.fromtimestamp(1001001001),
             chat=telegram.Chat(5001, 'private'), text='/start'))
-        update.message.reply_text = MagicMock()
+        self.quiz._updater.bot.send_message = MagicMock()
         context = mock_callback_context()
         context.chat_data = {'typing_name': False}
 
@@ -260,7 +300,8 @@ class HandleRegistrationUpdateTest(StartedQuizBaseTestCase):
 
         self.assertListEqual([], self.quiz_db.get_teams(quiz_id='test'))
         self.assertEqual(True, context.chat_data['typing_name'])
-        update.message.reply_text.assert_called_with('Hello!')
+        self.quiz._outbox.flush()
+        self.quiz._updater.bot.send_message.assert_called_with(5001, 'Hello!')
 
     @patch('telegram.ext.CallbackContext')
     def test_registers_team(self, mock_callback_context):
@@ -268,7 +309,7 @@ class HandleRegistrationUpdateTest(StartedQuizBaseTestCase):
             2001, None,
             datetime.fromtimestamp(123),
             chat=telegram.Chat(5001, 'private'), text='\n  Unicode   \n    \n\n Юнікод\n 😎  \n \n'))
-        update.message.reply_text = MagicMock()
+        self.quiz._updater.bot.send_message = MagicMock()
         context = mock_callback_context()
         context.chat_data = {'typing_name': True}
 
@@ -280,8 +321,8 @@ class HandleRegistrationUpdateTest(StartedQuizBaseTestCase):
                  timestamp=123)
         ], self.quiz_db.get_teams(quiz_id='test'))
         self.assertNotIn('typing_name', context.chat_data)
-        update.message.reply_text.assert_called_with(
-            'Good luck, Unicode Юнікод 😎!')
+        self.quiz._outbox.flush()
+        self.quiz._updater.bot.send_message.assert_called_with(5001, 'Good luck, Unicode Юнікод 😎!')
 
     @patch('telegram.ext.CallbackContext')
     def test_updates_team(self, mock_callback_context):
@@ -291,7 +332,7 @@ class HandleRegistrationUpdateTest(StartedQuizBaseTestCase):
             2001, None,
             datetime.fromtimestamp(123),
             chat=telegram.Chat(5001, 'private'), text='Banana'))
-        update.message.reply_text = MagicMock()
+        self.quiz._updater.bot.send_message = MagicMock()
         context = mock_callback_context()
         context.chat_data = {'typing_name': True}
 
@@ -303,7 +344,8 @@ class HandleRegistrationUpdateTest(StartedQuizBaseTestCase):
                  timestamp=123)
         ], self.quiz_db.get_teams(quiz_id='test'))
         self.assertNotIn('typing_name', context.chat_data)
-        update.message.reply_text.assert_called_with('Good luck, Banana!')
+        self.quiz._outbox.flush()
+        self.quiz._updater.bot.send_message.assert_called_with(5001, 'Good luck, Banana!')
 
     @patch('telegram.ext.CallbackContext')
     def test_outdated_registration(self, mock_callback_context):
@@ -313,7 +355,7 @@ class HandleRegistrationUpdateTest(StartedQuizBaseTestCase):
             2001, None,
             datetime.fromtimestamp(123),
             chat=telegram.Chat(5001, 'private'), text='Banana'))
-        update.message.reply_text = MagicMock()
+        self.quiz._updater.bot.send_message = MagicMock()
         context = mock_callback_context()
         context.chat_data = {'typing_name': True}
 
@@ -325,7 +367,8 @@ class HandleRegistrationUpdateTest(StartedQuizBaseTestCase):
                  timestamp=124)
         ], self.quiz_db.get_teams(quiz_id='test'))
         self.assertNotIn('typing_name', context.chat_data)
-        update.message.reply_text.assert_not_called()
+        self.quiz._outbox.flush()
+        self.quiz._updater.bot.send_message.assert_not_called()
 
     def test_registration_not_started(self):
         self.quiz._handle_registration_update(None, None)
@@ -342,20 +385,41 @@ class HandleAnswerUpdateTest(StartedQuizBaseTestCase):
             2001, None,
             datetime.fromtimestamp(4),
             chat=telegram.Chat(5001, 'private'), text=' \nUnicode\n Юнікод  😎   \n\n  '))
-        update.message.reply_text = MagicMock()
-        self.quiz._updater.dispatcher.run_async = MagicMock()
+        self.quiz._updater.bot.send_message = MagicMock()
 
         self.quiz.start_question(question=1)
         self.quiz._handle_answer_update(update, context=None)
         self.quiz.stop_question()
+        self.quiz._answer_writer.flush()
 
         self.assertListEqual([
             Answer(quiz_id='test', question=1, team_id=5001,
                    answer='Unicode Юнікод 😎', timestamp=4),
         ], self.quiz_db.get_answers(quiz_id='test'))
 
-        self.quiz._updater.dispatcher.run_async.assert_called_with(
-            update.message.reply_text, 'Confirmed #1: Unicode Юнікод 😎.')
+        self.quiz._outbox.flush()
+        self.quiz._updater.bot.send_message.assert_called_with(5001, 'Confirmed #1: Unicode Юнікод 😎.')
+
+    @patch('telegram.ext.CallbackContext')
+    def test_traces_answer(self, mock_callback_context):
+        self.quiz_db.update_team(
+            quiz_id='test', team_id=5001, name='Liverpool', registration_time=1)
+
+        update = telegram.update.Update(1001, message=telegram.message.Message(
+            2001, None,
+            datetime.fromtimestamp(4),
+            chat=telegram.Chat(5001, 'private'), text='Apple'))
+        self.quiz._updater.bot.send_message = MagicMock()
+
+        self.quiz.start_question(question=1)
+        self.quiz._handle_answer_update(update, context=None)
+        self.quiz.stop_question()
+        self.quiz._answer_writer.flush()
+
+        (trace,) = self.quiz.answer_tracer.get_traces()
+        self.assertEqual(('test', 1, 5001, 4), (trace.quiz_id, trace.question, trace.team_id, trace.sent))
+        self.assertEqual(self.quiz_db.get_answers(quiz_id='test')[0].update_id, trace.update_id)
+        self.assertLessEqual(trace.received, trace.committed)
 
     @patch('telegram.ext.CallbackContext')
     def test_updates_answer(self, mock_callback_context):
@@ -368,12 +432,12 @@ class HandleAnswerUpdateTest(StartedQuizBaseTestCase):
             2001, None,
             datetime.fromtimestamp(4),
             chat=telegram.Chat(5001, 'private'), text='Banana'))
-        update.message.reply_text = MagicMock()
-        self.quiz._updater.dispatcher.run_async = MagicMock()
+        self.quiz._updater.bot.send_message = MagicMock()
 
         self.quiz.start_question(question=4)
         self.quiz._handle_answer_update(update, context=None)
         self.quiz.stop_question()
+        self.quiz._answer_writer.flush()
 
         expected_answers = [
             Answer(quiz_id='test', question=4, team_id=5001,
@@ -382,8 +446,8 @@ class HandleAnswerUpdateTest(StartedQuizBaseTestCase):
 
         self.assertListEqual(
             expected_answers, self.quiz_db.get_answers(quiz_id='test'))
-        self.quiz._updater.dispatcher.run_async.assert_called_with(
-            update.message.reply_text, 'Confirmed #4: Banana.')
+        self.quiz._outbox.flush()
+        self.quiz._updater.bot.send_message.assert_called_with(5001, 'Confirmed #4: Banana.')
 
     @patch('telegram.ext.CallbackContext')
     def test_non_registered_team(self, mock_callback_context):
@@ -394,14 +458,16 @@ class HandleAnswerUpdateTest(StartedQuizBaseTestCase):
             2001, None,
             datetime.fromtimestamp(4),
             chat=telegram.Chat(5002, 'private'), text='Banana'))
-        update.message.reply_text = MagicMock()
+        self.quiz._updater.bot.send_message = MagicMock()
 
         self.quiz.start_question(question=1)
         self.quiz._handle_answer_update(update, context=None)
         self.quiz.stop_question()
+        self.quiz._answer_writer.flush()
 
         self.assertListEqual([], self.quiz_db.get_answers(quiz_id='test'))
-        update.message.reply_text.assert_not_called()
+        self.quiz._outbox.flush()
+        self.quiz._updater.bot.send_message.assert_not_called()
 
     @patch('telegram.ext.CallbackContext')
     def test_outdated_answer(self, mock_callback_context):
@@ -414,17 +480,85 @@ class HandleAnswerUpdateTest(StartedQuizBaseTestCase):
             2001, None,
             datetime.fromtimestamp(4),
             chat=telegram.Chat(5001, 'private'), text='Apple'))
-        update.message.reply_text = MagicMock()
+        self.quiz._updater.bot.send_message = MagicMock()
 
         self.quiz.start_question(question=1)
         self.quiz._handle_answer_update(update, context=None)
         self.quiz.stop_question()
+        self.quiz._answer_writer.flush()
 
         self.assertListEqual([
             Answer(quiz_id='test', question=1,
                    team_id=5001, answer='Banana', timestamp=5),
         ], self.quiz_db.get_answers(quiz_id='test'))
-        update.message.reply_text.assert_not_called()
+        self.quiz._outbox.flush()
+        self.quiz._updater.bot.send_message.assert_not_called()
+
+    @patch('telegram.ext.CallbackContext')
+    def test_reply_does_not_block_quiz(self, mock_callback_context):
+        self.quiz_db.update_team(
+            quiz_id='test', team_id=5001, name='Liverpool', registration_time=1)
+        update = telegram.update.Update(1001, message=telegram.message.Message(
+            2001, None,
+            datetime.fromtimestamp(4),
+            chat=telegram.Chat(5001, 'private'), text='Apple'))
+        sending = threading.Event()
+        telegram_responds = threading.Event()
+
+        def _slow_send_message(*args):
+            sending.set()
+            telegram_responds.wait()
+
+        self.quiz._updater.bot.send_message = MagicMock(side_effect=_slow_send_message)
+
+        self.quiz.start_question(question=1)
+        self.quiz._handle_answer_update(update, context=None)
+        self.assertTrue(sending.wait(timeout=5))
+        # The quiz lock is free while Telegram has not responded yet.
+        self.quiz.stop_question()
+        telegram_responds.set()
+        self.quiz._outbox.flush()
+
+        self.quiz._updater.bot.send_message.assert_called_with(5001, 'Confirmed #1: Apple.')
+
+    @patch('telegram.ext.CallbackContext')
+    def test_does_not_take_quiz_lock(self, mock_callback_context):
+        self.quiz_db.update_team(
+            quiz_id='test', team_id=5001, name='Liverpool', registration_time=1)
+        update = telegram.update.Update(1001, message=telegram.message.Message(
+            2001, None,
+            datetime.fromtimestamp(4),
+            chat=telegram.Chat(5001, 'private'), text='Apple'))
+        self.quiz._updater.bot.send_message = MagicMock()
+        self.quiz.start_question(question=1)
+
+        with self.quiz._lock:
+            self.quiz._handle_answer_update(update, context=None)
+            self.quiz._answer_writer.flush()
+
+        self.assertListEqual([
+            Answer(quiz_id='test', question=1, team_id=5001, answer='Apple', timestamp=4),
+        ], self.quiz_db.get_answers(quiz_id='test'))
+        self.quiz._outbox.flush()
+        self.quiz._updater.bot.send_message.assert_called_with(5001, 'Confirmed #1: Apple.')
+
+    @patch('telegram.ext.CallbackContext')
+    def test_stop_writes_pending_answers(self, mock_callback_context):
+        self.quiz_db.update_team(
+            quiz_id='test', team_id=5001, name='Liverpool', registration_time=1)
+        update = telegram.update.Update(1001, message=telegram.message.Message(
+            2001, None,
+            datetime.fromtimestamp(4),
+            chat=telegram.Chat(5001, 'private'), text='Apple'))
+        send_message = self.quiz._updater.bot.send_message = MagicMock()
+        self.quiz.start_question(question=1)
+
+        self.quiz._handle_answer_update(update, context=None)
+        self.quiz.stop()
+
+        self.assertIsNone(self.quiz._answer_writer)
+        self.assertEqual(1, len(self.quiz_db.get_answers(quiz_id='test')))
+        send_message.assert_called_with(5001, 'Confirmed #1: Apple.')
 
     def test_question_not_started(self):
         self.quiz._handle_answer_update(update=None, context=None)
@@ -557,5 +691,168 @@ class SendResultsTest(StartedQuizBaseTestCase):
         self.assertRaisesRegex(TelegramQuizError, 'not started', self.quiz.send_results, team_id=5001)
 
 
+class SendAllResultsTest(StartedQuizBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        for (team_id, name) in ((5001, 'Liverpool'), (5002, 'Tottenham'), (5003, 'Chelsea')):
+            self.quiz_db.update_team(quiz_id='test', team_id=team_id, name=name, registration_time=1)
+        for (question, team_id, points) in ((1, 5001, 1), (2, 5001, 1), (1, 5002, 0), (2, 5002, 1)):
+            self.quiz_db.update_answer(quiz_id='test', question=question, team_id=team_id, answer='Apple',
+                                       answer_time=2)
+            self.quiz_db.set_answer_points(quiz_id='test', question=question, team_id=team_id, points=points)
+        self.quiz._updater.bot.send_message = MagicMock()
+
+    def test_sends_results_to_all_teams(self):
+        self.assertEqual(3, self.quiz.send_all_results())
+        self.quiz._outbox.flush()
+
+        self.assertCountEqual([
+            call(5001, 'Correct answers: 1, 2. Total: 2.'),
+            call(5002, 'Correct answers: 2. Total: 1.'),
+            call(5003, 'Zero answers.'),
+        ], self.quiz._updater.bot.send_message.call_args_list)
+
+    def test_reads_answers_in_one_query(self):
+        self.quiz_db.get_answers = MagicMock(wraps=self.quiz_db.get_answers)
+        self.quiz_db.get_correct_questions = MagicMock(wraps=self.quiz_db.get_correct_questions)
+
+        self.quiz.send_all_results()
+        self.quiz._outbox.flush()
+
+        self.quiz_db.get_answers.assert_not_called()
+        self.quiz_db.get_correct_questions.assert_called_once_with('test')
+
+    def test_reports_progress(self):
+        self.quiz._updater.bot.send_message.side_effect = [None, telegram.error.Unauthorized('Blocked'), None]
+        sub = MagicMock()
+        self.quiz.add_updates_subscriber(sub)
+        update_id = self.quiz.status_update_id
+
+        self.quiz.send_all_results()
+        self.quiz._outbox.flush()
+
+        status = self.quiz.get_status()
+        self.assertEqual(3, status.results_total)
+        self.assertEqual(2, status.results_sent)
+        self.assertEqual(1, status.results_failed)
+        # Once when sending starts and once per team.
+        self.assertEqual(update_id + 4, self.quiz.status_update_id)
+        self.assertEqual(4, sub.call_count)
+
+    def test_raises_when_already_sending(self):
+        sending = threading.Event()
+        telegram_responds = threading.Event()
+
+        def _slow_send_message(*args):
+            sending.set()
+            telegram_responds.wait()
+
+        self.quiz._updater.bot.send_message.side_effect = _slow_send_message
+        self.quiz.send_all_results()
+        self.assertTrue(sending.wait(timeout=5))
+
+        self.assertRaisesRegex(TelegramQuizError, 'already being sent', self.quiz.send_all_results)
+        telegram_responds.set()
+        self.quiz._outbox.flush()
+        self.assertEqual(3, self.quiz.send_all_results())
+
+    def test_raises_when_quiz_not_started(self):
+        self.quiz.stop()
+        self.assertRaisesRegex(TelegramQuizError, 'not started', self.quiz.send_all_results)
+
+
+def _webhook_updater_factory(bot_api_token: str) -> telegram.ext.Updater:
+    updater = telegram.ext.Updater(bot_api_token, use_context=True)
+    updater.start_polling = MagicMock()
+    updater.bot.set_webhook = MagicMock()
+    updater.bot.delete_webhook = MagicMock()
+    # The dispatcher asks for the bot id, which would call Telegram otherwise.
+    updater.bot.bot = telegram.User(123, 'Quiz', is_bot=True)
+    return updater
+
+
+class WebhookTest(BaseTestCase):
+    UPDATE = {
+        'update_id': 1001,
+        'message': {
+            'message_id': 2001,
+            'date': 1001001001,
+            'chat': {'id': 5001, 'type': 'private'},
+            'text': 'Apple',
+        },
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.quiz = TelegramQuiz(strings_file=self.strings_file, quiz_db=self.quiz_db,
+                                 webhook_url='https://quiz.example.com/')
+
+    def _start(self, updater_factory=_webhook_updater_factory):
+        self.quiz.start(quiz_id='test', bot_api_token='123:TOKEN', language='lang', updater_factory=updater_factory)
+
+    def test_sets_webhook(self):
+        self._start()
+
+        url = f'https://quiz.example.com/telegram/{self.quiz._webhook_token}'
+        self.quiz._updater.bot.set_webhook.assert_called_once_with(url=url)
+        self.quiz._updater.start_polling.assert_not_called()
+        self.assertTrue(self.quiz._dispatcher_thread.is_alive())
+        self.quiz.stop()
+
+    def test_sets_webhook_without_quiz_lock(self):
+        lock_held = []
+
+        def _checking_updater_factory(bot_api_token: str) -> telegram.ext.Updater:
+            updater = _webhook_updater_factory(bot_api_token)
+            updater.bot.set_webhook.side_effect = lambda url: lock_held.append(self.quiz._lock.locked())
+            return updater
+
+        self._start(_checking_updater_factory)
+
+        self.assertListEqual([False], lock_held)
+        self.quiz.stop()
+
+    def test_dispatches_updates(self):
+        self._start()
+
+        self.assertTrue(self.quiz.put_webhook_update(self.quiz._webhook_token, self.UPDATE))
+        self.quiz._updater.update_queue.join()
+        self.quiz._message_writer.flush()
+
+        self.assertListEqual([Message(timestamp=1001001001, update_id=1001, chat_id=5001, text='Apple')],
+                             self.quiz_db.select_messages())
+        self.quiz.stop()
+
+    def test_rejects_wrong_token(self):
+        self._start()
+
+        self.assertFalse(self.quiz.put_webhook_update('wrong', self.UPDATE))
+        self.assertFalse(self.quiz.put_webhook_update('Юнікод', self.UPDATE))
+        self.assertTrue(self.quiz._updater.update_queue.empty())
+        self.quiz.stop()
+
+    def test_stop_deletes_webhook(self):
+        self._start()
+        updater = self.quiz._updater
+        token = self.quiz._webhook_token
+
+        self.quiz.stop()
+
+        updater.bot.delete_webhook.assert_called_once_with()
+        self.assertIsNone(self.quiz._dispatcher_thread)
+        self.assertFalse(updater.dispatcher.running)
+        self.assertFalse(self.quiz.put_webhook_update(token, self.UPDATE))
+
+    def test_set_webhook_fails(self):
+        def _failing_updater_factory(bot_api_token: str) -> telegram.ext.Updater:
+            updater = _webhook_updater_factory(bot_api_token)
+            updater.bot.set_webhook.side_effect = telegram.error.NetworkError('Unreachable')
+            return updater
+
+        self.assertRaisesRegex(TelegramQuizError, 'Could not set webhook', self._start, _failing_updater_factory)
+        self.assertIsNone(self.quiz.id)
+        self.assertIsNone(self.quiz._message_writer)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+from typing import Callable, Optional, Set
+
+
+_logger = logging.getLogger(__name__)
+
+
+class UpdateNotifier:
+    """Calls subscribers when something has changed, once per burst of changes.
+
+    Without a debounce window subscribers are called by notify() itself. With a window of debounce seconds
+    the first notify() schedules a call from a background thread after the window, and every notify() made
+    meanwhile is collapsed into that call. The window is not extended by later changes, so subscribers
+    learn about a change at most debounce seconds after it. Every call of the subscribers starts a new generation.
+    """
+
+    def __init__(self, *, debounce: float = 0.0, name: str = 'UpdateNotifier'):
+        self._debounce = debounce
+        self._name = name
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)
+        self._subscribers: Set[Callable[[], None]] = set()
+        self._generation = 0
+        # Changes are counted, so that flush() knows which of them have been delivered.
+        self._changes = 0
+        self._delivered_changes = 0
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def add_subscriber(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            self._subscribers.add(callback)
+
+    def remove_subscriber(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            self._subscribers.remove(callback)
+
+    def notify(self) -> None:
+        if self._debounce <= 0:
+            with self._lock:
+                self._generation += 1
+            self._call_subscribers()
+            return
+        with self._lock:
+            if self._closed:
+                return
+            self._changes += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def flush(self) -> None:
+        """Waits until subscribers have been called for every change notified before."""
+        with self._lock:
+            changes = self._changes
+            while self._thread and self._delivered_changes < changes:
+                self._condition.wait()
+
+    def close(self) -> None:
+        """Calls subscribers for the pending changes and stops the background thread."""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+            self._condition.notify_all()
+        if thread:
+            thread.join()
+
+    def _call_subscribers(self) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            try:
+                sub()
+            except Exception:
+                _logger.exception('Subscriber raised an error.')
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                while self._delivered_changes == self._changes and not self._closed:
+                    self._condition.wait()
+                if self._delivered_changes == self._changes:
+                    return
+            # Changes notified during the window are delivered together with the first one.
+            time.sleep(self._debounce)
+            with self._lock:
+                changes = self._changes
+                self._generation += 1
+            self._call_subscribers()
+            with self._lock:
+                self._delivered_changes = changes
+                self._condition.notify_all()
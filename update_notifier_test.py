@@ -0,0 +1,110 @@
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock
+from update_notifier import UpdateNotifier
+
+
+class UpdateNotifierTest(unittest.TestCase):
+    def test_notifies_synchronously_without_debounce(self):
+        notifier = UpdateNotifier()
+        sub = MagicMock()
+        notifier.add_subscriber(sub)
+
+        notifier.notify()
+        notifier.notify()
+
+        self.assertEqual(2, sub.call_count)
+        self.assertEqual(2, notifier.generation)
+
+    def test_collapses_burst(self):
+        notifier = UpdateNotifier(debounce=0.05)
+        sub = MagicMock()
+        notifier.add_subscriber(sub)
+
+        for _ in range(60):
+            notifier.notify()
+        notifier.flush()
+
+        sub.assert_called_once_with()
+        self.assertEqual(1, notifier.generation)
+        notifier.close()
+
+    def test_notifies_off_the_notifying_thread(self):
+        notifier = UpdateNotifier(debounce=0.001)
+        threads = []
+        notifier.add_subscriber(lambda: threads.append(threading.current_thread()))
+
+        notifier.notify()
+        notifier.flush()
+
+        self.assertEqual(1, len(threads))
+        self.assertIsNot(threading.current_thread(), threads[0])
+        notifier.close()
+
+    def test_notifies_changes_after_window(self):
+        notifier = UpdateNotifier(debounce=0.001)
+        sub = MagicMock()
+        notifier.add_subscriber(sub)
+
+        notifier.notify()
+        notifier.flush()
+        notifier.notify()
+        notifier.flush()
+
+        self.assertEqual(2, sub.call_count)
+        self.assertEqual(2, notifier.generation)
+        notifier.close()
+
+    def test_window_is_not_extended(self):
+        notifier = UpdateNotifier(debounce=0.1)
+        notified = threading.Event()
+        notifier.add_subscriber(notified.set)
+
+        start_time = time.monotonic()
+        notifier.notify()
+        while not notified.is_set():
+            notifier.notify()
+            time.sleep(0.01)
+
+        self.assertLess(time.monotonic() - start_time, 1.0)
+        notifier.close()
+
+    def test_close_delivers_pending_changes(self):
+        notifier = UpdateNotifier(debounce=0.05)
+        sub = MagicMock()
+        notifier.add_subscriber(sub)
+
+        notifier.notify()
+        notifier.close()
+
+        sub.assert_called_once_with()
+        notifier.notify()
+        notifier.flush()
+        sub.assert_called_once_with()
+
+    def test_survives_subscriber_errors(self):
+        notifier = UpdateNotifier(debounce=0.001)
+        sub = MagicMock()
+        notifier.add_subscriber(MagicMock(side_effect=Exception('Boom')))
+        notifier.add_subscriber(sub)
+
+        notifier.notify()
+        notifier.flush()
+
+        sub.assert_called_once_with()
+        notifier.close()
+
+    def test_removes_subscriber(self):
+        notifier = UpdateNotifier()
+        sub = MagicMock()
+        notifier.add_subscriber(sub)
+        notifier.remove_subscriber(sub)
+
+        notifier.notify()
+
+        sub.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()